@@ -0,0 +1,196 @@
+"""
+Measure how much each sampler configuration slows the profiled program down,
+and how accurately it attributes time to lines.
+
+Usage: python benchmarks/sampler_fidelity.py [--rate HZ] [--results PATH] [SCRIPT]
+
+By default this profiles ``scripts_for_tests/known_costs.py``, whose lines
+have known relative costs, marked with "# cost: N" comments.  For each
+configuration it reports:
+
+* Slowdown: the profiled program's run time, divided by its run time without
+  the profiler.
+* The achieved sample rate, and the percentage of bad samples.
+* Attribution error: how far the measured split of time between the marked
+  loops is from the expected split, in percentage points (half the sum of the
+  absolute differences, so 0 is perfect and 100 is completely wrong).
+
+Each run's results are also appended to ``--results`` as one JSON object per
+configuration, with the date and git commit, so configurations and sampler
+changes can be compared over time.  Requires profila's gdb, see ``python -m
+profila setup``.
+"""
+
+from argparse import ArgumentParser
+import asyncio
+from dataclasses import asdict, replace
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+
+from profila._gdb import (
+    EMBEDDED,
+    GDB_PATH,
+    SAMPLER_MODES,
+    UNWIND_STRATEGIES,
+    SamplerOptions,
+    run_subprocess,
+)
+from profila._stats import FinalStats
+from profila.__main__ import get_stats
+
+COST_MARKER = re.compile(r"#\s*cost:\s*([0-9.]+)")
+
+
+def expected_costs(script: str) -> dict[tuple[int, ...], float]:
+    """
+    Map the lines of each marked loop, the loop header and the marked body
+    line, to its expected share of the time.
+    """
+    costs = {}
+    with open(script) as f:
+        for line_number, line in enumerate(f, start=1):
+            match = COST_MARKER.search(line)
+            if match:
+                costs[(line_number - 1, line_number)] = float(match.group(1))
+    total = sum(costs.values())
+    return {lines: cost / total * 100 for (lines, cost) in costs.items()}
+
+
+def attribution_error(
+    stats: FinalStats, script: str, expected: dict[tuple[int, ...], float]
+) -> float:
+    """
+    How far the measured split between the marked loops is from the expected
+    split, in percentage points.
+    """
+    line_percents = stats.numba_samples.get(os.path.abspath(script), {})
+    measured = {
+        lines: sum(line_percents.get(line, 0.0) for line in lines) for lines in expected
+    }
+    total = sum(measured.values())
+    if not total:
+        return 100.0
+    return round(
+        sum(abs(measured[lines] / total * 100 - expected[lines]) for lines in expected)
+        / 2,
+        1,
+    )
+
+
+def elapsed(result_path: str) -> float:
+    with open(result_path) as f:
+        result: float = json.load(f)["elapsed"]
+    return result
+
+
+def baseline(script: str, tempdir: str) -> float:
+    """
+    Run the script without the profiler, returning its self-reported run time.
+    """
+    result_path = os.path.join(tempdir, "baseline.json")
+    # Debug info can change code generation, so keep it the same as when
+    # profiling:
+    env = {**os.environ, "NUMBA_DEBUGINFO": "1"}
+    subprocess.run([sys.executable, script, result_path], env=env, check=True)
+    return elapsed(result_path)
+
+
+async def profile(script: str, options: SamplerOptions, result_path: str) -> FinalStats:
+    process = await run_subprocess([script, result_path])
+    return (await get_stats(process, options)).finalize()
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, encoding="utf-8"
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--rate", type=float, default=100.0)
+    parser.add_argument(
+        "--results", default="benchmarks/results/sampler_fidelity.jsonl"
+    )
+    parser.add_argument("script", nargs="?", default="scripts_for_tests/known_costs.py")
+    args = parser.parse_args()
+    # Check before spending time on the baseline run:
+    if not os.path.exists(GDB_PATH):
+        raise SystemExit(
+            "Profila's custom gdb not found, make sure it is installed by running "
+            "'python -m profila setup'."
+        )
+
+    expected = expected_costs(args.script)
+    base = SamplerOptions(interval=1 / args.rate)
+    configurations = [
+        replace(base, mode=mode, unwind=unwind)
+        for mode in SAMPLER_MODES
+        for unwind in UNWIND_STRATEGIES
+    ] + [
+        replace(base, mode=EMBEDDED, unwind=unwind, defer_symbols=True)
+        for unwind in UNWIND_STRATEGIES
+    ]
+
+    run = {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "script": args.script,
+    }
+    results = []
+    with TemporaryDirectory() as tempdir:
+        baseline_elapsed = baseline(args.script, tempdir)
+        for options in configurations:
+            result_path = os.path.join(tempdir, "profiled.json")
+            stats = asyncio.run(profile(args.script, options, result_path))
+            results.append(
+                {
+                    **run,
+                    "options": asdict(options),
+                    "slowdown": round(elapsed(result_path) / baseline_elapsed, 3),
+                    "requested_rate": stats.requested_rate,
+                    "achieved_rate": stats.achieved_rate,
+                    "percent_bad_samples": stats.percent_bad_samples,
+                    "mean_stop_ms": stats.mean_stop_ms,
+                    "attribution_error": attribution_error(
+                        stats, args.script, expected
+                    ),
+                }
+            )
+
+    os.makedirs(os.path.dirname(args.results) or ".", exist_ok=True)
+    with open(args.results, "a") as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+
+    print(
+        "| Sampler | Unwind | Slowdown | Rate (Hz) | Bad | Stop (ms) "
+        "| Attribution error |"
+    )
+    print(
+        "|:--------|:-------|---------:|----------:|----:|----------:"
+        "|------------------:|"
+    )
+    for result in results:
+        options = result["options"]
+        mode = options["mode"] + (" (deferred)" if options["defer_symbols"] else "")
+        print(
+            f"| {mode} | {options['unwind']} | {result['slowdown']}x "
+            f"| {result['achieved_rate']} | {result['percent_bad_samples']}% "
+            f"| {result['mean_stop_ms']} | {result['attribution_error']} |"
+        )
+
+
+if __name__ == "__main__":
+    main()
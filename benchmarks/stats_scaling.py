@@ -0,0 +1,111 @@
+"""
+Measure how ``Stats`` scales with the number of samples, by adding
+increasing numbers of samples and reporting, for each, the time per sample,
+the time to finalize and to merge into an empty ``Stats``, and the process'
+peak resident memory so far.
+
+Usage: python benchmarks/stats_scaling.py [--samples N ...] [--memory]
+
+The default is 10^6, 10^7 and 10^8 samples, the scale of continuous
+profiling; at a few microseconds per sample the largest takes several
+minutes.  ``--memory`` also reports peak memory allocated by Python, at the
+cost of much slower adds.
+"""
+
+from argparse import ArgumentParser
+import random
+import resource
+import time
+import tracemalloc
+
+from profila._gdb import Frame, Sample
+from profila._stats import Stats
+
+
+def make_stacks(count: int) -> list[list[Frame]]:
+    """
+    Pregenerate a variety of realistic-ish stacks.
+    """
+    rng = random.Random(0)
+    stacks = []
+    for _ in range(count):
+        stack = [
+            Frame(file="/app/kernels.py", line=rng.randint(1, 2000), func="kernel")
+            for _ in range(rng.randint(1, 4))
+        ]
+        stack.append(Frame(file="??", line=0, func="main", library="/usr/bin/python3"))
+        stacks.append(stack)
+    return stacks
+
+
+def measure(
+    samples: list[Sample], sample_count: int, threads: int, memory: bool
+) -> None:
+    """
+    Add ``sample_count`` thread samples to a new ``Stats`` and print a row of
+    results.
+    """
+    interruptions = sample_count // threads
+    if memory:
+        tracemalloc.start()
+    stats = Stats(interval=0.01)
+    start = time.perf_counter()
+    for i in range(interruptions):
+        stats.add_all_threads(samples[i % len(samples)])
+    add_time = time.perf_counter() - start
+    start = time.perf_counter()
+    stats.finalize()
+    finalize_time = time.perf_counter() - start
+    start = time.perf_counter()
+    Stats().merge(stats)
+    merge_time = time.perf_counter() - start
+    # Kilobytes on Linux:
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    row = (
+        f"{stats.total_samples():>12,} "
+        f"{add_time / stats.total_samples() * 1e6:>13.2f} "
+        f"{finalize_time * 1000:>12.1f} "
+        f"{merge_time * 1000:>9.1f} "
+        f"{max_rss / 1024:>12.1f}"
+    )
+    if memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        row += f" {peak / 2**20:>12.1f}"
+    print(row)
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--samples", type=int, nargs="+", default=[10**6, 10**7, 10**8])
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--memory", action="store_true")
+    args = parser.parse_args()
+
+    stacks = make_stacks(1000)
+    samples = [
+        Sample(
+            threads={
+                thread_id: stacks[(i * 7 + thread_id) % len(stacks)]
+                for thread_id in range(1, args.threads + 1)
+            },
+            stop_time=0.001,
+            timestamp=i * 0.01,
+        )
+        for i in range(1000)
+    ]
+
+    header = (
+        f"{'Samples':>12} {'Add µs/sample':>13} {'Finalize ms':>12} "
+        f"{'Merge ms':>9} {'Max RSS MiB':>12}"
+    )
+    if args.memory:
+        header += f" {'Peak MiB':>12}"
+    print(header)
+    for sample_count in args.samples:
+        measure(samples, sample_count, args.threads, args.memory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Measure how long the process is stopped per sample, for each sampler mode and
+unwinding strategy.
+
+Usage: python benchmarks/unwind_stop_time.py [--depth N] [SCRIPT]
+
+By default this profiles ``scripts_for_tests/deep_stack.py``, where the Numba
+code runs underneath a deep stack of native frames.  Requires profila's gdb,
+see ``python -m profila setup``.
+"""
+
+from argparse import ArgumentParser
+import asyncio
+from dataclasses import replace
+
+from profila._gdb import (
+    EMBEDDED,
+    SAMPLER_MODES,
+    UNWIND_STRATEGIES,
+    SamplerOptions,
+    run_subprocess,
+)
+from profila._stats import FinalStats
+from profila.__main__ import get_stats
+
+
+async def profile(script: str, options: SamplerOptions) -> FinalStats:
+    process = await run_subprocess([script])
+    return (await get_stats(process, options)).finalize()
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--depth", type=int, default=64)
+    parser.add_argument("script", nargs="?", default="scripts_for_tests/deep_stack.py")
+    args = parser.parse_args()
+
+    base = SamplerOptions(depth=args.depth)
+    configurations = [
+        replace(base, mode=mode, unwind=unwind)
+        for mode in SAMPLER_MODES
+        for unwind in UNWIND_STRATEGIES
+    ] + [
+        replace(base, mode=EMBEDDED, unwind=unwind, defer_symbols=True)
+        for unwind in UNWIND_STRATEGIES
+    ]
+
+    print("| Sampler | Unwind | Mean stop (ms) | Max stop (ms) | Samples | Numba |")
+    print("|:--------|:-------|---------------:|--------------:|--------:|------:|")
+    for options in configurations:
+        stats = asyncio.run(profile(args.script, options))
+        mode = options.mode + (" (deferred)" if options.defer_symbols else "")
+        print(
+            f"| {mode} | {options.unwind} | {stats.mean_stop_ms} "
+            f"| {stats.max_stop_ms} | {stats.total_samples} "
+            f"| {stats.percent_numba_samples()}% |"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+from time import time
+
+import numpy as np
+from numba import jit
+
+DATA = np.random.random((100_000,))
+
+
+@jit
+def kernel(timeseries):
+    total = 0.0
+    for i in range(len(timeseries)):
+        total += timeseries[i] ** 2
+    return total
+
+
+def recurse(depth):
+    # Calling through map() adds native frames for every level, like callbacks
+    # from NumPy or other extension code do:
+    if depth == 0:
+        return kernel(DATA)
+    return list(map(recurse, [depth - 1]))[0]
+
+
+kernel(DATA)
+
+start = time()
+# Run for 3 seconds, with the Numba code underneath a deep stack:
+while (time() - start) < 3:
+    recurse(50)
@@ -0,0 +1,26 @@
+import numpy as np
+from numba import njit
+
+DATA = np.random.random((1_000_000,))
+
+
+@njit
+def helper(x):
+    # LLVM inlines this into its caller:
+    return (7 + x / 9 + (x**2) / 7) / 5
+
+
+@njit
+def caller(timeseries):
+    result = np.empty_like(timeseries)
+    for i in range(len(timeseries)):
+        result[i] = helper(timeseries[i])
+    return result
+
+
+# Make sure the Numba code is pre-compiled
+caller(DATA)
+
+# This is the part we want to profile:
+for i in range(500):
+    caller(DATA)
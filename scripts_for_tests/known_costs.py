@@ -0,0 +1,39 @@
+"""
+A workload with known line costs, for ``benchmarks/sampler_fidelity.py``.
+
+The three loops run the same code, which can't be vectorized since each
+iteration depends on the last, so their costs are in the ratio marked by the
+"cost:" comments.  If given a path, the time taken is written there as JSON.
+"""
+
+import json
+import math
+import sys
+from time import perf_counter
+
+from numba import njit
+
+
+@njit
+def work(n):
+    total = 0.0
+    for i in range(n):
+        total = math.sin(total + i)  # cost: 1
+    for i in range(2 * n):
+        total = math.sin(total + i)  # cost: 2
+    for i in range(4 * n):
+        total = math.sin(total + i)  # cost: 4
+    return total
+
+
+# Make sure the Numba code is pre-compiled
+work(10)
+
+start = perf_counter()
+for _ in range(150):
+    work(100_000)
+elapsed = perf_counter() - start
+
+if len(sys.argv) > 1:
+    with open(sys.argv[1], "w") as f:
+        json.dump({"elapsed": elapsed}, f)
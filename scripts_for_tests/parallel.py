@@ -0,0 +1,21 @@
+import numpy as np
+from numba import njit, prange
+
+DATA = np.random.random((1_000_000,))
+
+
+@njit(parallel=True)
+def parallel(timeseries):
+    result = np.empty_like(timeseries)
+    for i in prange(len(timeseries)):
+        # This should be the most expensive line:
+        result[i] = (7 + timeseries[i] / 9 + (timeseries[i] ** 2) / 7) / 5
+    return result
+
+
+# Make sure the Numba code is pre-compiled
+parallel(DATA)
+
+# This is the part we want to profile:
+for i in range(500):
+    parallel(DATA)
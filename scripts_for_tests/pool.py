@@ -0,0 +1,25 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numba import jit
+
+
+@jit
+def simple(timeseries):
+    result = np.empty_like(timeseries)
+    for i in range(len(timeseries)):
+        # This should be the most expensive line:
+        result[i] = (7 + timeseries[i] / 9 + (timeseries[i] ** 2) / 7) / 5
+    return result
+
+
+def work(iterations):
+    data = np.random.random((1_000_000,))
+    for _ in range(iterations):
+        simple(data)
+
+
+if __name__ == "__main__":
+    # The Numba work only happens in the worker processes:
+    with ProcessPoolExecutor(2) as executor:
+        list(executor.map(work, [200, 200]))
@@ -0,0 +1,37 @@
+import json
+
+import numpy as np
+from numba import jit
+
+import profila
+
+DATA = np.random.random((1_000_000,))
+
+
+@jit
+def simple(timeseries):
+    result = np.empty_like(timeseries)
+    for i in range(len(timeseries)):
+        # This should be the most expensive line:
+        result[i] = (7 + timeseries[i] / 9 + (timeseries[i] ** 2) / 7) / 5
+    return result
+
+
+# Compilation happens outside the profiled code:
+simple(DATA)
+
+with profila.profile() as profiler:
+    for i in range(100):
+        simple(DATA)
+repeated = profila.profile_until(lambda: simple(DATA), min_samples=200)
+profila.detach()
+
+print(
+    json.dumps(
+        {
+            "block": profiler.stats.numba_samples[__file__],
+            "repeated": repeated.numba_samples[__file__],
+            "repeated_total": repeated.total_samples,
+        }
+    )
+)
@@ -0,0 +1,28 @@
+import ctypes
+
+import numpy as np
+from numba import jit
+
+# Let profila attach even though it's not our parent process:
+PR_SET_PTRACER = 0x59616D61
+PR_SET_PTRACER_ANY = ctypes.c_ulong(-1)
+ctypes.CDLL("libc.so.6").prctl(PR_SET_PTRACER, PR_SET_PTRACER_ANY)
+
+DATA = np.random.random((1_000_000,))
+
+
+@jit
+def simple(timeseries):
+    result = np.empty_like(timeseries)
+    for i in range(len(timeseries)):
+        # This should be the most expensive line:
+        result[i] = (7 + timeseries[i] / 9 + (timeseries[i] ** 2) / 7) / 5
+    return result
+
+
+simple(DATA)
+print("ready", flush=True)
+
+# Run until killed:
+while True:
+    simple(DATA)
@@ -0,0 +1,26 @@
+import time
+
+import numpy as np
+from numba import jit
+
+DATA = np.random.random((1_000_000,))
+
+
+@jit
+def simple(timeseries):
+    result = np.empty_like(timeseries)
+    for i in range(len(timeseries)):
+        # This is the only CPU-heavy line:
+        result[i] = (7 + timeseries[i] / 9 + (timeseries[i] ** 2) / 7) / 5
+    return result
+
+
+# Make sure the Numba code is pre-compiled
+simple(DATA)
+
+# Half computing, half waiting, like a service doing I/O:
+end = time.time() + 5
+while time.time() < end:
+    start = time.time()
+    simple(DATA)
+    time.sleep(time.time() - start)
@@ -0,0 +1,24 @@
+import numpy as np
+from numba import jit
+
+DATA64 = np.random.random((1_000_000,))
+DATA32 = DATA64.astype(np.float32)
+
+
+@jit
+def simple(timeseries):
+    result = np.empty_like(timeseries)
+    for i in range(len(timeseries)):
+        result[i] = (7 + timeseries[i] / 9 + (timeseries[i] ** 2) / 7) / 5
+    return result
+
+
+# Make sure both specializations are pre-compiled
+simple(DATA64)
+simple(DATA32)
+
+# The float64 version runs three times as often:
+for i in range(300):
+    simple(DATA64)
+    if i % 3 == 0:
+        simple(DATA32)
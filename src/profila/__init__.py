@@ -5,6 +5,20 @@ A profiler for Numba.
 import os
 import sys
 
+from ._profile import Profiler, profile, profile_until
+from ._render import render_text
+from ._session import detach
+from ._stats import FinalStats
+
+__all__ = [
+    "FinalStats",
+    "Profiler",
+    "detach",
+    "profile",
+    "profile_until",
+    "render_text",
+]
+
 
 def load_ipython_extension(ipython: object) -> None:
     """Load our IPython magic"""
@@ -2,28 +2,244 @@
 Run Profila as a command-line tool.
 """
 
-from argparse import ArgumentParser, REMAINDER, RawDescriptionHelpFormatter, Namespace
+from argparse import (
+    ArgumentParser,
+    ArgumentTypeError,
+    REMAINDER,
+    RawDescriptionHelpFormatter,
+    Namespace,
+)
 import asyncio
 from asyncio.subprocess import Process
 from dataclasses import asdict
 import json
 import os
-from platform import machine
+import re
+import signal
 import subprocess
 import sys
-import tarfile
-from tempfile import TemporaryFile
-from urllib.request import urlopen
+from time import monotonic
+from typing import Any, Callable, Optional, TextIO
 
 from ._gdb import (
     run_subprocess,
     read_samples,
     attach_subprocess,
+    AttachError,
     exit_subprocess,
+    find_pids,
+    keep_running,
     GDB_PATH,
+    SamplerOptions,
+)
+from ._diff import diff_stats, render_diff
+from ._html import render_html
+from ._jsonformat import from_json, to_json
+from ._options import (
+    SESSION_PARSER,
+    add_sampler_arguments,
+    add_timeline_arguments,
+    new_stats,
+    sampler_options,
 )
-from ._stats import Stats
-from ._render import render_text
+from ._samplelog import SampleLogReader, SampleLogWriter
+from ._stats import FinalStats, Stats, top_lines_error, PRECISION_TOP_LINES
+from ._render import render_text, render_collapsed, render_speedscope
+
+OUTPUT_FORMATS = ("text", "json", "html", "speedscope")
+
+
+def add_export_arguments(parser: ArgumentParser) -> None:
+    """
+    Add the command-line options for exporting call stacks.
+    """
+    parser.add_argument(
+        "--collapsed",
+        metavar="PATH",
+        help="Write call stacks in collapsed format, for flamegraph.pl.",
+    )
+    parser.add_argument(
+        "--speedscope",
+        metavar="PATH",
+        help="Write call stacks as a speedscope JSON profile.",
+    )
+
+
+def add_format_argument(parser: ArgumentParser) -> None:
+    """
+    Add the command-line option for the output format.
+    """
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="text",
+        help=(
+            "Print the results as text, as a versioned JSON profile, as a "
+            "self-contained HTML report, or as a speedscope profile "
+            "(default: text)."
+        ),
+    )
+
+
+def add_follow_children_argument(parser: ArgumentParser) -> None:
+    """
+    Add the command-line option for profiling child processes too.
+    """
+    parser.add_argument(
+        "--follow-children",
+        action="store_true",
+        help=(
+            "Also profile child processes, e.g. multiprocessing or "
+            "ProcessPoolExecutor workers, reporting merged results plus a "
+            "per-process breakdown."
+        ),
+    )
+
+
+def add_fast_start_arguments(parser: ArgumentParser) -> None:
+    """
+    Add the command-line options for starting faster by loading fewer symbols.
+    """
+    parser.add_argument(
+        "--fast-start",
+        action="store_true",
+        help=(
+            "Start sampling sooner by only loading symbols for Numba's compiled "
+            "code and the few libraries profila needs, instead of every shared "
+            "library.  Non-Numba code in other libraries is then only broken "
+            "down by library, without function names."
+        ),
+    )
+    parser.add_argument(
+        "--load-symbols",
+        action="append",
+        metavar="REGEX",
+        help=(
+            "With --fast-start, also load symbols for shared libraries whose "
+            "path matches this regular expression, e.g. 'numpy'.  Can be "
+            "given more than once; implies --fast-start."
+        ),
+    )
+
+
+def load_symbols(args: Namespace) -> Optional[list[str]]:
+    """
+    The libraries to load symbols for with ``--fast-start``, or ``None`` to
+    load them all.
+    """
+    if not (args.fast_start or args.load_symbols):
+        return None
+    if args.follow_children:
+        raise SystemExit("--fast-start can't be combined with --follow-children.")
+    return args.load_symbols or []
+
+
+def percentage(value: str) -> float:
+    """
+    Parse a positive percentage, with or without a "%" suffix.
+    """
+    try:
+        result = float(value.strip().removesuffix("%"))
+    except ValueError:
+        raise ArgumentTypeError(f"invalid percentage: {value!r}") from None
+    if not result > 0:
+        raise ArgumentTypeError(f"must be positive: {value!r}")
+    return result
+
+
+def add_stop_arguments(parser: ArgumentParser) -> None:
+    """
+    Add the command-line options for stopping once there are enough samples.
+    """
+    parser.add_argument(
+        "--precision",
+        type=percentage,
+        metavar="PERCENT",
+        help=(
+            f"Stop once the {PRECISION_TOP_LINES} hottest lines' percentages are "
+            "known to within this many percentage points, at 95%% confidence, "
+            "e.g. '1%%'."
+        ),
+    )
+    parser.add_argument(
+        "--max-samples",
+        type=int,
+        metavar="N",
+        help="Stop after this many samples.",
+    )
+
+
+class AutoStop:
+    """
+    Decide when to stop sampling, for ``--precision`` and ``--max-samples``.
+
+    Call it after each sample with the ``Stats`` being gathered, one per
+    process if several are sampled at once.
+    """
+
+    # Checking the precision goes through every line's counts, so only do it
+    # every this many samples:
+    CHECK_EVERY = 100
+
+    def __init__(self, args: Namespace) -> None:
+        if args.max_samples is not None and args.max_samples < 1:
+            raise SystemExit("--max-samples must be at least 1.")
+        self.precision: Optional[float] = args.precision
+        self.max_samples: Optional[int] = args.max_samples
+        self.next_check = 0
+        self.reason: Optional[str] = None
+
+    def __call__(self, all_stats: list[Stats]) -> bool:
+        if self.reason is not None:
+            return True
+        total = sum(stats.total_samples() for stats in all_stats)
+        if self.max_samples is not None and total >= self.max_samples:
+            self.reason = f"Reached {self.max_samples} samples"
+        elif self.precision is not None and total >= self.next_check:
+            self.next_check = total + self.CHECK_EVERY
+            error = top_lines_error(all_stats)
+            if error is not None and error <= self.precision:
+                self.reason = (
+                    f"Hottest lines known to ±{round(error, 2)}% after {total} samples"
+                )
+        return self.reason is not None
+
+
+def pid_list(value: str) -> list[str]:
+    """
+    Parse a comma-separated list of PIDs.
+    """
+    pids = [pid.strip() for pid in value.split(",") if pid.strip()]
+    if not pids or not all(pid.isdigit() for pid in pids):
+        raise ArgumentTypeError(f"invalid PID list: {value!r}")
+    return pids
+
+
+def render_stats(output_format: str, stats: Stats) -> str:
+    """
+    Render stats in one of the ``OUTPUT_FORMATS``.
+    """
+    if output_format == "speedscope":
+        return render_speedscope(stats)
+    final_stats = stats.finalize()
+    if output_format == "json":
+        return json.dumps(to_json(final_stats))
+    if output_format == "html":
+        return render_html(final_stats)
+    return render_text(final_stats)
+
+
+def write_exports(args: Namespace, stats: Stats) -> None:
+    """
+    Write the call stack exports requested on the command-line.
+    """
+    if args.collapsed is not None:
+        with open(args.collapsed, "w") as f:
+            f.write(render_collapsed(stats))
+    if args.speedscope is not None:
+        with open(args.speedscope, "w") as f:
+            f.write(render_speedscope(stats))
+
 
 PARSER = ArgumentParser(prog="profila", description="A profiler for Numba.")
 SUBPARSERS = PARSER.add_subparsers()
@@ -46,6 +262,80 @@ ANNOTATE_PARSER.add_argument(
     help="The arguments you'd usually pass to the Python command-line.",
 )
 ANNOTATE_PARSER.set_defaults(command="annotate")
+add_sampler_arguments(ANNOTATE_PARSER)
+add_timeline_arguments(ANNOTATE_PARSER)
+add_export_arguments(ANNOTATE_PARSER)
+add_format_argument(ANNOTATE_PARSER)
+add_follow_children_argument(ANNOTATE_PARSER)
+add_fast_start_arguments(ANNOTATE_PARSER)
+add_stop_arguments(ANNOTATE_PARSER)
+ANNOTATE_PARSER.add_argument(
+    "--output",
+    metavar="PATH",
+    help=(
+        "Also stream the samples to this file as they arrive; view it later "
+        "with 'python -m profila report PATH'."
+    ),
+)
+ATTACH_PARSER = SUBPARSERS.add_parser(
+    "attach",
+    help="Profile a running process, leaving it running when done.",
+    formatter_class=RawDescriptionHelpFormatter,
+    description="""To profile process 1234 for 60 seconds, printing the results so
+far every 10 seconds:
+
+    python -m profila attach --duration 60 --snapshot-every 10 1234
+
+To profile several processes at once and merge the results, e.g. identical
+workers:
+
+    python -m profila attach --pids 101,102,103
+    python -m profila attach --name 'worker\\.py'
+
+Without --duration, profiling continues until the process exits or you hit
+Ctrl-C.  The process needs to have been started with NUMBA_DEBUGINFO=1 set.
+""",
+)
+ATTACH_PARSER.add_argument(
+    "pid",
+    action="store",
+    nargs="?",
+    help="The process PID.",
+)
+ATTACH_PARSER.set_defaults(command="attach")
+ATTACH_PARSER.add_argument(
+    "--pids",
+    type=pid_list,
+    metavar="PID,PID,...",
+    help="Profile all these processes at once, merging the results.",
+)
+ATTACH_PARSER.add_argument(
+    "--name",
+    metavar="REGEX",
+    help=(
+        "Profile all processes whose command line matches this regular "
+        "expression, merging the results."
+    ),
+)
+ATTACH_PARSER.add_argument(
+    "--duration",
+    type=float,
+    metavar="SECONDS",
+    help="Detach after this many seconds.",
+)
+ATTACH_PARSER.add_argument(
+    "--snapshot-every",
+    type=float,
+    metavar="SECONDS",
+    help="Print the results so far every this many seconds.",
+)
+add_sampler_arguments(ATTACH_PARSER)
+add_timeline_arguments(ATTACH_PARSER)
+add_export_arguments(ATTACH_PARSER)
+add_format_argument(ATTACH_PARSER)
+add_follow_children_argument(ATTACH_PARSER)
+add_fast_start_arguments(ATTACH_PARSER)
+add_stop_arguments(ATTACH_PARSER)
 ATTACH_AUTOMATED_PARSER = SUBPARSERS.add_parser(
     "attach_automated",
     help="Attach to an existing process, for use by the Jupyter extension.",
@@ -57,6 +347,69 @@ ATTACH_AUTOMATED_PARSER.add_argument(
 )
 ATTACH_AUTOMATED_PARSER.set_defaults(command="attach_automated")
 
+REPORT_PARSER = SUBPARSERS.add_parser(
+    "report",
+    help="Annotate the Numba source code using samples saved with --output.",
+)
+REPORT_PARSER.add_argument(
+    "path",
+    action="store",
+    help="The file passed to 'annotate --output'.",
+)
+REPORT_PARSER.set_defaults(command="report")
+add_timeline_arguments(REPORT_PARSER)
+add_export_arguments(REPORT_PARSER)
+add_format_argument(REPORT_PARSER)
+
+DIFF_PARSER = SUBPARSERS.add_parser(
+    "diff",
+    help="Compare two profiles saved with --format json.",
+    formatter_class=RawDescriptionHelpFormatter,
+    description="""To see which lines got slower or faster between two runs:
+
+    python -m profila report --format json base.log > base.json
+    python -m profila report --format json candidate.log > candidate.json
+    python -m profila diff base.json candidate.json
+
+Lines and functions are flagged if their share of the samples changed by more
+than can be explained by sampling noise, and by at least --min-change.
+""",
+)
+DIFF_PARSER.add_argument("base", help="The profile to compare against.")
+DIFF_PARSER.add_argument("candidate", help="The new profile.")
+DIFF_PARSER.set_defaults(command="diff")
+DIFF_PARSER.add_argument(
+    "--confidence",
+    type=float,
+    default=0.99,
+    help=(
+        "How sure we need to be that a change isn't just sampling noise "
+        "(default: 0.99)."
+    ),
+)
+DIFF_PARSER.add_argument(
+    "--min-change",
+    type=float,
+    default=1.0,
+    metavar="PERCENT",
+    help=(
+        "Ignore changes smaller than this many percentage points of all "
+        "samples (default: 1.0)."
+    ),
+)
+DIFF_PARSER.add_argument(
+    "--format",
+    choices=("text", "json"),
+    default="text",
+    help="Print the changes as text, or as a JSON list (default: text).",
+)
+DIFF_PARSER.add_argument(
+    "--check",
+    default=False,
+    action="store_true",
+    help="Exit with status 1 if there are any significant changes.",
+)
+
 # Hopefully can go away someday...
 SETUP_PARSER = SUBPARSERS.add_parser(
     "setup",
@@ -72,18 +425,54 @@ SETUP_PARSER.add_argument(
 )
 
 
-async def get_stats(process: Process) -> Stats:
-    stats = Stats()
+async def get_stats(
+    process: Process,
+    options: SamplerOptions = SamplerOptions(),
+    log: Optional[SampleLogWriter] = None,
+    stats: Optional[Stats] = None,
+    until: Optional[Callable[[], bool]] = None,
+) -> Stats:
+    """
+    Add samples from the process to ``stats`` until it exits, or until
+    ``until()`` returns true after a sample, which leaves it running.
+    """
+    if stats is None:
+        stats = Stats(interval=options.interval)
 
     count = 0
-    async for sample in read_samples(process):
-        count += 1
-        stats.add_sample(sample)
+    samples = read_samples(process, options)
+    try:
+        async for sample in samples:
+            # Each thread's stack counts as a sample, and no stacks is a bad
+            # sample, unless nothing was running with on-CPU sampling:
+            count += len(sample.threads) or int(not sample.off_cpu)
+            stats.add_all_threads(sample)
+            if log is not None:
+                log.write(sample)
+            if until is not None and until():
+                break
+    finally:
+        await samples.aclose()
     assert stats.total_samples() == count
 
     return stats
 
 
+def load_stats(f: TextIO, stats: Optional[Stats] = None) -> Stats:
+    """
+    Rebuild ``Stats`` from a sample log, one sample at a time.
+
+    If ``stats`` is given, samples are added to it.
+    """
+    reader = SampleLogReader(f)
+    if stats is None:
+        stats = Stats()
+    stats.interval = reader.metadata.get("interval", 0.0)
+    for sample in reader:
+        stats.add_all_threads(sample)
+    return stats
+
+
 def annotate_command(args: Namespace) -> None:
     """
     Run the ``anotate`` command.
@@ -97,44 +486,270 @@ def annotate_command(args: Namespace) -> None:
             "'python -m profila setup'."
         )
 
-    async def main() -> Stats:
-        process = await run_subprocess(args.rest)
-        return await get_stats(process)
+    options = sampler_options(args)
+    stats = new_stats(args, options.interval)
+    auto_stop = AutoStop(args)
+    symbols = load_symbols(args)
+
+    async def main(log: Optional[SampleLogWriter]) -> Stats:
+        process = await run_subprocess(args.rest, args.follow_children, symbols)
+        await get_stats(process, options, log, stats, lambda: auto_stop([stats]))
+        if auto_stop.reason is not None:
+            # Enough samples, so end the program early:
+            print(f"{auto_stop.reason}, stopping.", file=sys.stderr)
+            await exit_subprocess(process)
+        return stats
+
+    if args.output is None:
+        stats = asyncio.run(main(None))
+    else:
+        with open(args.output, "w") as f:
+            log = SampleLogWriter(f, {"interval": options.interval})
+            stats = asyncio.run(main(log))
+    print(render_stats(args.format, stats))
+    write_exports(args, stats)
+
+
+def report_command(args: Namespace) -> None:
+    """
+    Run the ``report`` command.
+    """
+    stats = new_stats(args)
+    try:
+        with open(args.path) as f:
+            load_stats(f, stats)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"Couldn't read {args.path}: {e}") from None
+    print(render_stats(args.format, stats))
+    write_exports(args, stats)
 
-    stats = asyncio.run(main())
-    final_stats = stats.finalize()
-    print(render_text(final_stats))
+
+def diff_command(args: Namespace) -> None:
+    """
+    Run the ``diff`` command.
+    """
+    if not 0 < args.confidence < 1:
+        raise SystemExit("--confidence must be between 0 and 1.")
+    profiles = []
+    for path in (args.base, args.candidate):
+        try:
+            with open(path) as f:
+                profiles.append(from_json(json.load(f)))
+        except (OSError, ValueError, KeyError) as e:
+            raise SystemExit(f"Couldn't read {path}: {e}") from None
+    base, candidate = profiles
+    changes = diff_stats(base, candidate, args.confidence, args.min_change)
+    if args.format == "json":
+        print(json.dumps([asdict(change) for change in changes]))
+    else:
+        print(render_diff(base, candidate, changes))
+    if args.check and any(change.significant for change in changes):
+        raise SystemExit(1)
+
+
+def attach_command(args: Namespace) -> None:
+    """
+    Run the ``attach`` command.
+    """
+    if not os.path.exists(GDB_PATH):
+        raise SystemExit(
+            "Profila's custom gdb not found, make sure it is installed by running "
+            "'python -m profila setup'."
+        )
+    if args.duration is not None and args.duration <= 0:
+        raise SystemExit("--duration must be positive.")
+    if args.snapshot_every is not None:
+        if args.snapshot_every <= 0:
+            raise SystemExit("--snapshot-every must be positive.")
+        if args.format not in ("text", "json"):
+            raise SystemExit("--snapshot-every requires --format text or json.")
+    if [args.pid, args.pids, args.name].count(None) != 2:
+        raise SystemExit("Pass exactly one of a PID, --pids or --name.")
+    if args.pids is not None:
+        pids = args.pids
+    elif args.name is not None:
+        try:
+            pids = [str(pid) for pid in find_pids(args.name)]
+        except re.error as e:
+            raise SystemExit(f"Invalid --name regular expression: {e}") from None
+        if not pids:
+            raise SystemExit(f"No processes match {args.name!r}.")
+    else:
+        pids = [args.pid]
+    options = sampler_options(args)
+    auto_stop = AutoStop(args)
+    symbols = load_symbols(args)
+    # One Stats per process, so each gdb's samples are checked and counted
+    # separately, merged for output:
+    targets = [new_stats(args, options.interval) for _ in pids]
+    start = monotonic()
+
+    def merged() -> Stats:
+        result = new_stats(args, options.interval)
+        for index, target in enumerate(targets):
+            result.merge(target, concurrent=index > 0)
+        return result
+
+    def emit(message: str, final_stats: FinalStats) -> None:
+        elapsed = round(monotonic() - start, 3)
+        if args.format == "json":
+            record = {"message": message, "elapsed": elapsed}
+            sys.stdout.write(json.dumps({**record, "stats": to_json(final_stats)}))
+            sys.stdout.write("\n")
+        else:
+            if message == "snapshot":
+                sys.stdout.write(f"## Snapshot after {elapsed} seconds\n\n")
+            sys.stdout.write(render_text(final_stats) + "\n")
+        sys.stdout.flush()
+
+    async def main() -> None:
+        processes = await asyncio.gather(
+            *(attach_subprocess(pid, args.follow_children, symbols) for pid in pids)
+        )
+        loop = asyncio.get_running_loop()
+        detaching = False
+
+        def until() -> bool:
+            return auto_stop(targets)
+
+        def detach() -> None:
+            # gdb detaches from the process when it exits, leaving it running:
+            nonlocal detaching
+            if not detaching:
+                detaching = True
+                for process in processes:
+                    if process.returncode is None:
+                        asyncio.ensure_future(exit_subprocess(process))
+
+        loop.add_signal_handler(signal.SIGINT, detach)
+        if args.duration is not None:
+            loop.call_later(args.duration, detach)
+
+        async def snapshots() -> None:
+            while True:
+                await asyncio.sleep(args.snapshot_every)
+                emit("snapshot", merged().finalize())
+
+        snapshot_task = None
+        if args.snapshot_every is not None:
+            snapshot_task = asyncio.ensure_future(snapshots())
+        try:
+            # Each process is sampled until it exits, we detach, or there are
+            # enough samples:
+            await asyncio.gather(
+                *(
+                    get_stats(process, options, stats=target, until=until)
+                    for (process, target) in zip(processes, targets)
+                )
+            )
+            if auto_stop.reason is not None:
+                print(f"{auto_stop.reason}, detaching.", file=sys.stderr)
+                detach()
+                await asyncio.gather(*(process.wait() for process in processes))
+        finally:
+            if snapshot_task is not None:
+                snapshot_task.cancel()
+            loop.remove_signal_handler(signal.SIGINT)
+
+    try:
+        asyncio.run(main())
+    except AttachError as e:
+        raise SystemExit(str(e)) from None
+    stats = merged()
+    if args.format in ("text", "json"):
+        emit("stats", stats.finalize())
+    else:
+        print(render_stats(args.format, stats))
+    write_exports(args, stats)
 
 
 def attach_automated_command(args: Namespace) -> None:
     """
     Run the ``attach_automated`` command.
 
-    The other side of this logic is in the ``_ipython.py`` module.
+    This attaches once and then samples whenever it's told to, so a Jupyter
+    kernel only pays for attaching once.  The other side of this logic is in
+    the ``_ipython.py`` module.  Messages in both directions are JSON objects,
+    one per line:
+
+    * ``{"message": "attached"}`` is sent once gdb has attached.
+    * ``{"command": "start", "args": [...]}`` starts sampling with the given
+      ``%%profila`` options, and is answered with ``{"message": "started"}``.
+    * ``{"command": "count"}``, while sampling, is answered with
+      ``{"message": "count", "numba_samples": N}``, the number of samples so
+      far that were in Numba code.
+    * ``{"command": "stop"}`` pauses sampling, and is answered with
+      ``{"message": "stats", "stats": ...}``.
+    * Closing stdin detaches, leaving the process running.
     """
 
-    async def stop_on_stdin_close(process: Process) -> None:
-        loop = asyncio.get_event_loop()
-        # The Jupyter side will signal it's finished running code by closing
-        # stdin.
-        await loop.run_in_executor(None, sys.stdin.read)
-        await exit_subprocess(process)
+    def send(message: dict[str, Any]) -> None:
+        sys.stdout.write(json.dumps(message) + "\n")
+        sys.stdout.flush()
 
-    async def main() -> Stats:
+    async def read_command() -> Optional[dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        return json.loads(line) if line.strip() else None
+
+    async def sample_cell(process: Process, command: dict[str, Any]) -> bool:
+        """
+        Sample until told to stop, and send the stats.  Returns whether the
+        session should continue.
+        """
+        cell_args = SESSION_PARSER.parse_args(command["args"])
+        options = sampler_options(cell_args)
+        stats = new_stats(cell_args, options.interval)
+
+        async def wait_for_stop() -> Optional[dict[str, Any]]:
+            while True:
+                command = await read_command()
+                if command is None or command["command"] == "stop":
+                    return command
+                assert command["command"] == "count"
+                send({"message": "count", "numba_samples": stats.numba_sample_count})
+
+        stop = asyncio.ensure_future(wait_for_stop())
+        send({"message": "started"})
+        samples = read_samples(process, options)
+        try:
+            async for sample in samples:
+                stats.add_all_threads(sample)
+                if stop.done():
+                    break
+        finally:
+            await samples.aclose()
+        # The source code is only available inside the Jupyter process (it's
+        # cells, not files on the filesystem), so do the source code loading
+        # over there.
+        send({"message": "stats", "stats": to_json(stats.finalize())})
+        if process.returncode is not None:
+            return False
+        return await stop is not None
+
+    async def main() -> None:
         process = await attach_subprocess(args.pid)
-        asyncio.create_task(stop_on_stdin_close(process))
         # Tell the Jupyter side it can start running code:
-        sys.stdout.write(json.dumps({"message": "attached"}) + "\n")
-        sys.stdout.flush()
-        return await get_stats(process)
-
-    final_stats = asyncio.run(main()).finalize()
-    # The source code is only available inside the Jupyter process (it's cells,
-    # not files on the filesystem), so do the source code loading over there.
-    sys.stdout.write(
-        json.dumps({"message": "stats", "stats": asdict(final_stats)}) + "\n"
-    )
-    sys.stdout.flush()
+        send({"message": "attached"})
+        while True:
+            idle = asyncio.ensure_future(keep_running(process))
+            command = await read_command()
+            idle.cancel()
+            await asyncio.gather(idle, return_exceptions=True)
+            if process.returncode is not None:
+                return
+            if command is None:
+                break
+            assert command["command"] == "start"
+            if not await sample_cell(process, command):
+                break
+        if process.returncode is None:
+            await exit_subprocess(process)
+
+    try:
+        asyncio.run(main())
+    except AttachError as e:
+        raise SystemExit(str(e)) from None
 
 
 STORAGE_PATH = os.path.expanduser("~/.profila-gdb/")
@@ -150,6 +765,12 @@ def setup_command(args: Namespace) -> None:
 
     See https://github.com/numba/numba/issues/9817
     """
+    # Only needed here, so other commands don't pay for importing them:
+    from platform import machine
+    import tarfile
+    from tempfile import TemporaryFile
+    from urllib.request import urlopen
+
     if os.path.exists(GDB_PATH):
         print(
             "Profila's gdb is already downloaded, exiting. "
@@ -211,8 +832,14 @@ def main() -> None:
     args = PARSER.parse_args()
     if args.command == "annotate":
         annotate_command(args)
+    elif args.command == "attach":
+        attach_command(args)
     elif args.command == "attach_automated":
         attach_automated_command(args)
+    elif args.command == "report":
+        report_command(args)
+    elif args.command == "diff":
+        diff_command(args)
     elif args.command == "setup":
         setup_command(args)
     else:
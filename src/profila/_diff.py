@@ -0,0 +1,170 @@
+"""
+Compare two profiles, to pin a regression on specific lines.
+
+Percentages are already normalised by each profile's total samples, so a
+line's share of the samples can be compared directly.  Whether a change is
+more than noise is checked with a two-proportion z-test: each sample either
+is or isn't on the line, so the number of samples on it is binomial.
+"""
+
+from dataclasses import dataclass
+from io import StringIO
+from linecache import getline
+from math import sqrt
+from statistics import NormalDist
+from typing import Optional
+
+from ._stats import FinalStats
+
+
+@dataclass(frozen=True)
+class Change:
+    """
+    How a line's or a function's share of the samples changed.
+    """
+
+    # "line" or "function":
+    kind: str
+    # The function name, or for lines the path:
+    name: str
+    line: Optional[int]
+    # Percentages of all samples:
+    base: float
+    candidate: float
+    # The z-score of the change, positive if the share grew:
+    z_score: float
+    significant: bool
+
+    def delta(self) -> float:
+        return round(self.candidate - self.base, 1)
+
+
+def _z_score(
+    base_percent: float, base_total: int, candidate_percent: float, candidate_total: int
+) -> float:
+    """
+    The two-proportion z-score for a change from ``base_percent`` of
+    ``base_total`` samples to ``candidate_percent`` of ``candidate_total``.
+    """
+    if not base_total or not candidate_total:
+        return 0.0
+    base = base_percent / 100
+    candidate = candidate_percent / 100
+    pooled = (base * base_total + candidate * candidate_total) / (
+        base_total + candidate_total
+    )
+    error = sqrt(pooled * (1 - pooled) * (1 / base_total + 1 / candidate_total))
+    if error == 0:
+        return 0.0
+    return (candidate - base) / error
+
+
+def diff_stats(
+    base: FinalStats,
+    candidate: FinalStats,
+    confidence: float = 0.99,
+    min_change: float = 1.0,
+) -> list[Change]:
+    """
+    Compare every line and Numba function in either profile, biggest change
+    first.
+
+    A change is significant if it's unlikely to be noise at the given
+    confidence level, and is at least ``min_change`` percentage points, since
+    with enough samples even irrelevant changes become statistically
+    significant.
+    """
+    threshold = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+
+    def change(
+        kind: str, name: str, line: Optional[int], base_percent: float, new: float
+    ) -> Change:
+        z_score = _z_score(
+            base_percent, base.total_samples, new, candidate.total_samples
+        )
+        return Change(
+            kind=kind,
+            name=name,
+            line=line,
+            base=base_percent,
+            candidate=new,
+            z_score=round(z_score, 2),
+            significant=(
+                abs(z_score) >= threshold and abs(new - base_percent) >= min_change
+            ),
+        )
+
+    changes = []
+    for filename in base.numba_samples.keys() | candidate.numba_samples.keys():
+        base_lines = base.numba_samples.get(filename, {})
+        candidate_lines = candidate.numba_samples.get(filename, {})
+        for line_number in base_lines.keys() | candidate_lines.keys():
+            changes.append(
+                change(
+                    "line",
+                    filename,
+                    line_number,
+                    base_lines.get(line_number, 0.0),
+                    candidate_lines.get(line_number, 0.0),
+                )
+            )
+    for func in base.numba_functions.keys() | candidate.numba_functions.keys():
+        changes.append(
+            change(
+                "function",
+                func,
+                None,
+                base.numba_functions.get(func, {}).get("self", 0.0),
+                candidate.numba_functions.get(func, {}).get("self", 0.0),
+            )
+        )
+    changes.sort(
+        key=lambda c: (-abs(c.candidate - c.base), c.kind, c.name, c.line or 0)
+    )
+    return changes
+
+
+def render_diff(base: FinalStats, candidate: FinalStats, changes: list[Change]) -> str:
+    """
+    Render the significant changes to text.
+    """
+    result = StringIO()
+    result.write(
+        f"**Samples:** {base.total_samples} in base, "
+        + f"{candidate.total_samples} in candidate\n\n"
+        + f"**Numba samples:** {base.percent_numba_samples()}% in base, "
+        + f"{candidate.percent_numba_samples()}% in candidate\n"
+    )
+    significant = [c for c in changes if c.significant]
+    if not significant:
+        result.write("\nNo significant changes.\n")
+        return result.getvalue()
+
+    functions = [c for c in significant if c.kind == "function"]
+    if functions:
+        result.write(
+            "\n| Numba function | Base | Candidate | Change | z |\n"
+            "|:---|---:|---:|---:|---:|\n"
+        )
+        for c in functions:
+            result.write(
+                f"| `{c.name}` | {c.base}% | {c.candidate}% "
+                + f"| {c.delta():+}% | {c.z_score} |\n"
+            )
+
+    lines = [c for c in significant if c.kind == "line"]
+    if lines:
+        result.write(
+            "\n| Line | Base | Candidate | Change | z | Code |\n"
+            "|:---|---:|---:|---:|---:|:---|\n"
+        )
+        for c in lines:
+            assert c.line is not None
+            code = getline(c.name, c.line).strip().replace("|", "\\|")
+            if code:
+                code = f"`{code}`"
+            result.write(
+                f"| {c.name}:{c.line} | {c.base}% | {c.candidate}% "
+                + f"| {c.delta():+}% | {c.z_score} | {code} |\n"
+            )
+    return result.getvalue()
@@ -6,18 +6,27 @@ trace samples.  When run with debug info added, Numba gives informative stack
 traces to gdb, at least, even if not to other tools, so we can use this info to
 get Numba stack traces.
 
-TODO: Currently only profiles the main thread.
+All threads are stopped on each interruption, and each thread's stack is
+recorded, so parallel Numba code can be profiled too.  When following child
+processes, e.g. ``multiprocessing`` workers, gdb debugs each one as a separate
+inferior, and threads of all of them are sampled together.
 """
 
 import asyncio
 from asyncio.subprocess import Process
-from collections.abc import AsyncIterable
-from dataclasses import dataclass
+from collections.abc import AsyncGenerator, Callable, Iterable
+from dataclasses import dataclass, field
+from itertools import count
+import json
 import os
 from shlex import quote
+from tempfile import TemporaryDirectory
+from random import uniform
+import re
 from time import time
 from typing import Optional, cast
 import sys
+from weakref import WeakKeyDictionary
 
 from pygdbmi.gdbmiparser import parse_response
 
@@ -28,11 +37,101 @@ GDB_PATH = os.path.expanduser("~/.profila-gdb/bin/gdb")
 class Frame:
     file: str
     line: int
+    # The function name, if gdb knows it:
+    func: Optional[str] = None
+    # For code without debug info, the shared library it was loaded from:
+    library: Optional[str] = None
+    # The instruction address, if instructions are being recorded; for frames
+    # other than the innermost this is the return address:
+    address: Optional[int] = None
+
+
+@dataclass
+class Instruction:
+    """
+    A disassembled machine code instruction.
+    """
+
+    address: int
+    # The source code line the instruction was compiled from:
+    file: str
+    line: int
+    func: Optional[str]
+    # The disassembled instruction, e.g. "vmulpd %ymm1,%ymm0,%ymm0":
+    text: str
+
+
+@dataclass
+class Sample:
+    """
+    The stacks of all threads from a single interruption of the process, and
+    of its child processes if they're being followed.
+    """
+
+    # Map gdb thread id to that thread's stack, innermost frame first, or to
+    # None if the stack couldn't be read.  Empty if listing threads failed.
+    threads: dict[int, Optional[list[Frame]]]
+    # How long, in seconds, the process was stopped to take this sample:
+    stop_time: float = 0.0
+    # When the sample was taken, as returned by ``time.time()``:
+    timestamp: float = 0.0
+    # If instructions are being recorded, Numba functions that appeared in a
+    # sample for the first time are disassembled, while the process is still
+    # stopped:
+    disassembly: list[Instruction] = field(default_factory=list)
+    # Map gdb thread id to the process id it belongs to, where known:
+    pids: dict[int, int] = field(default_factory=dict)
+    # With on-CPU sampling, the gdb ids of threads that weren't running, so
+    # weren't sampled:
+    off_cpu: list[int] = field(default_factory=list)
+
+
+# Shared libraries Numba's threading layers (workqueue, OpenMP, TBB) use to run
+# and park their worker threads.
+_THREADPOOL_LIBRARIES = (
+    "workqueue",
+    "omppool",
+    "tbbpool",
+    "libgomp",
+    "libiomp",
+    "libomp",
+    "libtbb",
+)
+
+# With fast start gdb only loads symbols for shared libraries matching these
+# regular expressions, plus any the user asks for: the C library, so stacks
+# can be unwound out of system calls, and the threadpools.
+_FAST_START_LIBRARIES = ("libc\\.so", "libpthread", *_THREADPOOL_LIBRARIES)
+
+# The library whose JIT interface tells gdb about the code Numba compiles:
+_JIT_LIBRARY = "llvmlite"
+
+
+def _is_threadpool_frame(frame: Frame) -> bool:
+    """
+    Is this frame part of Numba's threadpool machinery?
+    """
+    if frame.library is None:
+        return False
+    library = os.path.basename(frame.library)
+    return library.startswith(_THREADPOOL_LIBRARIES)
+
+
+def _is_attributable(frame: Frame) -> bool:
+    """
+    Is this the frame a sample gets attributed to, i.e. Numba code or the
+    threadpool?  Frames further out don't change the attribution.
+    """
+    return frame.file.endswith(".py") or _is_threadpool_frame(frame)
 
 
 async def _read(process: Process) -> Optional[dict[str, object]]:
     assert process.stdout is not None
     data_bytes = await process.stdout.readline()
+    if not data_bytes:
+        # End of output, gdb has exited:
+        await process.wait()
+        raise ProcessExited()
     if process.returncode is not None:
         raise ProcessExited()
     data = data_bytes.decode("utf-8").rstrip()
@@ -43,39 +142,752 @@ async def _read(process: Process) -> Optional[dict[str, object]]:
         return None
 
 
-async def _sample(process: Process) -> AsyncIterable[Optional[list[Frame]]]:
+def _parse_stack(
+    message: dict[str, object], with_addresses: bool = False
+) -> Optional[list[Frame]]:
+    """
+    Convert the result of ``-stack-list-frames`` into ``Frame`` objects.
+    """
+    payload = message["payload"]
+    if not isinstance(payload, dict) or "stack" not in payload:
+        # Bad read of some sort:
+        return None
+    return [
+        Frame(
+            file=f.get("fullname", ""),
+            line=int(f.get("line", 0)),
+            func=f.get("func"),
+            library=f.get("from"),
+            address=int(f["addr"], 16) if with_addresses and "addr" in f else None,
+        )
+        for f in payload["stack"]
+    ]
+
+
+def _parse_disassembly(message: dict[str, object]) -> list[Instruction]:
+    """
+    Convert the result of ``-data-disassemble`` with source lines (mode 4)
+    into ``Instruction`` objects.
+    """
+    payload = message["payload"]
+    if not isinstance(payload, dict) or "asm_insns" not in payload:
+        # E.g. no function contains the address:
+        return []
+    result = []
+    for entry in payload["asm_insns"]:
+        # Instructions are grouped by source line, if gdb knows it:
+        instructions = entry.get("line_asm_insn", [entry])
+        for instruction in instructions:
+            result.append(
+                Instruction(
+                    address=int(instruction["address"], 16),
+                    file=entry.get("fullname", ""),
+                    line=int(entry.get("line", 0)),
+                    func=instruction.get("func-name"),
+                    text=instruction.get("inst", ""),
+                )
+            )
+    return result
+
+
+def _parse_thread_ids(message: dict[str, object]) -> list[int]:
+    """
+    Extract the thread ids from the result of ``-thread-list-ids``.
+    """
+    payload = message["payload"]
+    if not isinstance(payload, dict) or not payload.get("thread-ids"):
+        return []
+    ids = payload["thread-ids"]["thread-id"]
+    # A single thread isn't wrapped in a list by the parser:
+    if isinstance(ids, str):
+        ids = [ids]
+    return [int(thread_id) for thread_id in ids]
+
+
+# The kernel thread id in a ``-thread-info`` target id, e.g. "Thread
+# 0x7f12345 (LWP 1234)", or "process 1234" for single-threaded processes:
+_TARGET_ID_TID = re.compile(r"\b(?:LWP|process) (\d+)")
+
+
+def _parse_thread_info(message: dict[str, object]) -> dict[int, Optional[int]]:
+    """
+    Map gdb thread ids to kernel thread ids, where known, from the result of
+    ``-thread-info``.
+    """
+    payload = message["payload"]
+    if not isinstance(payload, dict) or not payload.get("threads"):
+        return {}
+    result = {}
+    for thread in payload["threads"]:
+        match = _TARGET_ID_TID.search(thread.get("target-id", ""))
+        result[int(thread["id"])] = int(match.group(1)) if match else None
+    return result
+
+
+def _thread_states(pids: Iterable[int]) -> dict[int, str]:
+    """
+    Map the kernel thread ids of the given processes to their scheduler state
+    from ``/proc``, e.g. "R" if running or ready to run, "S" if sleeping.
+    """
+    result: dict[int, str] = {}
+    for pid in pids:
+        try:
+            task_ids = os.listdir(f"/proc/{pid}/task")
+        except OSError:
+            continue
+        for task_id in task_ids:
+            try:
+                with open(f"/proc/{pid}/task/{task_id}/stat", "rb") as f:
+                    stat = f.read()
+            except OSError:
+                continue
+            # The state follows the command name, which is in parentheses and
+            # may itself contain spaces or parentheses:
+            result[int(task_id)] = stat.rpartition(b")")[2].split()[0].decode()
+    return result
+
+
+def _off_cpu(
+    process: Process, tids: dict[int, Optional[int]]
+) -> tuple[list[int], bool]:
+    """
+    For on-CPU sampling, given the kernel thread id of each gdb thread as of
+    the last sample, return the gdb ids of threads that aren't running, and
+    whether any thread, including ones started since, is running.
+    """
+    states = _thread_states(_inferiors(process).group_pids.values())
+    off_cpu = [
+        thread_id
+        for (thread_id, tid) in tids.items()
+        if tid is not None and states.get(tid, "R") != "R"
+    ]
+    # If we can't tell, interrupt anyway:
+    running = not states or "R" in states.values()
+    return off_cpu, running
+
+
+# Sampler modes:
+SEQUENTIAL = "sequential"
+PIPELINED = "pipelined"
+EMBEDDED = "embedded"
+SAMPLER_MODES = (SEQUENTIAL, PIPELINED, EMBEDDED)
+
+# Unwinding strategies:
+FULL = "full"
+ADAPTIVE = "adaptive"
+UNWIND_STRATEGIES = (FULL, ADAPTIVE)
+
+# How many frames ADAPTIVE unwinding asks gdb for at a time:
+_UNWIND_CHUNK = 4
+
+# The script EMBEDDED mode loads into gdb's own Python interpreter:
+_GDB_SAMPLER_SCRIPT = os.path.join(os.path.dirname(__file__), "_gdb_sampler.py")
+
+
+@dataclass(frozen=True)
+class SamplerOptions:
+    """
+    How to sample the profiled process.
+    """
+
+    # SEQUENTIAL waits for each command's reply before sending the next one.
+    # PIPELINED sends all the commands for a sample as one batch once the
+    # process has stopped, matching up replies by their MI tokens. EMBEDDED
+    # runs the whole sampling loop inside gdb's Python interpreter, which
+    # streams compact records back over a FIFO.
+    mode: str = SEQUENTIAL
+    # Seconds between samples:
+    interval: float = 0.010
+    # Randomly move each sample by up to this fraction of the interval, to
+    # avoid aliasing with loops that run in step with the sampling:
+    jitter: float = 0.0
+    # How many frames of each thread's stack to record:
+    depth: int = 10
+    # Only record instruction addresses while the process is stopped, and
+    # resolve them to source lines (once per unique address) after it has
+    # continued.  Only supported by EMBEDDED.
+    defer_symbols: bool = False
+    # FULL reads ``depth`` frames of every stack.  ADAPTIVE reads a few frames
+    # at a time, stopping at the frame the sample is attributed to (Numba code
+    # or the threadpool), so deep stacks underneath it aren't read at all, at
+    # the cost of losing callers for inclusive time and flamegraphs.
+    unwind: str = FULL
+    # Record instruction addresses, and disassemble the Numba functions they're
+    # in:
+    instructions: bool = False
+    # Before interrupting, check which threads are running according to
+    # ``/proc``, and only sample those; if none are, don't interrupt at all.
+    # Threads that were waiting, e.g. for I/O or a lock, are counted as
+    # off-CPU instead.
+    on_cpu: bool = False
+
+
+class _Schedule:
+    """
+    Decide when to take the next sample.
+
+    Sample times are on a fixed grid starting from when sampling started, so
+    the time taken by each sample doesn't make the rate drift.
+    """
+
+    def __init__(self, interval: float, jitter: float) -> None:
+        self.interval = interval
+        self.jitter = jitter
+        self.next_tick = time()
+
+    def delay(self) -> float:
+        """
+        Return how many seconds to wait until the next sample.
+        """
+        now = time()
+        self.next_tick += self.interval
+        if self.next_tick < now:
+            # We fell behind, e.g. gdb was slow; rather than catching up with
+            # a burst of samples, continue the grid from now:
+            self.next_tick = now
+        jitter = uniform(-self.jitter, self.jitter) * self.interval
+        return max(self.next_tick + jitter - now, 0)
+
+
+def _stack_command(
+    thread_id: int, low: int, high: int, token: Optional[int] = None
+) -> bytes:
+    """
+    The MI command to list frames ``low`` to ``high`` (inclusive) of a thread.
+    """
+    return b"%s-stack-list-frames --thread %d --no-frame-filters %d %d\n" % (
+        b"" if token is None else b"%d" % token,
+        thread_id,
+        low,
+        high,
+    )
+
+
+def _next_chunk(
+    stack: Optional[list[Frame]], requested: int, options: SamplerOptions
+) -> Optional[int]:
+    """
+    For ADAPTIVE unwinding, given the frames read so far after asking for the
+    first ``requested`` frames, return the index of the next frame to read, or
+    ``None`` if the stack is complete.
+    """
+    if stack is None or len(stack) >= options.depth:
+        return None
+    if len(stack) < requested:
+        # gdb returned fewer frames than we asked for; that's the whole stack:
+        return None
+    if stack[-1].file.endswith(".py"):
+        # Numba functions that were inlined into each other share one machine
+        # code frame, but gdb lists each call site as a separate frame, which
+        # may be in the next chunk:
+        return len(stack)
+    # Earlier chunks may have ended in Numba frames too, so check all of them:
+    if any(_is_attributable(frame) for frame in stack):
+        return None
+    return len(stack)
+
+
+def _chunk_high(low: int, options: SamplerOptions) -> int:
+    """
+    The index of the last frame in an ADAPTIVE chunk starting at ``low``.
+    """
+    return min(low + _UNWIND_CHUNK, options.depth) - 1
+
+
+def _first_high(options: SamplerOptions) -> int:
+    """
+    The index of the last frame to ask for in the first request for a stack.
+    Frame ranges are inclusive, so for FULL unwinding this is ``depth - 1``.
+    """
+    if options.unwind == ADAPTIVE:
+        return _chunk_high(0, options)
+    return options.depth - 1
+
+
+def _extend_stack(
+    stack: Optional[list[Frame]],
+    result: dict[str, object],
+    with_addresses: bool = False,
+) -> Optional[list[Frame]]:
+    """
+    Add the frames from the reply to a ``-stack-list-frames`` to the stack
+    read so far, which is ``None`` for the first chunk.
+    """
+    frames = _parse_stack(result, with_addresses)
+    if stack is None:
+        return frames
+    if frames is None:
+        # Asking for frames past the end of the stack is an error, which means
+        # we already have all the frames:
+        return stack
+    return stack + frames
+
+
+def _disassembly_command(address: int, token: Optional[int] = None) -> bytes:
+    """
+    The MI command to disassemble the function containing an address, with
+    source lines.
+    """
+    return b"%s-data-disassemble -a %d -- 4\n" % (
+        b"" if token is None else b"%d" % token,
+        address,
+    )
+
+
+def _undisassembled(
+    threads: dict[int, Optional[list[Frame]]], disassembled: set[int]
+) -> list[int]:
+    """
+    Return addresses of Numba frames that aren't in any function we've already
+    disassembled.
+    """
+    result = set()
+    for stack in threads.values():
+        for frame in stack or ():
+            if (
+                frame.file.endswith(".py")
+                and frame.address is not None
+                and frame.address not in disassembled
+            ):
+                result.add(frame.address)
+    return sorted(result)
+
+
+def _add_disassembly(
+    address: int,
+    instructions: list[Instruction],
+    disassembled: set[int],
+    disassembly: list[Instruction],
+) -> None:
+    """
+    Record the disassembly of the function containing ``address``.
+    """
+    for instruction in instructions:
+        if instruction.address not in disassembled:
+            disassembled.add(instruction.address)
+            disassembly.append(instruction)
+    # Even if disassembly failed, don't try again:
+    disassembled.add(address)
+
+
+async def _sample_sequential(
+    process: Process, options: SamplerOptions
+) -> AsyncGenerator[Sample, None]:
     assert process.stdin is not None
+    schedule = _Schedule(options.interval, options.jitter)
+    # Addresses in functions we've already disassembled:
+    disassembled: set[int] = set()
+    # For on-CPU sampling, map gdb thread id to kernel thread id:
+    tids: dict[int, Optional[int]] = {}
     while True:
         start = time()
+        off_cpu: list[int] = []
+        if options.on_cpu:
+            off_cpu, running = _off_cpu(process, tids)
+            if off_cpu and not running:
+                # Nothing to sample, so don't stop the process at all:
+                yield Sample(
+                    threads={},
+                    timestamp=start,
+                    pids=_inferiors(process).pids(off_cpu),
+                    off_cpu=off_cpu,
+                )
+                await asyncio.sleep(schedule.delay())
+                continue
+
         process.stdin.write(b"-exec-interrupt\n")
         await _read_until_done(process)
+        await _load_pending_symbols(process)
 
-        process.stdin.write(b"-stack-list-frames --no-frame-filters 0 10\n")
-        message = await _read_until_done(process)
-        if message["payload"] is None or "stack" not in message["payload"]:  # type: ignore
-            # Bad read of some sort:
-            yield None
+        if options.on_cpu:
+            process.stdin.write(b"-thread-info\n")
+            tids = _parse_thread_info(await _read_until_done(process))
+            off_cpu = [t for t in off_cpu if t in tids]
+            thread_ids = [t for t in tids if t not in off_cpu]
         else:
-            yield [
-                Frame(file=f["fullname"], line=int(f["line"]))
-                for f in message["payload"]["stack"]  # type: ignore
-                if ("fullname" in f) and ("line" in f)
-            ]
+            process.stdin.write(b"-thread-list-ids\n")
+            thread_ids = _parse_thread_ids(await _read_until_done(process))
+        threads = {}
+        for thread_id in thread_ids:
+            if options.unwind == ADAPTIVE:
+                stack: Optional[list[Frame]] = None
+                low: Optional[int] = 0
+                while low is not None:
+                    high = _chunk_high(low, options)
+                    process.stdin.write(_stack_command(thread_id, low, high))
+                    stack = _extend_stack(
+                        stack, await _read_until_done(process), options.instructions
+                    )
+                    low = _next_chunk(stack, high + 1, options)
+                threads[thread_id] = stack
+            else:
+                process.stdin.write(_stack_command(thread_id, 0, _first_high(options)))
+                threads[thread_id] = _parse_stack(
+                    await _read_until_done(process), options.instructions
+                )
+
+        disassembly: list[Instruction] = []
+        for address in _undisassembled(threads, disassembled):
+            if address not in disassembled:
+                process.stdin.write(_disassembly_command(address))
+                instructions = _parse_disassembly(await _read_until_done(process))
+                _add_disassembly(address, instructions, disassembled, disassembly)
 
         process.stdin.write(b"-exec-continue\n")
         await _read_until_done(process)
         elapsed = time() - start
-        await asyncio.sleep(max(0.010 - elapsed, 0))
-        # print(time() - start)
+        yield Sample(
+            threads=threads,
+            stop_time=elapsed,
+            timestamp=start,
+            disassembly=disassembly,
+            pids=_inferiors(process).pids([*threads, *off_cpu]),
+            off_cpu=off_cpu,
+        )
+        await asyncio.sleep(schedule.delay())
+
+
+async def _sample_pipelined(
+    process: Process, options: SamplerOptions
+) -> AsyncGenerator[Sample, None]:
+    assert process.stdin is not None
+    tokens = count(1)
+    # With on-CPU sampling, threads are listed with -thread-info, which also
+    # maps gdb thread id to kernel thread id:
+    list_command = b"-thread-info" if options.on_cpu else b"-thread-list-ids"
+    process.stdin.write(list_command + b"\n")
+    result = await _read_until_done(process)
+    tids = _parse_thread_info(result) if options.on_cpu else {}
+    thread_ids = list(tids) if options.on_cpu else _parse_thread_ids(result)
+    schedule = _Schedule(options.interval, options.jitter)
+    adaptive = options.unwind == ADAPTIVE
+    # Addresses in functions we've already disassembled:
+    disassembled: set[int] = set()
+    while True:
+        start = time()
+        off_cpu: list[int] = []
+        if options.on_cpu:
+            off_cpu, running = _off_cpu(process, tids)
+            if off_cpu and not running:
+                # Nothing to sample, so don't stop the process at all:
+                yield Sample(
+                    threads={},
+                    timestamp=start,
+                    pids=_inferiors(process).pids(off_cpu),
+                    off_cpu=off_cpu,
+                )
+                await asyncio.sleep(schedule.delay())
+                continue
+
+        process.stdin.write(b"-exec-interrupt\n")
+        await _read_until_stopped(process)
+        await _load_pending_symbols(process)
+
+        # Threads may have started or exited since the last sample; the
+        # refreshed list is used to filter this sample and for the next one.
+        list_token = next(tokens)
+        stack_tokens = {
+            thread_id: next(tokens)
+            for thread_id in thread_ids
+            if thread_id not in off_cpu
+        }
+        batch = [b"%d%s\n" % (list_token, list_command)]
+        high = _first_high(options)
+        for thread_id, token in stack_tokens.items():
+            batch.append(_stack_command(thread_id, 0, high, token))
+        # Later chunks and disassembly depend on these replies, so we can't
+        # always continue straight away:
+        continue_later = adaptive or options.instructions
+        if continue_later:
+            process.stdin.write(b"".join(batch))
+            results = await _read_results(process, [list_token, *stack_tokens.values()])
+        else:
+            continue_token = next(tokens)
+            batch.append(b"%d-exec-continue\n" % continue_token)
+            process.stdin.write(b"".join(batch))
+            results = await _read_results(
+                process, [list_token, *stack_tokens.values(), continue_token]
+            )
+        if options.on_cpu:
+            tids = _parse_thread_info(results[list_token])
+            thread_ids = list(tids)
+            off_cpu = [t for t in off_cpu if t in tids]
+        else:
+            thread_ids = _parse_thread_ids(results[list_token])
+        threads = {
+            thread_id: _parse_stack(results[token], options.instructions)
+            for (thread_id, token) in stack_tokens.items()
+            if thread_id in thread_ids
+        }
+
+        if adaptive:
+            # Fetch the next chunk of every unfinished stack as one batch:
+            requested = dict.fromkeys(threads, high + 1)
+            while True:
+                chunks = {}
+                for thread_id, frame_count in requested.items():
+                    low = _next_chunk(threads[thread_id], frame_count, options)
+                    if low is not None:
+                        chunks[thread_id] = (low, next(tokens))
+                if not chunks:
+                    break
+                process.stdin.write(
+                    b"".join(
+                        _stack_command(thread_id, low, _chunk_high(low, options), token)
+                        for (thread_id, (low, token)) in chunks.items()
+                    )
+                )
+                results = await _read_results(
+                    process, [token for (_, token) in chunks.values()]
+                )
+                requested = {}
+                for thread_id, (low, token) in chunks.items():
+                    threads[thread_id] = _extend_stack(
+                        threads[thread_id], results[token], options.instructions
+                    )
+                    requested[thread_id] = _chunk_high(low, options) + 1
+
+        disassembly: list[Instruction] = []
+        if options.instructions:
+            # Usually empty, once the hot functions have been seen:
+            disassembly_tokens = {
+                address: next(tokens)
+                for address in _undisassembled(threads, disassembled)
+            }
+            process.stdin.write(
+                b"".join(
+                    _disassembly_command(address, token)
+                    for (address, token) in disassembly_tokens.items()
+                )
+            )
+            results = await _read_results(process, list(disassembly_tokens.values()))
+            for address, token in disassembly_tokens.items():
+                _add_disassembly(
+                    address,
+                    _parse_disassembly(results[token]),
+                    disassembled,
+                    disassembly,
+                )
+
+        if continue_later:
+            continue_token = next(tokens)
+            process.stdin.write(b"%d-exec-continue\n" % continue_token)
+            await _read_results(process, [continue_token])
+
+        elapsed = time() - start
+        yield Sample(
+            threads=threads,
+            stop_time=elapsed,
+            timestamp=start,
+            disassembly=disassembly,
+            pids=_inferiors(process).pids([*threads, *off_cpu]),
+            off_cpu=off_cpu,
+        )
+        await asyncio.sleep(schedule.delay())
+
+
+def _mi_string(value: str) -> str:
+    """
+    Quote a string as a gdb/MI C string.
+    """
+    return json.dumps(value, ensure_ascii=False)
+
+
+async def _sample_embedded(
+    process: Process, options: SamplerOptions
+) -> AsyncGenerator[Sample, None]:
+    assert process.stdin is not None
+    loop = asyncio.get_running_loop()
+    with TemporaryDirectory() as tempdir:
+        fifo_path = os.path.join(tempdir, "samples")
+        os.mkfifo(fifo_path)
+        # Opening read-write means we don't block waiting for gdb to open it,
+        # and don't see EOF before it does; end of sampling is instead noticed
+        # by watching gdb's MI output for the process exiting.
+        fifo = os.fdopen(os.open(fifo_path, os.O_RDWR | os.O_NONBLOCK), "rb", 0)
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), fifo
+        )
+
+        for command in [
+            f"source {_GDB_SAMPLER_SCRIPT}",
+            f"python profila_start({fifo_path!r}, {options.interval!r}, "
+            + f"{options.jitter!r}, {options.depth!r}, "
+            + f"{options.defer_symbols!r}, {options.unwind == ADAPTIVE!r}, "
+            + f"{_THREADPOOL_LIBRARIES!r}, {options.instructions!r}, "
+            + f"{_inferiors(process).symbol_libraries!r}, {options.on_cpu!r})",
+        ]:
+            process.stdin.write(
+                f"-interpreter-exec console {_mi_string(command)}\n".encode("utf-8")
+            )
+            await _read_until_done(process)
+
+        async def watch_mi_output() -> None:
+            try:
+                await _read_until(process, lambda result: False)
+            except asyncio.CancelledError:
+                # Sampling is being stopped early, see below:
+                raise
+            except BaseException:
+                reader.feed_eof()
+                raise
+
+        watcher = asyncio.ensure_future(watch_mi_output())
+        frames: dict[int, Frame] = {}
+        # Map thread id to process id:
+        pids: dict[int, int] = {}
+        # Instructions disassembled since the last sample:
+        disassembly: list[Instruction] = []
+        # Threads that weren't running, for the next sample:
+        off_cpu: list[int] = []
+        try:
+            while True:
+                record = (await reader.readline()).decode("utf-8").rstrip("\n")
+                if not record or record == "E":
+                    break
+                kind, data = record.split(" ", 1)
+                if kind == "F":
+                    frame_id, line, file, func, library, address = data.split("\t")
+                    frames[int(frame_id)] = Frame(
+                        file=file,
+                        line=int(line),
+                        func=func or None,
+                        library=library or None,
+                        address=int(address) if address else None,
+                    )
+                elif kind == "P":
+                    thread_id, pid = data.split(" ")
+                    pids[int(thread_id)] = int(pid)
+                elif kind == "O":
+                    off_cpu = [int(thread_id) for thread_id in data.split(",")]
+                elif kind == "I":
+                    address, line, file, func, text = data.split("\t")
+                    disassembly.append(
+                        Instruction(
+                            address=int(address),
+                            file=file,
+                            line=int(line),
+                            func=func or None,
+                            text=text,
+                        )
+                    )
+                elif kind == "S":
+                    times, *stacks = data.split("\t")
+                    stop_time, timestamp = times.split(" ")
+                    threads: dict[int, Optional[list[Frame]]] = {}
+                    for stack in stacks:
+                        thread_id, frame_ids = stack.split(":", 1)
+                        if frame_ids == "!":
+                            threads[int(thread_id)] = None
+                        elif frame_ids:
+                            threads[int(thread_id)] = [
+                                frames[int(i)] for i in frame_ids.split(",")
+                            ]
+                        else:
+                            threads[int(thread_id)] = []
+                    yield Sample(
+                        threads=threads,
+                        stop_time=float(stop_time),
+                        timestamp=float(timestamp),
+                        disassembly=disassembly,
+                        pids={t: pids[t] for t in [*threads, *off_cpu] if t in pids},
+                        off_cpu=off_cpu,
+                    )
+                    disassembly = []
+                    off_cpu = []
+        except GeneratorExit:
+            if not watcher.done():
+                # We're being closed before the process exited, so stop the
+                # sampler in gdb, leaving the process running.  Once it's
+                # finished its current sample it writes an "E" record.
+                watcher.cancel()
+                await asyncio.gather(watcher, return_exceptions=True)
+                process.stdin.write(
+                    b"-interpreter-exec console "
+                    + _mi_string("python profila_stop()").encode("utf-8")
+                    + b"\n"
+                )
+                await _read_until_done(process)
+                while (await reader.readline()).rstrip(b"\n") not in (b"E", b""):
+                    pass
+            raise
+        finally:
+            transport.close()
+            if not watcher.done():
+                watcher.cancel()
+        # Re-raise ProcessExited, or any other error:
+        await watcher
 
 
 class ProcessExited(Exception):
     """The profiled process has exited."""
 
 
-async def _read_until_done(process: Process) -> dict[str, object]:
+class AttachError(RuntimeError):
+    """gdb couldn't attach to a process."""
+
+
+class _Inferiors:
     """
-    Read until a command is done, return its result dictionary.
+    Track which process each thread belongs to, and with fast start which
+    libraries need symbols, from gdb's notifications.
+    """
+
+    def __init__(self) -> None:
+        # Map thread group id, e.g. "i1", to process id:
+        self.group_pids: dict[str, int] = {}
+        # Map thread id to thread group id:
+        self.thread_groups: dict[int, str] = {}
+        # With fast start, regular expressions for the libraries to load
+        # symbols for, and whether a matching library was loaded since
+        # symbols were last loaded:
+        self.symbol_libraries: tuple[str, ...] = ()
+        self.symbols_pending = False
+
+    def update(self, message: str, payload: dict[str, str]) -> None:
+        if message == "thread-group-started":
+            self.group_pids[payload["id"]] = int(payload["pid"])
+        elif message == "thread-group-exited":
+            self.group_pids.pop(payload["id"], None)
+        elif message == "thread-created":
+            self.thread_groups[int(payload["id"])] = payload["group-id"]
+        elif message == "thread-exited":
+            self.thread_groups.pop(int(payload["id"]), None)
+        elif message == "library-loaded":
+            if any(
+                re.search(pattern, payload["target-name"])
+                for pattern in self.symbol_libraries
+            ):
+                self.symbols_pending = True
+
+    def pids(self, thread_ids: Iterable[int]) -> dict[int, int]:
+        """
+        Map the given thread ids to process ids, where known.
+        """
+        result = {}
+        for thread_id in thread_ids:
+            pid = self.group_pids.get(self.thread_groups.get(thread_id, ""))
+            if pid is not None:
+                result[thread_id] = pid
+        return result
+
+
+_INFERIORS: "WeakKeyDictionary[Process, _Inferiors]" = WeakKeyDictionary()
+
+
+def _inferiors(process: Process) -> _Inferiors:
+    inferiors = _INFERIORS.get(process)
+    if inferiors is None:
+        inferiors = _INFERIORS[process] = _Inferiors()
+    return inferiors
+
+
+async def _read_until(
+    process: Process, is_done: Callable[[dict[str, object]], bool]
+) -> dict[str, object]:
+    """
+    Read until ``is_done()`` returns true for a message, and return it.
     """
     assert process.stdin is not None
     while True:
@@ -85,33 +897,218 @@ async def _read_until_done(process: Process) -> dict[str, object]:
         assert isinstance(result, dict)
         if result["type"] == "output":
             print(result["payload"])
-        if result["type"] == "result":
+        if is_done(result):
             return result
-        if result["type"] == "notify" and result["message"] == "thread-group-exited":
-            await exit_subprocess(process)
-            raise ProcessExited()
+        if result["type"] == "notify":
+            message = cast(str, result["message"])
+            payload = cast(dict[str, str], result["payload"])
+            _inferiors(process).update(message, payload)
+            # Child processes exiting doesn't end profiling, only the first
+            # process exiting does:
+            if message == "thread-group-exited" and payload["id"] == "i1":
+                await exit_subprocess(process)
+                raise ProcessExited()
+
+
+async def _read_until_done(process: Process) -> dict[str, object]:
+    """
+    Read until a command is done, return its result dictionary.
+    """
+    return await _read_until(process, lambda result: result["type"] == "result")
 
 
-async def read_samples(process: Process) -> AsyncIterable[Optional[list[Frame]]]:
+async def _read_until_stopped(process: Process) -> dict[str, object]:
+    """
+    Read until the process has stopped, return the stop notification.
+    """
+    return await _read_until(
+        process,
+        lambda result: result["type"] == "notify" and result["message"] == "stopped",
+    )
+
+
+async def _read_results(
+    process: Process, tokens: list[int]
+) -> dict[int, dict[str, object]]:
+    """
+    Read until the results of all commands sent with the given tokens have
+    arrived, return them keyed by token.
+    """
+    pending = set(tokens)
+    results = {}
+    while pending:
+        result = await _read_until_done(process)
+        token = result["token"]
+        if token in pending:
+            pending.remove(token)
+            results[token] = result
+    return results
+
+
+async def read_samples(
+    process: Process, options: SamplerOptions = SamplerOptions()
+) -> AsyncGenerator[Sample, None]:
     """
     Return async iterable of samples read from the process.
 
-    Call on result of ``run_subprocess()`` or ``attach_subprocess()``.
+    Call on result of ``run_subprocess()`` or ``attach_subprocess()``.  To stop
+    sampling before the process exits, call ``aclose()`` on the result; the
+    process is left running, and sampling can be started again later with
+    another call.
     """
+    if options.mode == PIPELINED:
+        samples = _sample_pipelined(process, options)
+    elif options.mode == EMBEDDED:
+        samples = _sample_embedded(process, options)
+    else:
+        samples = _sample_sequential(process, options)
     try:
-        async for sample in _sample(process):
+        async for sample in samples:
             yield sample
     except ProcessExited:
         await process.wait()
         return
+    finally:
+        await samples.aclose()
+
+
+async def _follow_children(process: Process) -> None:
+    """
+    Keep debugging child processes after a fork, as additional inferiors, and
+    run all of them whenever the process is continued.
+    """
+    assert process.stdin is not None
+    for command in [
+        b"-gdb-set detach-on-fork off",
+        b"-gdb-set schedule-multiple on",
+    ]:
+        process.stdin.write(command + b"\n")
+        await _read_until_done(process)
+
+
+async def _console(process: Process, command: str) -> dict[str, object]:
+    """
+    Run a gdb console command, return its result dictionary.
+    """
+    assert process.stdin is not None
+    process.stdin.write(
+        f"-interpreter-exec console {_mi_string(command)}\n".encode("utf-8")
+    )
+    return await _read_until_done(process)
+
+
+async def _fast_start(process: Process, load_symbols: list[str]) -> None:
+    """
+    Stop gdb loading symbols for every shared library, which is most of the
+    time it takes to start profiling.  Symbols are instead loaded for the
+    libraries profila needs, and those matching ``load_symbols``.
+    """
+    assert process.stdin is not None
+    process.stdin.write(b"-gdb-set auto-solib-add off\n")
+    await _read_until_done(process)
+    _inferiors(process).symbol_libraries = (*_FAST_START_LIBRARIES, *load_symbols)
+
+
+async def _load_symbols(process: Process) -> None:
+    """
+    With fast start, load symbols for all the libraries we need that have been
+    loaded so far.  The process must be stopped.
+    """
+    inferiors = _inferiors(process)
+    inferiors.symbols_pending = False
+    for pattern in inferiors.symbol_libraries:
+        await _console(process, f"sharedlibrary {pattern}")
+
+
+async def _load_pending_symbols(process: Process) -> None:
+    """
+    With fast start, load symbols for the libraries we need that were loaded
+    since the last sample.  The process must be stopped.
+    """
+    if _inferiors(process).symbols_pending:
+        await _load_symbols(process)
+
+
+def _library_addresses(pid: int, pattern: str) -> dict[str, int]:
+    """
+    Map the paths of a process' shared libraries matching a regular
+    expression to the address each is loaded at, from ``/proc``.
+    """
+    regex = re.compile(pattern)
+    result: dict[str, int] = {}
+    try:
+        with open(f"/proc/{pid}/maps") as f:
+            for line in f:
+                # E.g. "7f12...-7f13... r--p 00000000 08:01 1234  /lib/x.so":
+                fields = line.split(maxsplit=5)
+                if len(fields) < 6 or int(fields[2], 16) != 0:
+                    continue
+                path = fields[5].rstrip("\n")
+                if path not in result and regex.search(path):
+                    result[path] = int(fields[0].split("-")[0], 16)
+    except OSError:
+        pass
+    return result
+
+
+def _child_pids(pid: int) -> list[int]:
+    """
+    The direct children of a process, from ``/proc``.
+    """
+    result: list[int] = []
+    try:
+        task_ids = os.listdir(f"/proc/{pid}/task")
+    except OSError:
+        return result
+    for task_id in task_ids:
+        try:
+            with open(f"/proc/{pid}/task/{task_id}/children") as f:
+                result.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return sorted(set(result))
+
+
+def find_pids(pattern: str) -> list[int]:
+    """
+    Find processes whose command line matches a regular expression, like
+    ``pgrep -f``.  The current process is never included.
+    """
+    regex = re.compile(pattern)
+    result = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit() or int(entry) == os.getpid():
+            continue
+        try:
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                cmdline = f.read()
+        except OSError:
+            continue
+        # Arguments are separated, and terminated, by NUL bytes:
+        command = os.fsdecode(cmdline).rstrip("\0").replace("\0", " ")
+        if command and regex.search(command):
+            result.append(int(entry))
+    return sorted(result)
 
 
 async def run_subprocess(
     python_cli_args: list[str],
+    follow_children: bool = False,
+    load_symbols: Optional[list[str]] = None,
 ) -> Process:
     """
     Run Python in a subprocess.
+
+    With ``follow_children``, child processes it starts, e.g. by
+    ``multiprocessing``, are sampled too.
+
+    If ``load_symbols`` isn't ``None``, start faster by only loading symbols
+    for Numba's compiled code, the libraries profila needs, and libraries
+    whose path matches one of the given regular expressions.  The process
+    then runs unsampled until it loads Numba's compiler.
     """
+    if follow_children and load_symbols is not None:
+        raise ValueError("Fast start can't be combined with following children.")
     env = os.environ.copy()
     # Make sure we get useful info from Numba
     env["NUMBA_DEBUGINFO"] = "1"
@@ -129,6 +1126,15 @@ async def run_subprocess(
 
     process.stdin.write(b"-gdb-set mi-async\n")
     await _read_until_done(process)
+    if follow_children:
+        await _follow_children(process)
+    if load_symbols is not None:
+        await _fast_start(process, load_symbols)
+        # gdb only reads the list of code that was already compiled when the
+        # process starts, so llvmlite's symbols must be loaded before Numba
+        # compiles anything; stop as soon as it's loaded:
+        process.stdin.write(b"-catch-load -t %s\n" % _JIT_LIBRARY.encode("ascii"))
+        await _read_until_done(process)
     process.stdin.write(f"-file-exec-file {quote(sys.executable)}\n".encode("utf-8"))
     await _read_until_done(process)
     process.stdin.write(
@@ -141,32 +1147,113 @@ async def run_subprocess(
     await _read_until_done(process)
     process.stdin.write(b"-exec-run\n")
     await _read_until_done(process)
+    if load_symbols is not None:
+        try:
+            await _read_until_stopped(process)
+        except ProcessExited:
+            # It never loaded Numba, so there's nothing to sample:
+            return process
+        await _console(process, f"sharedlibrary {_JIT_LIBRARY}")
+        await _load_symbols(process)
+        process.stdin.write(b"-exec-continue\n")
+        await _read_until_done(process)
 
     return process
 
 
-async def attach_subprocess(pid: str) -> Process:
+async def attach_subprocess(
+    pid: str, follow_children: bool = False, load_symbols: Optional[list[str]] = None
+) -> Process:
     """
     Attach to an existing Python subprocess.
+
+    With ``follow_children``, its existing child processes are attached to as
+    well, and new ones are followed.  When gdb exits, e.g. via
+    ``exit_subprocess()``, it detaches from all of them and leaves them
+    running.
+
+    ``load_symbols`` is as for ``run_subprocess()``.
+
+    Raises ``AttachError`` if gdb can't attach to the process.
     """
+    if follow_children and load_symbols is not None:
+        raise ValueError("Fast start can't be combined with following children.")
     process = await asyncio.create_subprocess_exec(
         GDB_PATH,
         "--interpreter=mi3",
         stdout=asyncio.subprocess.PIPE,
         stdin=asyncio.subprocess.PIPE,
+        # Keep Ctrl-C in the terminal from reaching gdb, which would interrupt
+        # the process it's attached to:
+        start_new_session=True,
     )
     assert process.stdin is not None
 
     process.stdin.write(b"-gdb-set mi-async\n")
     await _read_until_done(process)
+    if load_symbols is not None:
+        await _fast_start(process, load_symbols)
+        # gdb only reads the list of code Numba already compiled when it
+        # attaches, so llvmlite's symbols must be loaded beforehand, at the
+        # address the process loaded it at:
+        for path, address in _library_addresses(int(pid), _JIT_LIBRARY).items():
+            await _console(process, f"add-symbol-file {quote(path)} -o {address:#x}")
+    # With fast start, symbols for the other libraries we need are loaded at
+    # the first sample, once gdb has told us which libraries are loaded.
     process.stdin.write(b"-target-attach %s\n" % pid.encode("ascii"))
-    await _read_until_done(process)
+    result = await _read_until_done(process)
+    if result["message"] == "error":
+        await exit_subprocess(process)
+        message = cast(dict[str, str], result["payload"])["msg"]
+        raise AttachError(f"Couldn't attach to process {pid}: {message}")
+    if follow_children:
+        await _follow_children(process)
+        for child in _child_pids(int(pid)):
+            process.stdin.write(b"-add-inferior\n")
+            result = await _read_until_done(process)
+            group_id = cast(dict[str, str], result["payload"])["inferior"]
+            process.stdin.write(
+                b"-target-attach --thread-group %s %d\n"
+                % (group_id.encode("ascii"), child)
+            )
+            result = await _read_until_done(process)
+            if result["message"] == "error":
+                # Most likely the child exited since we listed it:
+                message = cast(dict[str, str], result["payload"])["msg"]
+                print(
+                    f"Couldn't attach to child process {child}, skipping: {message}",
+                    file=sys.stderr,
+                )
+                process.stdin.write(b"-remove-inferior %s\n" % group_id.encode("ascii"))
+                await _read_until_done(process)
     process.stdin.write(b"-exec-continue\n")
     await _read_until_done(process)
 
     return process
 
 
+async def keep_running(process: Process) -> None:
+    """
+    Keep an attached process running while it's not being sampled, until
+    cancelled.
+
+    gdb's output is still read, so it doesn't fill the pipe and block gdb, and
+    if a signal stops the process it's continued.  SIGINT, e.g. from
+    interrupting a Jupyter kernel, is passed on to the process; gdb doesn't do
+    that by default, since it's also how gdb interrupts the process itself.
+    """
+    assert process.stdin is not None
+    while True:
+        stopped = await _read_until_stopped(process)
+        payload = cast(dict[str, object], stopped["payload"])
+        if payload.get("signal-name") == "SIGINT":
+            command = "-interpreter-exec console " + _mi_string("signal SIGINT")
+        else:
+            command = "-exec-continue"
+        process.stdin.write(command.encode("utf-8") + b"\n")
+        await _read_until_done(process)
+
+
 async def exit_subprocess(process: Process) -> None:
     """Exit GDB."""
     assert process.stdin is not None
@@ -0,0 +1,481 @@
+"""
+A sampler that runs inside gdb's embedded Python interpreter.
+
+This module is NOT imported by profila; ``_gdb.py`` loads it into gdb with the
+``source`` command and then calls ``profila_start()``.  The interrupt, unwind,
+continue loop then runs entirely inside gdb, and compact text records are
+written to a FIFO that profila reads:
+
+* ``F <id>\\t<line>\\t<file>\\t<func>\\t<library>\\t<address>``: defines a frame
+  id, sent the first time a frame is seen.  Empty fields mean gdb didn't know
+  the value; the address is only recorded with ``instructions``.
+* ``I <address>\\t<line>\\t<file>\\t<func>\\t<instruction>``: one disassembled
+  instruction of a Numba function, sent before the first sample it appeared
+  in, if ``instructions`` is set.
+* ``P <thread id> <pid>``: the process a thread belongs to, sent before the
+  first sample it appeared in.  There's more than one process if gdb is
+  following child processes.
+* ``O <thread id>,<thread id>,...``: with ``on_cpu``, the threads that weren't
+  running and so weren't sampled, sent before the sample they were skipped in.
+* ``S <stop time> <timestamp>\\t<thread id>:<frame id>,<frame id>,...\\t...``:
+  one sample, with each thread's stack innermost frame first.  A stack of ``!``
+  means that thread couldn't be unwound.
+* ``E``: sampling was stopped by ``profila_stop()``, and the process left
+  running.  Nothing more is written.
+
+With ``defer_symbols``, only instruction addresses are collected while the
+process is stopped.  They're resolved to source lines after it has been
+continued, with a cache shared by all samples, so each unique address is only
+resolved once.  An address in code where functions were inlined into each
+other resolves to one frame per function, as if they hadn't been inlined,
+just like gdb's own inline frames.
+
+With ``adaptive``, unwinding each stack stops at the first frame the sample is
+attributed to: Numba code, or one of the given threadpool libraries.
+
+With ``instructions``, each Numba function is disassembled the first time it's
+seen, while the process is still stopped.
+
+With ``on_cpu``, each thread's state is read from ``/proc`` before
+interrupting, and only running threads are sampled.  If no thread is running
+the process isn't interrupted at all, and the sample has no stacks.
+
+With ``symbol_libraries``, gdb isn't loading symbols for shared libraries by
+itself, so at most once a second symbols are loaded for newly loaded
+libraries matching any of these regular expressions.
+"""
+
+import os
+from random import uniform
+import threading
+from time import perf_counter, time
+from typing import Optional, TextIO
+
+import gdb
+
+
+class _Sampler:
+    """
+    Interrupt the process every ``interval`` seconds and record all stacks.
+
+    Sample times are on a fixed grid starting from when sampling started, so
+    the time taken by each sample doesn't make the rate drift.
+    """
+
+    def __init__(
+        self,
+        output: TextIO,
+        interval: float,
+        jitter: float,
+        depth: int,
+        defer_symbols: bool,
+        adaptive: bool,
+        threadpool_libraries: tuple[str, ...],
+        instructions: bool,
+        symbol_libraries: tuple[str, ...],
+        on_cpu: bool,
+    ) -> None:
+        self.output = output
+        self.interval = interval
+        self.jitter = jitter
+        self.next_tick = time()
+        self.depth = depth
+        self.defer_symbols = defer_symbols
+        self.adaptive = adaptive
+        self.threadpool_libraries = threadpool_libraries
+        self.instructions = instructions
+        self.symbol_libraries = symbol_libraries
+        self.on_cpu = on_cpu
+        # With on_cpu, the global ids of threads that weren't running at the
+        # latest interruption:
+        self.off_cpu: list[int] = []
+        self.next_symbol_load = 0.0
+        # Map (line, file, func, library, address) to frame id:
+        self.frame_ids: dict[tuple[int, str, str, str, str], int] = {}
+        # Map instruction address to frame ids, innermost inlined function
+        # first, for deferred symbols:
+        self.address_ids: dict[int, list[int]] = {}
+        # Frame ids that samples get attributed to, for adaptive unwinding:
+        self.attributable_ids: set[int] = set()
+        # Addresses we've already checked for disassembly, and "I" records to
+        # write once the process has continued:
+        self.disassembled: set[int] = set()
+        self.disassembly: list[str] = []
+        self.interrupted_at: Optional[float] = None
+        self.timestamp = 0.0
+        # Stacks from the latest stop, to be written once we've continued.
+        # These are frame ids, or addresses if symbols are deferred:
+        self.stacks: list[tuple[int, Optional[list[int]]]] = []
+        # Map thread id to process id, for threads seen so far, and "P"
+        # records to write once the process has continued:
+        self.thread_pids: dict[int, int] = {}
+        self.pid_records: list[str] = []
+        self.running = True
+        # Set by profila_stop(), to finish after the current sample:
+        self.stopping = False
+
+    def start(self) -> None:
+        gdb.events.stop.connect(self._on_stop)
+        gdb.events.exited.connect(self._on_exit)
+        self._schedule()
+
+    def _finish(self) -> None:
+        self.running = False
+        # Sampling may be started again later with a new _Sampler:
+        gdb.events.stop.disconnect(self._on_stop)
+        gdb.events.exited.disconnect(self._on_exit)
+        self.output.write("E\n")
+        self.output.close()
+
+    def _schedule(self) -> None:
+        now = time()
+        self.next_tick += self.interval
+        if self.next_tick < now:
+            # We fell behind; rather than catching up with a burst of samples,
+            # continue the grid from now:
+            self.next_tick = now
+        jitter = uniform(-self.jitter, self.jitter) * self.interval
+        delay = max(self.next_tick + jitter - now, 0)
+        timer = threading.Timer(delay, gdb.post_event, (self._interrupt,))
+        timer.daemon = True
+        timer.start()
+
+    def _interrupt(self) -> None:
+        if not self.running:
+            return
+        if self.stopping:
+            self._finish()
+            return
+        self.interrupted_at = perf_counter()
+        self.timestamp = time()
+        if self.on_cpu and not self._check_threads() and self.off_cpu:
+            # Nothing to sample, so don't stop the process at all:
+            self.stacks = []
+            self._write_sample(0.0)
+            return
+        try:
+            gdb.execute("interrupt")
+        except gdb.error:
+            # The process is gone:
+            self.running = False
+
+    def _record_pid(self, thread: gdb.InferiorThread, inferior: gdb.Inferior) -> None:
+        if self.thread_pids.get(thread.global_num) != inferior.pid:
+            self.thread_pids[thread.global_num] = inferior.pid
+            self.pid_records.append(f"P {thread.global_num} {inferior.pid}\n")
+
+    def _check_threads(self) -> bool:
+        """
+        For ``on_cpu``, find the threads that aren't running, and return
+        whether any thread is.
+        """
+        self.off_cpu = []
+        running = False
+        for inferior in gdb.inferiors():
+            if not inferior.pid:
+                continue
+            states = _thread_states(inferior.pid)
+            # If we can't tell, interrupt anyway:
+            if not states or "R" in states.values():
+                running = True
+            for thread in inferior.threads():
+                if thread.is_valid() and states.get(thread.ptid[1], "R") != "R":
+                    self.off_cpu.append(thread.global_num)
+                    self._record_pid(thread, inferior)
+        return running
+
+    def _intern(self, key: tuple[int, str, str, str, str]) -> int:
+        frame_id = self.frame_ids.get(key)
+        if frame_id is None:
+            frame_id = self.frame_ids[key] = len(self.frame_ids)
+            self.output.write(f"F {frame_id}\t" + "\t".join(map(str, key)) + "\n")
+            _, file, _, library, _ = key
+            if file.endswith(".py") or os.path.basename(library).startswith(
+                self.threadpool_libraries
+            ):
+                self.attributable_ids.add(frame_id)
+        return frame_id
+
+    def _address(self, address: int) -> str:
+        """
+        The address as recorded in frame keys, if we're recording them.
+        """
+        return str(address) if self.instructions else ""
+
+    def _frame_id(self, frame: gdb.Frame) -> int:
+        sal = frame.find_sal()
+        address = self._address(frame.pc())
+        if sal.symtab is not None:
+            key = (sal.line, sal.symtab.fullname(), frame.name() or "", "", address)
+        else:
+            library = gdb.solib_name(frame.pc()) or ""
+            key = (0, "", frame.name() or "", library, address)
+        return self._intern(key)
+
+    def _address_ids(self, address: int) -> list[int]:
+        frame_ids = self.address_ids.get(address)
+        if frame_ids is not None:
+            return frame_ids
+
+        # The function containing the address, and if it was inlined, the
+        # functions it was inlined into, innermost first:
+        functions: list[gdb.Symbol] = []
+        try:
+            block: Optional[gdb.Block] = gdb.block_for_pc(address)
+        except RuntimeError:
+            block = None
+        while block is not None:
+            if block.function is not None:
+                functions.append(block.function)
+            block = block.superblock
+        sal = gdb.find_pc_line(address)
+        keys = []
+        if sal.symtab is not None and functions:
+            line, file = sal.line, sal.symtab.fullname()
+            for function in functions:
+                keys.append((line, file, function.name, "", self._address(address)))
+                # For inlined functions, gdb gives the symbol the location of
+                # the call site, which is the line in the next function out:
+                if function.symtab is not None:
+                    line, file = function.line, function.symtab.fullname()
+        elif sal.symtab is not None:
+            keys.append(
+                (sal.line, sal.symtab.fullname(), "", "", self._address(address))
+            )
+        else:
+            func = functions[0].name if functions else _minimal_symbol(address)
+            library = gdb.solib_name(address) or ""
+            keys.append((0, "", func, library, self._address(address)))
+        frame_ids = self.address_ids[address] = [self._intern(key) for key in keys]
+        return frame_ids
+
+    def _stack(self) -> Optional[list[int]]:
+        result: list[int] = []
+        try:
+            frame: Optional[gdb.Frame] = gdb.newest_frame()
+            while frame is not None and len(result) < self.depth:
+                frame_ids: list[int] = []
+                # Inlined functions' frames share their caller's machine code
+                # frame, and always have an older frame, their call site:
+                inlined = frame.type() == gdb.INLINE_FRAME
+                if not self.defer_symbols:
+                    frame_ids = [self._frame_id(frame)]
+                    result.extend(frame_ids)
+                elif not inlined:
+                    # Callers' addresses are return addresses, which may be
+                    # on the line after the call:
+                    address = frame.pc() - 1 if result else frame.pc()
+                    result.append(address)
+                    # Only addresses resolved by earlier samples are known,
+                    # and include any inlined call sites:
+                    frame_ids = self.address_ids.get(address, [])
+                if self.instructions and frame.pc() not in self.disassembled:
+                    self._disassemble(frame)
+                if (
+                    self.adaptive
+                    and not inlined
+                    and any(i in self.attributable_ids for i in frame_ids)
+                ):
+                    break
+                frame = frame.older()
+        except gdb.error:
+            return None
+        return result
+
+    def _disassemble(self, frame: gdb.Frame) -> None:
+        """
+        If the frame is Numba code, disassemble its function.
+        """
+        self.disassembled.add(frame.pc())
+        sal = gdb.find_pc_line(frame.pc())
+        if sal.symtab is None or not sal.symtab.filename.endswith(".py"):
+            return
+        block: Optional[gdb.Block] = gdb.block_for_pc(frame.pc())
+        while block is not None and block.function is None:
+            block = block.superblock
+        if block is None or block.function is None:
+            return
+        func = block.function.name
+        for instruction in frame.architecture().disassemble(block.start, block.end - 1):
+            address = instruction["addr"]
+            if address in self.disassembled:
+                continue
+            self.disassembled.add(address)
+            sal = gdb.find_pc_line(address)
+            file = sal.symtab.fullname() if sal.symtab is not None else ""
+            text = instruction["asm"].replace("\t", " ")
+            self.disassembly.append(
+                f"I {address}\t{sal.line}\t{file}\t{func}\t{text}\n"
+            )
+
+    def _load_symbols(self) -> None:
+        """
+        Load symbols for libraries matching ``symbol_libraries`` that were
+        loaded since we last checked.
+        """
+        self.next_symbol_load = time() + 1
+        for pattern in self.symbol_libraries:
+            try:
+                gdb.execute(f"sharedlibrary {pattern}", to_string=True)
+            except gdb.error:
+                pass
+
+    def _on_stop(self, event: gdb.StopEvent) -> None:
+        del event
+        if not self.running:
+            return
+        if self.symbol_libraries and time() >= self.next_symbol_load:
+            self._load_symbols()
+        stacks = []
+        off_cpu = set(self.off_cpu)
+        # Child processes being followed are additional inferiors:
+        for inferior in gdb.inferiors():
+            for thread in inferior.threads():
+                if not thread.is_valid() or thread.global_num in off_cpu:
+                    continue
+                thread.switch()
+                stacks.append((thread.global_num, self._stack()))
+                self._record_pid(thread, inferior)
+        gdb.post_event(self._continue)
+        self.stacks = stacks
+
+    def _continue(self) -> None:
+        if not self.running:
+            return
+        try:
+            gdb.execute("continue&")
+        except gdb.error:
+            self.running = False
+            return
+        stop_time = 0.0
+        if self.interrupted_at is not None:
+            stop_time = perf_counter() - self.interrupted_at
+        self._write_sample(stop_time)
+
+    def _write_sample(self, stop_time: float) -> None:
+        # The process is running again, so resolving addresses is now free
+        # from the process' point of view:
+        stacks = []
+        for thread_id, stack in self.stacks:
+            if stack is None:
+                stacks.append(f"{thread_id}:!")
+                continue
+            if self.defer_symbols:
+                stack = [
+                    frame_id
+                    for address in stack
+                    for frame_id in self._address_ids(address)
+                ]
+            stacks.append(f"{thread_id}:" + ",".join(map(str, stack)))
+        self.output.write("".join(self.disassembly))
+        self.disassembly = []
+        self.output.write("".join(self.pid_records))
+        self.pid_records = []
+        if self.off_cpu:
+            self.output.write("O " + ",".join(map(str, self.off_cpu)) + "\n")
+            self.off_cpu = []
+        self.output.write(
+            "\t".join([f"S {stop_time} {self.timestamp}", *stacks]) + "\n"
+        )
+        self.output.flush()
+        if self.stopping:
+            self._finish()
+        else:
+            self._schedule()
+
+    def _on_exit(self, event: gdb.ExitedEvent) -> None:
+        # Child processes exiting doesn't end sampling:
+        if event.inferior.num != 1:
+            return
+        self.running = False
+        gdb.events.stop.disconnect(self._on_stop)
+        gdb.events.exited.disconnect(self._on_exit)
+        self.output.close()
+
+
+# The sampler started by the latest profila_start():
+_current: Optional[_Sampler] = None
+
+
+def _thread_states(pid: int) -> dict[int, str]:
+    """
+    Map a process' kernel thread ids to their scheduler state from ``/proc``,
+    e.g. "R" if running or ready to run, "S" if sleeping.
+    """
+    result: dict[int, str] = {}
+    try:
+        task_ids = os.listdir(f"/proc/{pid}/task")
+    except OSError:
+        return result
+    for task_id in task_ids:
+        try:
+            with open(f"/proc/{pid}/task/{task_id}/stat", "rb") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The state follows the command name, which is in parentheses and may
+        # itself contain spaces or parentheses:
+        result[int(task_id)] = stat.rpartition(b")")[2].split()[0].decode()
+    return result
+
+
+def _minimal_symbol(address: int) -> str:
+    """
+    Find the name of the function containing an address, for code without
+    debug info.
+    """
+    try:
+        info = gdb.execute(f"info symbol {address:#x}", to_string=True)
+    except gdb.error:
+        return ""
+    if info.startswith("No symbol"):
+        return ""
+    # E.g. "pthread_cond_wait + 123 in section .text of /lib/libc.so.6":
+    return info.split(" ", 1)[0]
+
+
+def profila_start(
+    fifo_path: str,
+    interval: float,
+    jitter: float,
+    depth: int,
+    defer_symbols: bool,
+    adaptive: bool,
+    threadpool_libraries: tuple[str, ...],
+    instructions: bool,
+    symbol_libraries: tuple[str, ...] = (),
+    on_cpu: bool = False,
+) -> None:
+    """
+    Start sampling, writing records to the given FIFO.
+    """
+    global _current
+    output = open(fifo_path, "w")
+    _current = _Sampler(
+        output,
+        interval,
+        jitter,
+        depth,
+        defer_symbols,
+        adaptive,
+        threadpool_libraries,
+        instructions,
+        symbol_libraries,
+        on_cpu,
+    )
+    _current.start()
+
+
+def profila_stop() -> None:
+    """
+    Stop sampling once the current sample is done, leaving the process
+    running.
+    """
+    if _current is None:
+        return
+    if _current.running:
+        _current.stopping = True
+    elif not _current.output.closed:
+        # Sampling already failed, so there's no current sample to wait for:
+        _current.output.write("E\n")
+        _current.output.close()
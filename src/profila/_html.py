@@ -0,0 +1,293 @@
+"""
+Render ``FinalStats`` as a self-contained HTML report.
+
+Only the hot regions of each file, i.e. lines with samples plus a few lines of
+context, are included.  Their source code is embedded as JSON and only turned
+into table rows when a region is opened, so large profiles stay fast to load.
+"""
+
+from html import escape
+from io import StringIO
+import json
+from linecache import getline
+from typing import Any
+
+from ._stats import FinalStats
+
+# Lines of context around lines with samples:
+REGION_CONTEXT = 3
+
+_STYLE = """
+body { font-family: sans-serif; margin: 2em; }
+table { border-collapse: collapse; }
+th, td { padding: 0.1em 0.6em; text-align: right; }
+th:last-child, td:last-child { text-align: left; }
+.code td:last-child { font-family: monospace; white-space: pre; }
+.code td { border-right: 1px solid #ccc; }
+summary { cursor: pointer; margin: 0.4em 0; }
+pre { background: #f4f4f4; padding: 0.5em; }
+"""
+
+_SCRIPT = """
+const regions = JSON.parse(document.getElementById("profila-regions").textContent);
+
+function percent(value) {
+  return value ? value + "%" : "";
+}
+
+function renderRegion(details) {
+  if (details.dataset.rendered) {
+    return;
+  }
+  details.dataset.rendered = "1";
+  const region = regions[Number(details.dataset.region)];
+  const table = document.createElement("table");
+  table.className = "code";
+  const header = table.insertRow();
+  const headings = region.inclusive ? ["Self", "Incl", "Line", ""] : ["Self", "Line", ""];
+  for (const heading of headings) {
+    const th = document.createElement("th");
+    th.textContent = heading;
+    header.appendChild(th);
+  }
+  for (const [line, code, self, inclusive] of region.lines) {
+    const row = table.insertRow();
+    const cells = region.inclusive
+      ? [percent(self), percent(inclusive), line, code]
+      : [percent(self), line, code];
+    for (const value of cells) {
+      row.insertCell().textContent = value;
+    }
+  }
+  details.appendChild(table);
+}
+
+for (const details of document.querySelectorAll("details[data-region]")) {
+  details.addEventListener("toggle", () => renderRegion(details));
+  if (details.open) {
+    renderRegion(details);
+  }
+}
+"""
+
+
+def _hot_regions(stats: FinalStats) -> list[dict[str, Any]]:
+    """
+    Find the regions of each file with samples, hottest first.
+
+    Lines with samples that are close together share a region.
+    """
+    regions: list[dict[str, Any]] = []
+    filenames = {**stats.numba_samples, **stats.inclusive_numba_samples}
+    for filename in filenames:
+        line_percents = stats.numba_samples.get(filename, {})
+        inclusive_percents = stats.inclusive_numba_samples.get(filename, {})
+        # Only show inclusive time if some line calls into other code:
+        show_inclusive = any(
+            percent != line_percents.get(line_number, 0)
+            for (line_number, percent) in inclusive_percents.items()
+        )
+        hot_lines = sorted(line_percents.keys() | inclusive_percents.keys())
+        groups = [[hot_lines[0]]]
+        for line_number in hot_lines[1:]:
+            if line_number - groups[-1][-1] > 2 * REGION_CONTEXT + 1:
+                groups.append([])
+            groups[-1].append(line_number)
+        for group in groups:
+            start = max(group[0] - REGION_CONTEXT, 1)
+            end = group[-1] + REGION_CONTEXT
+            lines: list[list[Any]] = [
+                [
+                    line_number,
+                    getline(filename, line_number).rstrip(),
+                    line_percents.get(line_number, 0),
+                    inclusive_percents.get(line_number, 0),
+                ]
+                for line_number in range(start, end + 1)
+            ]
+            # Don't show context past the end of the file:
+            while lines and not lines[-1][1] and lines[-1][0] > group[-1]:
+                lines.pop()
+            regions.append(
+                {
+                    "file": filename,
+                    "start": start,
+                    "end": lines[-1][0],
+                    "percent": round(
+                        sum(line_percents.get(line, 0) for line in group), 1
+                    ),
+                    "inclusive": show_inclusive,
+                    "lines": lines,
+                }
+            )
+    regions.sort(key=lambda region: region["percent"], reverse=True)
+    return regions
+
+
+def _table(headings: list[str], rows: list[list[Any]]) -> str:
+    result = StringIO()
+    result.write("<table>\n<tr>")
+    for heading in headings:
+        result.write(f"<th>{escape(heading)}</th>")
+    result.write("</tr>\n")
+    for row in rows:
+        result.write("<tr>")
+        for value in row:
+            result.write(f"<td>{escape(str(value))}</td>")
+        result.write("</tr>\n")
+    result.write("</table>\n")
+    return result.getvalue()
+
+
+def render_html(stats: FinalStats) -> str:
+    """
+    Render stats to a self-contained HTML page.
+    """
+    result = StringIO()
+    result.write(
+        "<!DOCTYPE html>\n<html>\n<head>\n<meta charset='utf-8'>\n"
+        f"<title>Profila report</title>\n<style>{_STYLE}</style>\n</head>\n"
+        "<body>\n<h1>Profila report</h1>\n"
+    )
+    result.write(
+        f"<p><b>Total samples:</b> {stats.total_samples} "
+        f"({stats.percent_numba_samples()}% Numba, "
+        f"{stats.percent_other_samples}% non-Numba, "
+        f"{stats.percent_idle_samples}% idle in threadpool, "
+        f"{stats.percent_bad_samples}% bad samples)</p>\n"
+    )
+    if stats.percent_off_cpu:
+        result.write(
+            f"<p><b>Off-CPU:</b> {stats.percent_off_cpu}% of thread samples "
+            "were waiting rather than running, and aren't included above</p>\n"
+        )
+    if stats.duration:
+        result.write(
+            f"<p><b>Sampling:</b> {stats.achieved_rate} samples/second over "
+            f"{stats.duration} seconds, process stopped by the sampler "
+            f"{stats.percent_overhead}% of the time</p>\n"
+        )
+
+    if stats.numba_functions:
+        result.write("<h2>Numba functions</h2>\n")
+        rows: list[list[Any]] = []
+        for func, percents in stats.numba_functions.items():
+            rows.append([f"{percents['self']}%", f"{percents['inclusive']}%", func])
+            specializations = stats.numba_specializations.get(func, {})
+            if len(specializations) < 2:
+                continue
+            for signature, percents in specializations.items():
+                rows.append(
+                    [
+                        f"{percents['self']}%",
+                        f"{percents['inclusive']}%",
+                        f"↳ {func}{signature}",
+                    ]
+                )
+        result.write(_table(["Self", "Inclusive", "Function"], rows))
+
+    if stats.other_breakdown:
+        result.write("<h2>Non-Numba code</h2>\n")
+        result.write(
+            _table(
+                ["Samples", "Code"],
+                [
+                    [f"{percent}%", category]
+                    for (category, percent) in stats.other_breakdown.items()
+                ],
+            )
+        )
+
+    if len(stats.per_process) > 1:
+        result.write("<h2>Processes</h2>\n")
+        result.write(
+            _table(
+                ["Process", "Samples", "Numba", "Non-Numba", "Idle", "Bad"],
+                [
+                    [
+                        pid,
+                        process_stats.total_samples,
+                        f"{process_stats.percent_numba_samples()}%",
+                        f"{process_stats.percent_other_samples}%",
+                        f"{process_stats.percent_idle_samples}%",
+                        f"{process_stats.percent_bad_samples}%",
+                    ]
+                    for (pid, process_stats) in stats.per_process.items()
+                ],
+            )
+        )
+
+    if len(stats.per_thread) > 1:
+        # Threads from different processes can have the same thread id:
+        processes = len({pid for (pid, _) in stats.per_thread}) > 1
+        result.write("<h2>Threads</h2>\n")
+        result.write(
+            _table(
+                (["Process"] if processes else [])
+                + ["Thread", "Samples", "Numba", "Non-Numba", "Idle", "Bad"],
+                [
+                    ([pid] if processes else [])
+                    + [
+                        thread_id,
+                        thread_stats.total_samples,
+                        f"{thread_stats.percent_numba_samples()}%",
+                        f"{thread_stats.percent_other_samples}%",
+                        f"{thread_stats.percent_idle_samples}%",
+                        f"{thread_stats.percent_bad_samples}%",
+                    ]
+                    for ((pid, thread_id), thread_stats) in stats.per_thread.items()
+                ],
+            )
+        )
+
+    if stats.timeline:
+        result.write("<h2>Timeline</h2>\n")
+        result.write(
+            _table(
+                ["Seconds", "Samples", "Numba", "Hottest lines"],
+                [
+                    [
+                        f"{window['start']}–{window['end']}",
+                        window["total_samples"],
+                        f"{window['percent_numba_samples']}%",
+                        ", ".join(
+                            f"{path}:{line_number} ({percent}%)"
+                            for (path, line_number, percent) in window["top_lines"]
+                        ),
+                    ]
+                    for window in stats.timeline
+                ],
+            )
+        )
+
+    regions = _hot_regions(stats)
+    if regions:
+        result.write("<h2>Hot regions</h2>\n")
+    for index, region in enumerate(regions):
+        # Open the hottest region to start with:
+        is_open = " open" if index == 0 else ""
+        result.write(
+            f"<details data-region='{index}'{is_open}><summary>"
+            f"{escape(region['file'])} lines {region['start']} to {region['end']} "
+            f"({region['percent']}%)</summary></details>\n"
+        )
+
+    if stats.hot_instructions:
+        result.write("<h2>Instructions for the hottest lines</h2>\n")
+        for hot_line in stats.hot_instructions:
+            code = getline(hot_line["file"], hot_line["line"]).strip()
+            result.write(
+                f"<p>{escape(hot_line['file'])} line {hot_line['line']} "
+                f"({hot_line['percent']}%): <code>{escape(code)}</code></p>\n<pre>"
+            )
+            for address, text, percent in hot_line["instructions"]:
+                result.write(escape(f"{percent:>5}% | {address:#x}: {text}\n"))
+            result.write("</pre>\n")
+
+    # Escape "</" so source code can't end the script element:
+    regions_json = json.dumps(regions).replace("</", "<\\/")
+    result.write(
+        "<script type='application/json' id='profila-regions'>"
+        f"{regions_json}</script>\n<script>{_SCRIPT}</script>\n</body>\n</html>\n"
+    )
+    return result.getvalue()
@@ -0,0 +1,281 @@
+"""
+The versioned JSON profile format, for dashboards and other tools.
+
+Unlike ``FinalStats`` this only uses JSON types, so e.g. line numbers are
+values rather than dictionary keys.  Percentages are of all samples, or of the
+thread's or time window's samples where noted.  Version 1 looks like this:
+
+.. code-block:: text
+
+    {
+      "format": "profila",
+      "version": 1,
+      "total_samples": 1000,
+      "percent_numba_samples": 75.0,
+      "percent_other_samples": 15.0,
+      "percent_idle_samples": 0.0,
+      "percent_bad_samples": 10.0,
+      // Only with on-CPU sampling: thread samples skipped because the thread
+      // was waiting, as a percentage of all thread samples including these.
+      // Other percentages are then of the on-CPU samples:
+      "percent_off_cpu": 20.0,
+      "sampling": {"duration": 10.0, "requested_rate": 100.0,
+                   "achieved_rate": 99.9, "percent_overhead": 2.5,
+                   "mean_stop_ms": 0.25, "max_stop_ms": 1.5},
+      // Sorted by file, then line.  "self" or "inclusive" is null if the line
+      // had no samples of that kind.  "error" is the margin of error of
+      // "self" in percentage points at 95% confidence, or null if unknown:
+      "lines": [{"file": "/path/to/code.py", "line": 12, "self": 60.0,
+                 "inclusive": 60.0, "error": 3.0}, ...],
+      // Where non-Numba samples were spent, most common first:
+      "other": [{"name": "numpy: DOUBLE_add", "percent": 10.0}, ...],
+      "functions": [{"name": "code.simple", "self": 60.0, "inclusive": 75.0,
+                     "specializations": [{"signature": "(float64)",
+                                          "self": 60.0, "inclusive": 75.0},
+                                         ...]},
+                    ...],
+      // Each thread has the same keys as the top level, minus "format",
+      // "version" and "threads", with percentages of that thread's samples,
+      // plus "pid", the thread's process id, left out if it isn't known:
+      "threads": [{"thread_id": 1, "pid": 1234, "total_samples": 500, ...},
+                  ...],
+      // Only if samples came from more than one process, e.g. when following
+      // child processes.  The same keys as threads, with percentages of that
+      // process' samples:
+      "processes": [{"pid": 1234, "total_samples": 500, ...}, ...],
+      // Only with --timeline, percentages of that window's samples:
+      "timeline": [{"start": 0.0, "end": 1.0, "total_samples": 100,
+                    "percent_numba_samples": 80.0,
+                    "top_lines": [{"file": "...", "line": 12,
+                                   "percent": 50.0}, ...]},
+                   ...],
+      // Only with --instructions:
+      "hot_instructions": [{"file": "...", "line": 12, "percent": 60.0,
+                            "instructions": [{"address": 4096,
+                                              "text": "vmulpd ...",
+                                              "percent": 30.0}, ...]},
+                           ...]
+    }
+
+New keys may be added without changing the version; removing or changing the
+meaning of existing keys increments it.
+"""
+
+from typing import Any, Optional
+
+from ._stats import FinalStats, ThreadKey
+
+FORMAT_VERSION = 1
+
+
+def _stats_to_json(stats: FinalStats) -> dict[str, Any]:
+    filenames = sorted(stats.numba_samples.keys() | stats.inclusive_numba_samples)
+    lines = []
+    for filename in filenames:
+        line_percents = stats.numba_samples.get(filename, {})
+        inclusive_percents = stats.inclusive_numba_samples.get(filename, {})
+        line_errors = stats.numba_sample_errors.get(filename, {})
+        for line_number in sorted(line_percents.keys() | inclusive_percents):
+            lines.append(
+                {
+                    "file": filename,
+                    "line": line_number,
+                    "self": line_percents.get(line_number),
+                    "inclusive": inclusive_percents.get(line_number),
+                    "error": line_errors.get(line_number),
+                }
+            )
+    functions = [
+        {
+            "name": func,
+            "self": percents["self"],
+            "inclusive": percents["inclusive"],
+            "specializations": [
+                {
+                    "signature": signature,
+                    "self": specialization["self"],
+                    "inclusive": specialization["inclusive"],
+                }
+                for (signature, specialization) in stats.numba_specializations.get(
+                    func, {}
+                ).items()
+            ],
+        }
+        for (func, percents) in stats.numba_functions.items()
+    ]
+    return {
+        "total_samples": stats.total_samples,
+        "percent_numba_samples": stats.percent_numba_samples(),
+        "percent_other_samples": stats.percent_other_samples,
+        "percent_idle_samples": stats.percent_idle_samples,
+        "percent_bad_samples": stats.percent_bad_samples,
+        "percent_off_cpu": stats.percent_off_cpu,
+        "sampling": {
+            "duration": stats.duration,
+            "requested_rate": stats.requested_rate,
+            "achieved_rate": stats.achieved_rate,
+            "percent_overhead": stats.percent_overhead,
+            "mean_stop_ms": stats.mean_stop_ms,
+            "max_stop_ms": stats.max_stop_ms,
+        },
+        "lines": lines,
+        "other": [
+            {"name": name, "percent": percent}
+            for (name, percent) in stats.other_breakdown.items()
+        ],
+        "functions": functions,
+        "timeline": [
+            {
+                **{key: value for (key, value) in window.items() if key != "top_lines"},
+                "top_lines": [
+                    {"file": path, "line": line_number, "percent": percent}
+                    for (path, line_number, percent) in window["top_lines"]
+                ],
+            }
+            for window in stats.timeline
+        ],
+        "hot_instructions": [
+            {
+                **{
+                    key: value
+                    for (key, value) in hot_line.items()
+                    if key != "instructions"
+                },
+                "instructions": [
+                    {"address": address, "text": text, "percent": percent}
+                    for (address, text, percent) in hot_line["instructions"]
+                ],
+            }
+            for hot_line in stats.hot_instructions
+        ],
+    }
+
+
+def to_json(stats: FinalStats) -> dict[str, Any]:
+    """
+    Convert stats to the JSON profile format, ready for ``json.dumps()``.
+    """
+    result: dict[str, Any] = {
+        "format": "profila",
+        "version": FORMAT_VERSION,
+        **_stats_to_json(stats),
+        "threads": [
+            {
+                "thread_id": thread_id,
+                **({"pid": pid} if pid else {}),
+                **_stats_to_json(thread_stats),
+            }
+            for ((pid, thread_id), thread_stats) in stats.per_thread.items()
+        ],
+    }
+    if len(stats.per_process) > 1:
+        result["processes"] = [
+            {"pid": pid, **_stats_to_json(process_stats)}
+            for (pid, process_stats) in stats.per_process.items()
+        ]
+    return result
+
+
+def _stats_from_json(
+    data: dict[str, Any],
+    per_thread: Optional[dict[ThreadKey, FinalStats]] = None,
+    per_process: Optional[dict[int, FinalStats]] = None,
+) -> FinalStats:
+    numba_samples: dict[str, dict[int, float]] = {}
+    inclusive_numba_samples: dict[str, dict[int, float]] = {}
+    numba_sample_errors: dict[str, dict[int, float]] = {}
+    for line in data["lines"]:
+        if line["self"] is not None:
+            numba_samples.setdefault(line["file"], {})[line["line"]] = line["self"]
+        if line["inclusive"] is not None:
+            inclusive_numba_samples.setdefault(line["file"], {})[line["line"]] = line[
+                "inclusive"
+            ]
+        if line.get("error") is not None:
+            numba_sample_errors.setdefault(line["file"], {})[line["line"]] = line[
+                "error"
+            ]
+    numba_functions = {}
+    numba_specializations = {}
+    for function in data["functions"]:
+        numba_functions[function["name"]] = {
+            "self": function["self"],
+            "inclusive": function["inclusive"],
+        }
+        if function["specializations"]:
+            numba_specializations[function["name"]] = {
+                specialization["signature"]: {
+                    "self": specialization["self"],
+                    "inclusive": specialization["inclusive"],
+                }
+                for specialization in function["specializations"]
+            }
+    sampling = data["sampling"]
+    return FinalStats(
+        total_samples=data["total_samples"],
+        percent_bad_samples=data["percent_bad_samples"],
+        percent_other_samples=data["percent_other_samples"],
+        numba_samples=numba_samples,
+        percent_idle_samples=data["percent_idle_samples"],
+        percent_off_cpu=data.get("percent_off_cpu", 0.0),
+        numba_sample_errors=numba_sample_errors,
+        other_breakdown={
+            other["name"]: other["percent"] for other in data.get("other", [])
+        },
+        per_thread=per_thread or {},
+        per_process=per_process or {},
+        mean_stop_ms=sampling["mean_stop_ms"],
+        max_stop_ms=sampling["max_stop_ms"],
+        duration=sampling["duration"],
+        requested_rate=sampling["requested_rate"],
+        achieved_rate=sampling["achieved_rate"],
+        percent_overhead=sampling["percent_overhead"],
+        inclusive_numba_samples=inclusive_numba_samples,
+        numba_functions=numba_functions,
+        numba_specializations=numba_specializations,
+        timeline=[
+            {
+                **window,
+                "top_lines": [
+                    [top_line["file"], top_line["line"], top_line["percent"]]
+                    for top_line in window["top_lines"]
+                ],
+            }
+            for window in data["timeline"]
+        ],
+        hot_instructions=[
+            {
+                **hot_line,
+                "instructions": [
+                    [
+                        instruction["address"],
+                        instruction["text"],
+                        instruction["percent"],
+                    ]
+                    for instruction in hot_line["instructions"]
+                ],
+            }
+            for hot_line in data["hot_instructions"]
+        ],
+    )
+
+
+def from_json(data: dict[str, Any]) -> FinalStats:
+    """
+    Recreate ``FinalStats`` from the JSON profile format.
+
+    Raises ``ValueError`` if it's not a profile in a supported version.
+    """
+    if data.get("format") != "profila":
+        raise ValueError("Not a profila JSON profile.")
+    if data.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported profile version {data.get('version')}.")
+    per_thread = {
+        (thread.get("pid", 0), thread["thread_id"]): _stats_from_json(thread)
+        for thread in data["threads"]
+    }
+    per_process = {
+        process["pid"]: _stats_from_json(process)
+        for process in data.get("processes", [])
+    }
+    return _stats_from_json(data, per_thread, per_process)
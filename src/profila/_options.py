@@ -0,0 +1,183 @@
+"""
+Command-line options shared by the ``profila`` command and in-process
+profiling, e.g. the options of the ``%%profila`` magic.
+"""
+
+from argparse import ArgumentParser, Namespace
+
+from ._gdb import (
+    SAMPLER_MODES,
+    SEQUENTIAL,
+    EMBEDDED,
+    FULL,
+    UNWIND_STRATEGIES,
+    SamplerOptions,
+)
+from ._stats import Stats
+
+
+def add_sampler_arguments(parser: ArgumentParser) -> None:
+    """
+    Add the command-line options that control sampling.
+    """
+    parser.add_argument(
+        "--sampler",
+        choices=SAMPLER_MODES,
+        default=SEQUENTIAL,
+        help=(
+            "How to talk to gdb: 'sequential' waits for each reply, 'pipelined' "
+            "batches each sample's commands to keep the process stopped for "
+            "less time, 'embedded' runs the sampling loop inside gdb's Python "
+            "interpreter."
+        ),
+    )
+    rate = parser.add_mutually_exclusive_group()
+    rate.add_argument(
+        "--interval",
+        type=float,
+        metavar="MILLISECONDS",
+        help="Milliseconds between samples (default: 10).",
+    )
+    rate.add_argument(
+        "--rate",
+        type=float,
+        metavar="HZ",
+        help="Samples per second (default: 100).",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.0,
+        metavar="FRACTION",
+        help=(
+            "Randomly move each sample by up to this fraction of the interval, "
+            "to avoid aliasing with periodic loops (default: 0)."
+        ),
+    )
+    parser.add_argument(
+        "--depth",
+        type=int,
+        default=SamplerOptions.depth,
+        help="How many frames of each thread's stack to record (default: 10).",
+    )
+    parser.add_argument(
+        "--unwind",
+        choices=UNWIND_STRATEGIES,
+        default=FULL,
+        help=(
+            "'full' records --depth frames of every stack; 'adaptive' reads "
+            "a few frames at a time and stops at the Numba frame the sample "
+            "is attributed to, which keeps the process stopped for less time "
+            "with deep stacks, but loses callers (default: full)."
+        ),
+    )
+    parser.add_argument(
+        "--instructions",
+        default=False,
+        action="store_true",
+        help=(
+            "Also record which machine code instructions were running, and "
+            "show the disassembly of the hottest lines."
+        ),
+    )
+    parser.add_argument(
+        "--defer-symbols",
+        default=False,
+        action="store_true",
+        help=(
+            "Only record instruction addresses while the process is stopped, "
+            "resolving them to source lines afterwards. Requires "
+            "--sampler=embedded."
+        ),
+    )
+    parser.add_argument(
+        "--on-cpu",
+        default=False,
+        action="store_true",
+        help=(
+            "Only sample threads that are running, skipping threads waiting "
+            "for I/O or a lock, and don't stop the process at all if none "
+            "are.  Waiting time is reported separately as off-CPU."
+        ),
+    )
+
+
+def sampler_options(args: Namespace) -> SamplerOptions:
+    """
+    Create ``SamplerOptions`` from parsed command-line arguments.
+    """
+    if args.defer_symbols and args.sampler != EMBEDDED:
+        raise SystemExit("--defer-symbols requires --sampler=embedded.")
+    if not 0 <= args.jitter < 1:
+        raise SystemExit("--jitter must be at least 0 and less than 1.")
+    interval = SamplerOptions.interval
+    if args.interval is not None:
+        if args.interval <= 0:
+            raise SystemExit("--interval must be positive.")
+        interval = args.interval / 1000
+    elif args.rate is not None:
+        if args.rate <= 0:
+            raise SystemExit("--rate must be positive.")
+        interval = 1 / args.rate
+    if args.depth < 1:
+        raise SystemExit("--depth must be at least 1.")
+    return SamplerOptions(
+        mode=args.sampler,
+        interval=interval,
+        jitter=args.jitter,
+        depth=args.depth,
+        defer_symbols=args.defer_symbols,
+        unwind=args.unwind,
+        instructions=args.instructions,
+        on_cpu=args.on_cpu,
+    )
+
+
+def add_timeline_arguments(parser: ArgumentParser) -> None:
+    """
+    Add the command-line options for the timeline of hot lines.
+    """
+    parser.add_argument(
+        "--timeline",
+        type=float,
+        metavar="SECONDS",
+        help="Show the hottest lines in each time window of this many seconds.",
+    )
+    parser.add_argument(
+        "--timeline-windows",
+        type=int,
+        default=Stats.max_buckets,
+        metavar="N",
+        help="Only keep the most recent N time windows (default: 100).",
+    )
+
+
+def new_stats(args: Namespace, interval: float = 0.0) -> Stats:
+    """
+    Create an empty ``Stats``, with the timeline options from parsed
+    command-line arguments.
+    """
+    # Per-thread stacks are only needed for speedscope profiles:
+    thread_call_trees = (
+        getattr(args, "format", None) == "speedscope"
+        or getattr(args, "speedscope", None) is not None
+    )
+    if args.timeline is None:
+        return Stats(interval=interval, thread_call_trees=thread_call_trees)
+    if args.timeline <= 0:
+        raise SystemExit("--timeline must be positive.")
+    if args.timeline_windows < 1:
+        raise SystemExit("--timeline-windows must be at least 1.")
+    return Stats(
+        interval=interval,
+        bucket_width=args.timeline,
+        max_buckets=args.timeline_windows,
+        thread_call_trees=thread_call_trees,
+    )
+
+
+# Options for each time attach_automated is told to start sampling; these are
+# the options of the %%profila magic:
+SESSION_PARSER = ArgumentParser(prog="%%profila")
+add_sampler_arguments(SESSION_PARSER)
+add_timeline_arguments(SESSION_PARSER)
@@ -0,0 +1,93 @@
+"""
+Profile parts of a program from inside it.
+"""
+
+from collections.abc import Callable
+from contextlib import ContextDecorator
+from time import monotonic
+from typing import Optional
+
+from ._session import Session, get_session, parse_options
+from ._stats import FinalStats
+
+# How often profile_until() checks how many samples it has:
+_COUNT_INTERVAL = 0.1
+
+
+class Profiler(ContextDecorator):
+    """
+    Profile the code run inside a ``with`` block, or each call to a decorated
+    function.
+
+    Once the block or call is done, the results are in ``stats``.
+    """
+
+    def __init__(self, options: str = "") -> None:
+        self._args = parse_options(options)
+        self._session: Optional[Session] = None
+        self.stats: Optional[FinalStats] = None
+
+    def __enter__(self) -> "Profiler":
+        self._session = get_session()
+        self._session.start(self._args)
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        assert self._session is not None
+        self.stats = self._session.stop()
+        self._session = None
+
+
+def profile(options: str = "") -> Profiler:
+    """
+    Profile a block of code, or a function, in this process:
+
+    .. code-block:: python
+
+        with profila.profile("--rate 1000") as profiler:
+            myfunc(DATA)
+        print(profila.render_text(profiler.stats))
+
+    Takes the same sampling options as ``python -m profila annotate``.  The
+    first use attaches the profiler to this process, which can take a few
+    seconds; it then stays attached, with sampling paused in between, until
+    ``profila.detach()``.  The process needs to have been started with
+    ``NUMBA_DEBUGINFO=1`` set.
+    """
+    return Profiler(options)
+
+
+def profile_until(
+    func: Callable[[], object],
+    min_samples: int = 1000,
+    max_seconds: float = 60.0,
+    options: str = "",
+) -> FinalStats:
+    """
+    Call ``func()`` repeatedly under the profiler, until at least
+    ``min_samples`` samples were in Numba code or ``max_seconds`` have passed,
+    and return the stats.
+
+    ``func()`` is always called at least once.
+    """
+    if min_samples < 1:
+        raise ValueError("min_samples must be at least 1.")
+    args = parse_options(options)
+    session = get_session()
+    session.start(args)
+    try:
+        start = last_count = monotonic()
+        while True:
+            func()
+            now = monotonic()
+            if now - start >= max_seconds:
+                break
+            # Asking for the count is a round trip to the profiler, so don't
+            # do it after every call of a fast function:
+            if now - last_count >= _COUNT_INTERVAL:
+                last_count = now
+                if session.numba_samples() >= min_samples:
+                    break
+    finally:
+        stats = session.stop()
+    return stats
@@ -1,11 +1,186 @@
 """
-Render ``FinalStats`` to human-readable text.
+Render ``FinalStats`` to human-readable text, and ``Stats`` call stacks to
+flamegraph formats.
 """
 
 from io import StringIO
+import json
 from linecache import getline
+import os
+from typing import Optional
 
-from ._stats import FinalStats
+from ._stacks import FrameKey
+from ._stats import CONFIDENCE, FinalStats, Stats
+
+
+def _format_percent(percent: float) -> str:
+    """
+    Format a percentage to fixed width, leaving zero blank.
+    """
+    if percent == 0:
+        return "      "
+    return f"{percent:>5}%"
+
+
+def _format_error(error: Optional[float]) -> str:
+    """
+    Format a margin of error to fixed width, leaving missing ones blank.
+    """
+    if error is None:
+        return "      "
+    return f" ±{error:>4}"
+
+
+def _render_functions(stats: FinalStats) -> str:
+    """
+    Render a table of self and inclusive time per Numba function, and per
+    compiled specialization for functions that have more than one.
+    """
+    result = StringIO()
+    result.write("\n| Numba function | Self | Inclusive |\n|:---|---:|---:|\n")
+    for func, percents in stats.numba_functions.items():
+        result.write(f"| `{func}` | {percents['self']}% | {percents['inclusive']}% |\n")
+        specializations = stats.numba_specializations.get(func, {})
+        if len(specializations) < 2:
+            continue
+        for signature, percents in specializations.items():
+            result.write(
+                f"| ↳ `{func}{signature}` | {percents['self']}% "
+                + f"| {percents['inclusive']}% |\n"
+            )
+    return result.getvalue()
+
+
+def _thread_processes(stats: FinalStats) -> bool:
+    """
+    Do the threads come from more than one process, so they need to be told
+    apart by process id as well as thread id?
+    """
+    return len({pid for (pid, _) in stats.per_thread}) > 1
+
+
+def _render_threads(stats: FinalStats) -> str:
+    """
+    Render a per-thread summary table, to show load imbalance.
+    """
+    result = StringIO()
+    # Only with on-CPU sampling:
+    off_cpu = bool(stats.percent_off_cpu)
+    # Only if threads are from more than one process:
+    processes = _thread_processes(stats)
+    result.write(
+        ("\n| Process " if processes else "\n")
+        + "| Thread | Samples | Numba | Non-Numba | Idle in threadpool | Bad |"
+        + (" Off-CPU |\n" if off_cpu else "\n")
+        + ("|--------:" if processes else "")
+        + "|-------:|--------:|------:|----------:|-------------------:|----:|"
+        + ("--------:|\n" if off_cpu else "\n")
+    )
+    for (pid, thread_id), thread_stats in stats.per_thread.items():
+        result.write(
+            (f"| {pid} " if processes else "")
+            + f"| {thread_id} | {thread_stats.total_samples} "
+            f"| {thread_stats.percent_numba_samples()}% "
+            f"| {thread_stats.percent_other_samples}% "
+            f"| {thread_stats.percent_idle_samples}% "
+            f"| {thread_stats.percent_bad_samples}% |"
+            + (f" {thread_stats.percent_off_cpu}% |\n" if off_cpu else "\n")
+        )
+    return result.getvalue()
+
+
+# How many places to list in the non-Numba breakdown:
+OTHER_TOP_CATEGORIES = 10
+
+
+def _render_other(stats: FinalStats) -> str:
+    """
+    Render where non-Numba samples were spent, e.g. interpreter or NumPy
+    code between Numba calls.
+    """
+    result = StringIO()
+    result.write("\n| Non-Numba code | Samples |\n|:---|---:|\n")
+    categories = list(stats.other_breakdown.items())
+    for category, percent in categories[:OTHER_TOP_CATEGORIES]:
+        library, _, func = category.partition(": ")
+        name = f"{library}: `{func}`" if func else library
+        result.write(f"| {name} | {percent}% |\n")
+    rest = categories[OTHER_TOP_CATEGORIES:]
+    if rest:
+        percent = round(sum(percent for (_, percent) in rest), 1)
+        result.write(f"| {len(rest)} others | {percent}% |\n")
+    return result.getvalue()
+
+
+def _render_processes(stats: FinalStats) -> str:
+    """
+    Render a per-process summary table, e.g. for ``multiprocessing`` workers.
+    """
+    result = StringIO()
+    result.write(
+        "\n| Process | Samples | Numba | Non-Numba | Idle in threadpool | Bad "
+        "| Hottest line |\n"
+        "|--------:|--------:|------:|----------:|-------------------:|----:"
+        "|:-------------|\n"
+    )
+    for pid, process_stats in stats.per_process.items():
+        hottest = ""
+        lines = [
+            (percent, path, line_number)
+            for (path, line_percents) in process_stats.numba_samples.items()
+            for (line_number, percent) in line_percents.items()
+        ]
+        if lines:
+            percent, path, line_number = max(lines)
+            hottest = f"{os.path.basename(path)}:{line_number} ({percent}%)"
+        result.write(
+            f"| {pid} | {process_stats.total_samples} "
+            f"| {process_stats.percent_numba_samples()}% "
+            f"| {process_stats.percent_other_samples}% "
+            f"| {process_stats.percent_idle_samples}% "
+            f"| {process_stats.percent_bad_samples}% | {hottest} |\n"
+        )
+    return result.getvalue()
+
+
+def _render_timeline(stats: FinalStats) -> str:
+    """
+    Render the hottest lines in each time window, to show phase changes.
+    """
+    result = StringIO()
+    result.write(
+        "\n| Seconds | Samples | Numba | Hottest lines |\n"
+        "|--------:|--------:|------:|:--------------|\n"
+    )
+    for window in stats.timeline:
+        hottest = ", ".join(
+            f"{os.path.basename(path)}:{line_number} ({percent}%)"
+            for (path, line_number, percent) in window["top_lines"]
+        )
+        result.write(
+            f"| {window['start']}–{window['end']} | {window['total_samples']} "
+            f"| {window['percent_numba_samples']}% | {hottest} |\n"
+        )
+    return result.getvalue()
+
+
+def _render_instructions(stats: FinalStats) -> str:
+    """
+    Render the disassembly of the hottest lines, with per-instruction
+    percentages.
+    """
+    result = StringIO()
+    result.write("\n**Instructions for the hottest lines:**\n")
+    for hot_line in stats.hot_instructions:
+        code = getline(hot_line["file"], hot_line["line"]).strip()
+        result.write(
+            f"\n{hot_line['file']} line {hot_line['line']} "
+            + f"({hot_line['percent']}%): `{code}`\n\n```\n"
+        )
+        for address, text, percent in hot_line["instructions"]:
+            result.write(f"{_format_percent(percent)} | {address:#x}: {text}\n")
+        result.write("```\n")
+    return result.getvalue()
 
 
 def render_text(stats: FinalStats) -> str:
@@ -13,25 +188,171 @@ def render_text(stats: FinalStats) -> str:
     Render stats to text.
     """
     result = StringIO()
+    idle = ""
+    if stats.percent_idle_samples:
+        idle = f"{stats.percent_idle_samples}% idle in threadpool, "
     result.write(
         f"**Total samples:** {stats.total_samples} "
         + f"({stats.percent_other_samples}% non-Numba samples, "
+        + idle
         + f"{stats.percent_bad_samples}% bad samples)\n"
     )
+    if stats.percent_off_cpu:
+        result.write(
+            f"\n**Off-CPU:** {stats.percent_off_cpu}% of thread samples were "
+            + "waiting rather than running, and aren't included above\n"
+        )
+    if stats.duration:
+        requested = ""
+        if stats.requested_rate:
+            requested = f" ({stats.requested_rate}/second requested)"
+        result.write(
+            f"\n**Sampling:** {stats.achieved_rate} samples/second{requested} "
+            + f"over {stats.duration} seconds, process stopped by the sampler "
+            + f"{stats.percent_overhead}% of the time\n"
+        )
+    if stats.mean_stop_ms:
+        result.write(
+            f"\n**Process stopped per sample:** {stats.mean_stop_ms}ms mean, "
+            + f"{stats.max_stop_ms}ms max\n"
+        )
+    if len(stats.per_process) > 1:
+        result.write(_render_processes(stats))
+
+    if len(stats.per_thread) > 1:
+        result.write(_render_threads(stats))
+
+    if stats.numba_functions:
+        result.write(_render_functions(stats))
+
+    if stats.other_breakdown:
+        result.write(_render_other(stats))
 
-    for filename, line_percents in stats.numba_samples.items():
-        min_line = min(line_percents)
-        max_line = max(line_percents)
+    if stats.timeline:
+        result.write(_render_timeline(stats))
+
+    # Files that only have callers of other Numba code have no self time:
+    filenames = {**stats.numba_samples, **stats.inclusive_numba_samples}
+    if filenames and stats.numba_sample_errors:
+        result.write(
+            f"\n± is the margin of error at {CONFIDENCE:.0%} confidence, "
+            + "in percentage points.\n"
+        )
+    for filename in filenames:
+        line_percents = stats.numba_samples.get(filename, {})
+        inclusive_percents = stats.inclusive_numba_samples.get(filename, {})
+        # Only show inclusive time if some line calls into other code:
+        show_inclusive = any(
+            percent != line_percents.get(line_number, 0)
+            for (line_number, percent) in inclusive_percents.items()
+        )
+        min_line = min(line_percents.keys() | inclusive_percents.keys())
+        max_line = max(line_percents.keys() | inclusive_percents.keys())
+
+        line_errors = stats.numba_sample_errors.get(filename)
 
         result.write(f"\n{filename} (lines {min_line} to {max_line}):\n\n```\n")
+        if show_inclusive:
+            self_heading = "  Self      " if line_errors else "  Self"
+            result.write(f"{self_heading}   Incl |\n")
         for line_number in range(min_line, max_line + 1):
             code = getline(filename, line_number).rstrip()
-            percent = line_percents.get(line_number, 0)
-            if percent == 0:
-                usage = "      "
-            else:
-                usage = f"{percent:>5}%"
+            usage = _format_percent(line_percents.get(line_number, 0))
+            if line_errors:
+                usage += _format_error(line_errors.get(line_number))
+            if show_inclusive:
+                usage += " " + _format_percent(inclusive_percents.get(line_number, 0))
             result.write(f"{usage} | {code}\n")
         result.write("```\n")
 
+    if stats.hot_instructions:
+        result.write(_render_instructions(stats))
+
     return result.getvalue()
+
+
+def _frame_name(frame: FrameKey) -> str:
+    """
+    A human-readable name for a frame.
+    """
+    file, line, func, library = frame
+    if file:
+        return f"{func or '??'} ({file}:{line})"
+    if library:
+        return f"{func or '??'} [{os.path.basename(library)}]"
+    return func or "??"
+
+
+def render_collapsed(stats: Stats) -> str:
+    """
+    Render call stacks in the collapsed format used by ``flamegraph.pl`` and
+    many other flamegraph tools: one line per unique stack, outermost frame
+    first, followed by the sample count.
+    """
+    tree = stats.call_tree
+    names = [_frame_name(frame).replace(";", ":") for frame in tree.frames]
+    lines = []
+    for path, count in tree.stacks():
+        if path:
+            lines.append(";".join(names[i] for i in path) + f" {count}\n")
+    return "".join(sorted(lines))
+
+
+def render_speedscope(stats: Stats) -> str:
+    """
+    Render call stacks as a speedscope (https://www.speedscope.app) JSON
+    profile, with one profile per thread.
+    """
+    frames: list[dict[str, object]] = []
+    frame_indexes: dict[FrameKey, int] = {}
+
+    def frame_index(frame: FrameKey) -> int:
+        index = frame_indexes.get(frame)
+        if index is None:
+            index = frame_indexes[frame] = len(frames)
+            file, line, _, _ = frame
+            entry: dict[str, object] = {"name": _frame_name(frame)}
+            if file:
+                entry["file"] = file
+                entry["line"] = line
+            frames.append(entry)
+        return index
+
+    # Each thread's stacks are only kept if ``Stats.thread_call_trees`` was
+    # set, otherwise all threads go in one profile:
+    processes = len({pid for (pid, _) in stats.per_thread}) > 1
+    trees = {
+        (
+            f"Process {pid} thread {thread_id}" if processes else f"Thread {thread_id}"
+        ): counts.call_tree
+        for ((pid, thread_id), counts) in stats.per_thread.items()
+        if counts.call_tree is not None
+    } or {"All threads": stats.call_tree}
+    profiles = []
+    for name, tree in trees.items():
+        samples = []
+        weights = []
+        for path, count in tree.stacks():
+            samples.append([frame_index(tree.frames[i]) for i in path])
+            weights.append(count)
+        profiles.append(
+            {
+                "type": "sampled",
+                "name": name,
+                "unit": "none",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }
+        )
+
+    return json.dumps(
+        {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+            "name": "profila",
+            "exporter": "profila",
+        }
+    )
@@ -0,0 +1,168 @@
+"""
+Stream samples to, and read them back from, an append-only log file.
+
+The log is newline-delimited JSON, written as samples arrive so that a crash
+or kill only loses the samples still in flight.  Frames are interned, so each
+unique frame is only written once:
+
+* ``["profila-samples", <version>, <metadata>]``: the first line.
+* ``["F", <id>, <file>, <line>, <func>, <library>, <address>]``: defines a
+  frame id.  The address is ``null`` unless instructions were recorded.
+* ``["I", <address>, <file>, <line>, <func>, <instruction>]``: a disassembled
+  instruction, written before the first sample that needed it.
+* ``["P", <thread id>, <pid>]``: the process a thread belongs to, written
+  before the first sample that needed it.  Older readers ignore these.
+* ``["O", [<thread id>, ...]]``: with on-CPU sampling, the threads that weren't
+  running and so weren't sampled, written just before the sample they were
+  skipped in.  Older readers ignore these.
+* ``["S", <timestamp>, <stop time>, [[<thread id>, [<frame id>, ...]], ...]]``:
+  one sample.  A thread's frame list is ``null`` if its stack couldn't be
+  read.
+"""
+
+from collections.abc import Iterator
+import json
+from typing import Any, Optional, TextIO
+
+from ._gdb import Frame, Instruction, Sample
+
+MAGIC = "profila-samples"
+VERSION = 2
+
+
+class SampleLogWriter:
+    """
+    Write samples to a log file.
+    """
+
+    def __init__(self, f: TextIO, metadata: dict[str, Any]) -> None:
+        self._file = f
+        # Map (file, line, func, library, address) to frame id:
+        self._frame_ids: dict[
+            tuple[str, int, Optional[str], Optional[str], Optional[int]], int
+        ] = {}
+        # Map thread id to process id, as written so far:
+        self._pids: dict[int, int] = {}
+        self._write([MAGIC, VERSION, metadata])
+
+    def _write(self, record: list[Any]) -> None:
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def _frame_id(self, frame: Frame) -> int:
+        key = (frame.file, frame.line, frame.func, frame.library, frame.address)
+        frame_id = self._frame_ids.get(key)
+        if frame_id is None:
+            frame_id = self._frame_ids[key] = len(self._frame_ids)
+            self._write(["F", frame_id, *key])
+        return frame_id
+
+    def write(self, sample: Sample) -> None:
+        """
+        Append a sample, and flush it so it survives a crash.
+        """
+        for instruction in sample.disassembly:
+            self._write(
+                [
+                    "I",
+                    instruction.address,
+                    instruction.file,
+                    instruction.line,
+                    instruction.func,
+                    instruction.text,
+                ]
+            )
+        for thread_id, pid in sample.pids.items():
+            if self._pids.get(thread_id) != pid:
+                self._pids[thread_id] = pid
+                self._write(["P", thread_id, pid])
+        if sample.off_cpu:
+            self._write(["O", sample.off_cpu])
+        threads = [
+            [
+                thread_id,
+                None if stack is None else [self._frame_id(f) for f in stack],
+            ]
+            for thread_id, stack in sample.threads.items()
+        ]
+        self._write(["S", sample.timestamp, sample.stop_time, threads])
+        self._file.flush()
+
+
+class SampleLogReader:
+    """
+    Read samples back from a log file, one at a time.
+    """
+
+    def __init__(self, f: TextIO) -> None:
+        self._file = f
+        try:
+            magic, version, metadata = json.loads(f.readline())
+        except ValueError:
+            raise ValueError("Not a profila sample log.") from None
+        if magic != MAGIC:
+            raise ValueError("Not a profila sample log.")
+        # Version 1 logs are the same, minus addresses and instructions:
+        if version not in (1, VERSION):
+            raise ValueError(f"Unsupported sample log version {version}.")
+        self.metadata: dict[str, Any] = metadata
+
+    def __iter__(self) -> Iterator[Sample]:
+        frames: dict[int, Frame] = {}
+        pids: dict[int, int] = {}
+        # Instructions and off-CPU threads to attach to the next sample:
+        disassembly: list[Instruction] = []
+        off_cpu: list[int] = []
+        for line in self._file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A partially written final line, if the profiler was killed:
+                return
+            if record[0] == "F":
+                _, frame_id, file, line_number, func, library, *address = record
+                frames[frame_id] = Frame(
+                    file=file,
+                    line=line_number,
+                    func=func,
+                    library=library,
+                    address=address[0] if address else None,
+                )
+            elif record[0] == "I":
+                _, address, file, line_number, func, text = record
+                disassembly.append(
+                    Instruction(
+                        address=address,
+                        file=file,
+                        line=line_number,
+                        func=func,
+                        text=text,
+                    )
+                )
+            elif record[0] == "P":
+                _, thread_id, pid = record
+                pids[thread_id] = pid
+            elif record[0] == "O":
+                off_cpu = record[1]
+            elif record[0] == "S":
+                _, timestamp, stop_time, threads = record
+                yield Sample(
+                    threads={
+                        thread_id: (
+                            None
+                            if frame_ids is None
+                            else [frames[frame_id] for frame_id in frame_ids]
+                        )
+                        for (thread_id, frame_ids) in threads
+                    },
+                    stop_time=stop_time,
+                    timestamp=timestamp,
+                    disassembly=disassembly,
+                    pids={
+                        thread_id: pids[thread_id]
+                        for thread_id in [t for (t, _) in threads] + off_cpu
+                        if thread_id in pids
+                    },
+                    off_cpu=off_cpu,
+                )
+                disassembly = []
+                off_cpu = []
@@ -0,0 +1,151 @@
+"""
+Profile the current process from a long-lived ``attach_automated`` subprocess.
+
+Used by the Jupyter magics and by ``profila.profile()``.  Attaching gdb and
+loading symbols takes seconds, so the subprocess is started the first time it's
+needed and stays attached, with sampling paused when nothing is being profiled,
+until ``detach()`` is called.
+"""
+
+import ctypes
+import json
+import os
+import shlex
+import sys
+from subprocess import Popen, PIPE
+from typing import Any, Optional
+
+from ._jsonformat import from_json
+from ._options import SESSION_PARSER, new_stats, sampler_options
+from ._stats import FinalStats
+
+# From linux/prctl.h:
+PR_SET_PTRACER = 0x59616D61
+
+
+def _set_ptracer(pid: int) -> None:
+    """
+    Allow the given process to attach via ptrace(), or with 0 switch back to
+    the normal ptrace() policy.
+    """
+    prctl = ctypes.CDLL("libc.so.6").prctl
+    prctl.argtypes = [ctypes.c_int, ctypes.c_ulong]
+    prctl.restype = ctypes.c_int
+    prctl(PR_SET_PTRACER, pid)
+
+
+def parse_options(options: str) -> list[str]:
+    """
+    Split and check sampling options, as passed to ``%%profila``.
+
+    Raises ``ValueError`` if they're invalid.
+    """
+    args = shlex.split(options)
+    try:
+        parsed_args = SESSION_PARSER.parse_args(args)
+        sampler_options(parsed_args)
+        new_stats(parsed_args)
+    except SystemExit as e:
+        raise ValueError(
+            e.code if isinstance(e.code, str) else f"Invalid options: {options!r}"
+        ) from None
+    return args
+
+
+class Session:
+    """
+    An ``attach_automated`` subprocess attached to this process.
+    """
+
+    def __init__(self) -> None:
+        # Allow this process' children to attach via ptrace(), so that gdb works:
+        _set_ptracer(os.getpid())
+        try:
+            self._process = Popen(
+                [sys.executable, "-m", "profila", "attach_automated", str(os.getpid())],
+                stdin=PIPE,
+                stdout=PIPE,
+            )
+            # Wait for it to be ready:
+            self._receive("attached")
+        finally:
+            # Switch back to normal ptrace() policy; gdb stays attached:
+            _set_ptracer(0)
+        self.sampling = False
+
+    def _send(self, command: dict[str, Any]) -> None:
+        assert self._process.stdin is not None
+        self._process.stdin.write(json.dumps(command).encode("utf-8") + b"\n")
+        self._process.stdin.flush()
+
+    def _receive(self, message: str) -> dict[str, Any]:
+        assert self._process.stdout is not None
+        line = self._process.stdout.readline()
+        if not line:
+            raise RuntimeError("The profiler exited unexpectedly.")
+        result: dict[str, Any] = json.loads(line)
+        assert result["message"] == message
+        return result
+
+    def is_alive(self) -> bool:
+        return self._process.poll() is None
+
+    def start(self, args: list[str]) -> None:
+        """
+        Start sampling, with options from ``parse_options()``.
+        """
+        if self.sampling:
+            raise RuntimeError("Profiling is already in progress.")
+        self.sampling = True
+        self._send({"command": "start", "args": args})
+        self._receive("started")
+
+    def numba_samples(self) -> int:
+        """
+        How many samples were in Numba code since sampling started.
+        """
+        self._send({"command": "count"})
+        count: int = self._receive("count")["numba_samples"]
+        return count
+
+    def stop(self) -> FinalStats:
+        """
+        Pause sampling, and return the stats since it started.
+        """
+        self.sampling = False
+        self._send({"command": "stop"})
+        return from_json(self._receive("stats")["stats"])
+
+    def close(self) -> None:
+        """
+        Detach, leaving this process running.
+        """
+        assert self._process.stdin is not None
+        # Closing stdin tells the subprocess to detach and exit:
+        self._process.stdin.close()
+        self._process.wait()
+
+
+_SESSION: Optional[Session] = None
+
+
+def get_session() -> Session:
+    """
+    Return the attached session, attaching first if necessary.
+    """
+    global _SESSION
+    if _SESSION is None or not _SESSION.is_alive():
+        _SESSION = Session()
+    return _SESSION
+
+
+def detach() -> None:
+    """
+    Detach the profiler from this process, if it's attached.
+
+    Profiling again later will attach again.
+    """
+    global _SESSION
+    if _SESSION is not None:
+        session, _SESSION = _SESSION, None
+        session.close()
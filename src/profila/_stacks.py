@@ -0,0 +1,126 @@
+"""
+Aggregate whole call stacks into a prefix tree.
+"""
+
+from collections import Counter
+from collections.abc import Callable, Hashable, Iterator
+from dataclasses import dataclass, field
+from typing import Optional, TypeVar
+
+from ._gdb import Frame
+
+# Frames are interned by (file, line, func, library):
+FrameKey = tuple[str, int, Optional[str], Optional[str]]
+
+K = TypeVar("K", bound=Hashable)
+
+
+def frame_key(frame: Frame) -> FrameKey:
+    """
+    The key a frame is interned by.
+    """
+    return (frame.file, frame.line, frame.func, frame.library)
+
+
+@dataclass
+class StackNode:
+    # Samples whose stack passes through this node:
+    total: int = 0
+    # Samples whose stack ends at this node:
+    self_count: int = 0
+    # Map frame id to the node for the next frame inwards:
+    children: dict[int, "StackNode"] = field(default_factory=dict)
+
+
+@dataclass
+class StackTree:
+    """
+    A prefix tree of call stacks, with the outermost frame at the root.
+
+    Frames are interned, so each unique frame is only stored once.
+    """
+
+    # Map frame id to the interned frame:
+    frames: list[FrameKey] = field(default_factory=list)
+    frame_ids: dict[FrameKey, int] = field(default_factory=dict)
+    root: StackNode = field(default_factory=StackNode)
+
+    def _intern(self, key: FrameKey) -> int:
+        frame_id = self.frame_ids.get(key)
+        if frame_id is None:
+            frame_id = self.frame_ids[key] = len(self.frames)
+            self.frames.append(key)
+        return frame_id
+
+    def add(self, stack: list[Frame]) -> None:
+        """
+        Add a stack, innermost frame first.
+        """
+        node = self.root
+        node.total += 1
+        for frame in reversed(stack):
+            frame_id = self._intern(frame_key(frame))
+            child = node.children.get(frame_id)
+            if child is None:
+                child = node.children[frame_id] = StackNode()
+            child.total += 1
+            node = child
+        node.self_count += 1
+
+    def merge(self, other: "StackTree") -> None:
+        """
+        Add all of another tree's stacks to this one.
+        """
+        # Map the other tree's frame ids to ours:
+        frame_ids = [self._intern(key) for key in other.frames]
+
+        pending = [(self.root, other.root)]
+        while pending:
+            node, other_node = pending.pop()
+            node.total += other_node.total
+            node.self_count += other_node.self_count
+            for other_frame_id, other_child in other_node.children.items():
+                frame_id = frame_ids[other_frame_id]
+                child = node.children.get(frame_id)
+                if child is None:
+                    child = node.children[frame_id] = StackNode()
+                pending.append((child, other_child))
+
+    def stacks(self) -> Iterator[tuple[list[int], int]]:
+        """
+        Yield each unique stack as frame ids, outermost first, with the number
+        of samples that had that stack.
+        """
+        pending: list[tuple[list[int], StackNode]] = [([], self.root)]
+        while pending:
+            path, node = pending.pop()
+            if node.self_count:
+                yield path, node.self_count
+            for frame_id, child in node.children.items():
+                pending.append((path + [frame_id], child))
+
+    def inclusive_counts(self, key: Callable[[FrameKey], Optional[K]]) -> Counter[K]:
+        """
+        Count how many samples include each key anywhere in their stack.
+
+        ``key()`` maps a frame to what's being counted, e.g. its line, or
+        ``None`` to ignore the frame.  Each sample is counted at most once per
+        key, even if the key appears multiple times in its stack.
+        """
+        result: Counter[K] = Counter()
+        # Keys already on the path from the root, with their multiplicity:
+        on_path: Counter[K] = Counter()
+
+        def visit(node: StackNode) -> None:
+            for frame_id, child in node.children.items():
+                child_key = key(self.frames[frame_id])
+                if child_key is not None:
+                    if not on_path[child_key]:
+                        result[child_key] += child.total
+                    on_path[child_key] += 1
+                visit(child)
+                if child_key is not None:
+                    on_path[child_key] -= 1
+
+        visit(self.root)
+        return result
@@ -2,10 +2,152 @@
 Aggregate call stacks.
 """
 
-from collections import Counter, defaultdict
+from array import array
+from collections import Counter, deque
+from collections.abc import Iterable
 from dataclasses import dataclass, field
-from typing import Optional
-from ._gdb import Frame
+from math import sqrt
+import os
+import re
+from statistics import NormalDist
+from typing import Any, Optional
+from ._gdb import Frame, Instruction, Sample, _is_threadpool_frame
+from ._stacks import FrameKey, StackTree
+
+
+def _attributed_line(stack: list[Frame]) -> Optional[tuple[str, int]]:
+    """
+    The (file, line) a stack's sample is attributed to, or ``None`` if it
+    isn't a Numba sample.
+    """
+    for frame in stack:
+        if frame.file.endswith(".py"):
+            return (frame.file, frame.line)
+        if _is_threadpool_frame(frame):
+            return None
+    return None
+
+
+# Shared libraries implementing BLAS and LAPACK, which NumPy and SciPy use for
+# linear algebra:
+_BLAS_LIBRARIES = (
+    "libopenblas",
+    "libmkl",
+    "libblas",
+    "liblapack",
+    "libblis",
+    "libflexiblas",
+)
+
+# Low-level libraries that are called on behalf of other code, so samples in
+# them are attributed to their caller if possible:
+_SYSTEM_LIBRARIES = ("libc.", "libm.", "libpthread", "ld-linux", "libgcc", "libstdc++")
+
+
+def _package(library: str) -> Optional[str]:
+    """
+    The name of the installed Python package a shared library is part of,
+    e.g. "numpy" for ``.../site-packages/numpy/core/_multiarray_umath.so``.
+    """
+    parts = library.split(os.sep)
+    for index, part in enumerate(parts[:-1]):
+        if part in ("site-packages", "dist-packages"):
+            # Wheels bundle their libraries in e.g. "numpy.libs":
+            return parts[index + 1].removesuffix(".libs")
+    return None
+
+
+def _is_interpreter_frame(frame: Frame) -> bool:
+    """
+    Is this frame part of the CPython interpreter?
+    """
+    if frame.library is not None:
+        return os.path.basename(frame.library).startswith("libpython")
+    # Statically linked interpreters have no library:
+    return (frame.func or "").startswith(("Py", "_Py"))
+
+
+def _other_category(stack: list[Frame]) -> str:
+    """
+    Where a sample that isn't in Numba code was spent, e.g. "numpy:
+    DOUBLE_add", "BLAS: dgemm_kernel" or "Python interpreter:
+    _PyEval_EvalFrameDefault".
+
+    The innermost frame in BLAS, a Python package's extension module, or the
+    interpreter decides the category; low-level system libraries are only
+    used if there's nothing else.
+    """
+    fallback = None
+    for frame in stack:
+        func = frame.func or "??"
+        if _is_interpreter_frame(frame):
+            return f"Python interpreter: {func}"
+        if frame.library is None:
+            continue
+        library = os.path.basename(frame.library)
+        if library.startswith(_BLAS_LIBRARIES):
+            return f"BLAS: {func}"
+        package = _package(frame.library)
+        if package is not None:
+            return f"{package}: {func}"
+        if fallback is None:
+            fallback = f"{library}: {func}"
+        if not library.startswith(_SYSTEM_LIBRARIES):
+            return fallback
+    return fallback or "unknown"
+
+
+def _numba_line(frame: FrameKey) -> Optional[tuple[str, int]]:
+    """
+    The (file, line) of a Numba frame, or ``None`` for other frames.
+    """
+    file, line, _, _ = frame
+    if file.endswith(".py"):
+        return (file, line)
+    return None
+
+
+def _numba_specialization(frame: FrameKey) -> Optional[tuple[str, str]]:
+    """
+    The function name and the argument types of the compiled specialization
+    of a Numba frame, or ``None`` for other frames.
+    """
+    file, _, func, _ = frame
+    if file.endswith(".py") and func:
+        return split_signature(func)
+    return None
+
+
+def _numba_function(frame: FrameKey) -> Optional[str]:
+    """
+    The function name of a Numba frame, or ``None`` for other frames.
+    """
+    specialization = _numba_specialization(frame)
+    if specialization is None:
+        return None
+    return specialization[0]
+
+
+# ABI tags Numba adds to compiled function names:
+_ABI_TAG = re.compile(r"\[abi:[^\]]*\]")
+
+
+def split_signature(func: str) -> tuple[str, str]:
+    """
+    Split a Numba function name, as demangled by gdb, into the Python function
+    name and the argument types of the compiled specialization.
+
+    E.g. ``"__main__::simple[abi:v1](Array<double, 1, C, mutable, aligned>)"``
+    becomes ``("__main__.simple", "(Array<double, 1, C, mutable, aligned>)")``.
+    """
+    name, paren, args = func.partition("(")
+    return _ABI_TAG.sub("", name).replace("::", "."), paren + args
+
+
+# A thread is identified by its process id, or 0 if that isn't known, and its
+# gdb thread id.  gdb thread ids are only unique within one gdb, and processes
+# sampled at the same time each have their own gdb:
+ThreadKey = tuple[int, int]
 
 
 @dataclass(frozen=True)
@@ -19,12 +161,68 @@ class FinalStats:
     percent_other_samples: float
     # Map path to mapping of line number to percentage.
     numba_samples: dict[str, dict[int, float]]
+    percent_idle_samples: float = 0.0
+    # With on-CPU sampling, the percentage of thread samples that were skipped
+    # because the thread was waiting, e.g. for I/O or a lock.  These aren't
+    # part of ``total_samples``, so other percentages are of on-CPU time:
+    percent_off_cpu: float = 0.0
+    # Map where non-Numba samples were spent, e.g. "numpy: DOUBLE_add" or
+    # "Python interpreter: _PyEval_EvalFrameDefault", to percentage, most
+    # common first:
+    other_breakdown: dict[str, float] = field(default_factory=dict)
+    # Map path to mapping of line number to the margin of error of its
+    # percentage, in percentage points, at the ``CONFIDENCE`` level:
+    numba_sample_errors: dict[str, dict[int, float]] = field(default_factory=dict)
+    # Map (process id, gdb thread id) to that thread's stats, with
+    # percentages relative to that thread's samples.  The process id is 0 if
+    # it isn't known:
+    per_thread: dict[ThreadKey, "FinalStats"] = field(default_factory=dict)
+    # Map process id to that process' stats, with percentages relative to that
+    # process' samples; there's more than one process when child processes
+    # are followed.
+    per_process: dict[int, "FinalStats"] = field(default_factory=dict)
+    # How long the process was stopped for each sample, in milliseconds:
+    mean_stop_ms: float = 0.0
+    max_stop_ms: float = 0.0
+    # Wall-clock seconds from the first sample to the last:
+    duration: float = 0.0
+    # Samples per second that were requested, and actually achieved:
+    requested_rate: float = 0.0
+    achieved_rate: float = 0.0
+    # Percentage of the time the process was stopped by the sampler:
+    percent_overhead: float = 0.0
+    # Map path to mapping of line number to percentage of samples that had
+    # that line anywhere in their stack, e.g. lines calling other functions.
+    inclusive_numba_samples: dict[str, dict[int, float]] = field(default_factory=dict)
+    # Map Numba function name to its "self" percentage (samples attributed to
+    # its lines) and "inclusive" percentage (samples with it anywhere in the
+    # stack):
+    numba_functions: dict[str, dict[str, float]] = field(default_factory=dict)
+    # Map Numba function name to mapping of the argument types of each
+    # compiled specialization, e.g. "(float32, float32)", to its "self" and
+    # "inclusive" percentages:
+    numba_specializations: dict[str, dict[str, dict[str, float]]] = field(
+        default_factory=dict
+    )
+    # One entry per time window, oldest first, each with "start" and "end"
+    # (seconds since the first sample), "total_samples",
+    # "percent_numba_samples", and "top_lines", a list of [path, line number,
+    # percentage]. Percentages are relative to that window's samples:
+    timeline: list[dict[str, Any]] = field(default_factory=list)
+    # The hottest lines that have disassembly, hottest first, each with "file",
+    # "line", "percent", and "instructions", a list of [address, instruction,
+    # percentage] in address order:
+    hot_instructions: list[dict[str, Any]] = field(default_factory=list)
 
     def total_percent(self) -> float:
         """
         Add up all percentages, should always be approximately 100%.
         """
-        result = self.percent_bad_samples + self.percent_other_samples
+        result = (
+            self.percent_bad_samples
+            + self.percent_other_samples
+            + self.percent_idle_samples
+        )
         for line_counts in self.numba_samples.values():
             result += sum(line_counts.values())
         if result == 0.0:
@@ -32,41 +230,522 @@ class FinalStats:
             result = 100.0
         return result
 
+    def percent_numba_samples(self) -> float:
+        """
+        Percentage of samples that were in Numba code.
+        """
+        return round(
+            sum(
+                (
+                    sum(line_counts.values())
+                    for line_counts in self.numba_samples.values()
+                ),
+                0.0,
+            ),
+            1,
+        )
+
+
+def _add_counts(target: "array[int]", source: "array[int]") -> None:
+    """
+    Add ``source`` counts to ``target`` counts, element by element.
+
+    With NumPy, which is always installed alongside Numba, this is one
+    vectorized addition into ``target``'s memory; reading saved profiles
+    doesn't need Numba, so otherwise it's a Python loop.
+    """
+    if len(target) < len(source):
+        target.extend(_zeros(len(source) - len(target)))
+    if not source:
+        return
+    try:
+        import numpy as np
+    except ImportError:
+        # Most lines have no samples, so only touch those that do:
+        for line_number, count in enumerate(source):
+            if count:
+                target[line_number] += count
+        return
+    # The views are released straight away, so ``target`` can still grow:
+    np.frombuffer(target, dtype=np.uint64)[: len(source)] += np.frombuffer(
+        source, dtype=np.uint64
+    )
+
+
+def _add_line(line_counts: list["array[int]"], file_id: int, line: int) -> None:
+    """
+    Add a sample to the per-line counts of an interned file, growing them as
+    needed.
+    """
+    while len(line_counts) <= file_id:
+        line_counts.append(_zeros(0))
+    counts = line_counts[file_id]
+    if line >= len(counts):
+        counts.extend(_zeros(line + 1 - len(counts)))
+    counts[line] += 1
+
+
+def _zeros(length: int) -> "array[int]":
+    """
+    An array of ``length`` zero counts.
+    """
+    return array("Q", bytes(8 * length))
+
+
+# How many of the hottest lines to report per time window:
+TIMELINE_TOP_LINES = 3
+
+# How many of the hottest lines to show disassembly for:
+DISASSEMBLED_HOT_LINES = 5
+
+# Confidence level for the margin of error of line percentages:
+CONFIDENCE = 0.95
+_Z = NormalDist().inv_cdf(1 - (1 - CONFIDENCE) / 2)
+
+# How many of the hottest lines need a small enough margin of error for
+# ``top_lines_error()``:
+PRECISION_TOP_LINES = 5
+
+
+def percent_error(count: int, total: int) -> float:
+    """
+    The margin of error, in percentage points, of ``count`` out of ``total``
+    samples as a percentage.
+
+    This is half the width of the Wilson score interval, which unlike the
+    textbook normal approximation doesn't claim certainty for lines with
+    few samples, or with all of them.  It assumes samples are independent,
+    which is roughly true for programs that don't synchronize with the
+    sampler.
+    """
+    if total == 0:
+        return 100.0
+    share = count / total
+    z_squared = _Z**2
+    return (
+        100
+        * _Z
+        / (1 + z_squared / total)
+        * sqrt(share * (1 - share) / total + z_squared / (4 * total**2))
+    )
+
+
+@dataclass
+class TimeBucket:
+    """
+    Samples from one fixed-width window of time.
+    """
+
+    # The window covers [index * width, (index + 1) * width) seconds since the
+    # epoch, so windows line up across different ``Stats``:
+    index: int
+    total_samples: int = 0
+    # Map (path, line number) to Numba sample count:
+    line_counts: Counter[tuple[str, int]] = field(default_factory=Counter)
+
+    def add(self, stack: Optional[list[Frame]]) -> None:
+        """
+        Add a sample of a single thread's stack.
+        """
+        self.total_samples += 1
+        if stack is not None:
+            line = _attributed_line(stack)
+            if line is not None:
+                self.line_counts[line] += 1
+
+    def merge(self, other: "TimeBucket") -> None:
+        """
+        Add another bucket's samples for the same window to this one.
+        """
+        self.total_samples += other.total_samples
+        self.line_counts.update(other.line_counts)
+
+
+@dataclass
+class SampleCounts:
+    """
+    Samples of one thread or process, with only what the per-thread and
+    per-process tables need, so tracking them stays cheap.
+    """
+
+    numba_samples: int = 0
+    other_samples: int = 0
+    idle_samples: int = 0
+    bad_samples: int = 0
+    off_cpu_samples: int = 0
+    # Per file id, interned by the ``Stats`` these counts belong to, Numba
+    # sample counts indexed by line number:
+    line_counts: list["array[int]"] = field(default_factory=list)
+    # Every stack seen, only kept if needed for a per-thread speedscope
+    # profile:
+    call_tree: Optional[StackTree] = None
+
+    def total_samples(self) -> int:
+        """
+        Total number of all samples.
+        """
+        return (
+            self.bad_samples
+            + self.other_samples
+            + self.idle_samples
+            + self.numba_samples
+        )
+
+    def add(
+        self,
+        stack: Optional[list[Frame]],
+        line: Optional[tuple[int, int]],
+        idle: bool,
+    ) -> None:
+        """
+        Add a sample of a single thread's stack, which ``Stats`` already
+        attributed to a Numba ``line``, a (file id, line number), or found to
+        be ``idle``.
+        """
+        if stack is None:
+            self.bad_samples += 1
+            return
+        if self.call_tree is not None:
+            self.call_tree.add(stack)
+        if line is not None:
+            self.numba_samples += 1
+            _add_line(self.line_counts, *line)
+        elif idle:
+            self.idle_samples += 1
+        else:
+            self.other_samples += 1
+
+    def merge(self, other: "SampleCounts", file_ids: list[int]) -> None:
+        """
+        Add another ``SampleCounts``' samples to this one, where ``file_ids``
+        maps the other's file ids to this one's.
+        """
+        self.numba_samples += other.numba_samples
+        self.other_samples += other.other_samples
+        self.idle_samples += other.idle_samples
+        self.bad_samples += other.bad_samples
+        self.off_cpu_samples += other.off_cpu_samples
+        for other_id, counts in enumerate(other.line_counts):
+            file_id = file_ids[other_id]
+            while len(self.line_counts) <= file_id:
+                self.line_counts.append(_zeros(0))
+            _add_counts(self.line_counts[file_id], counts)
+        if other.call_tree is not None:
+            if self.call_tree is None:
+                self.call_tree = StackTree()
+            self.call_tree.merge(other.call_tree)
+
+    def finalize(self, files: list[str]) -> FinalStats:
+        """
+        Calculate final stats, with percentages relative to these samples,
+        given the interned filenames.
+        """
+        total_samples = self.total_samples()
+
+        def to_percent(count: int) -> float:
+            if total_samples == 0:
+                return 0.0
+            return round((count / total_samples) * 100, 1)
+
+        numba_samples: dict[str, dict[int, float]] = {}
+        numba_sample_errors: dict[str, dict[int, float]] = {}
+        for filename, counts in sorted(zip(files, self.line_counts)):
+            for line_number, count in enumerate(counts):
+                if count:
+                    numba_samples.setdefault(filename, {})[line_number] = to_percent(
+                        count
+                    )
+                    numba_sample_errors.setdefault(filename, {})[line_number] = round(
+                        percent_error(count, total_samples), 1
+                    )
+        percent_off_cpu = 0.0
+        if self.off_cpu_samples:
+            percent_off_cpu = round(
+                self.off_cpu_samples / (self.off_cpu_samples + total_samples) * 100, 1
+            )
+        return FinalStats(
+            total_samples=total_samples,
+            percent_bad_samples=to_percent(self.bad_samples),
+            percent_other_samples=to_percent(self.other_samples),
+            numba_samples=numba_samples,
+            percent_idle_samples=to_percent(self.idle_samples),
+            percent_off_cpu=percent_off_cpu,
+            numba_sample_errors=numba_sample_errors,
+        )
+
 
 @dataclass
 class Stats:
-    # Map Python filenames to per-line counts. Should be Numba samples only.
-    path_to_line_counts: defaultdict[str, Counter[int]] = field(
-        default_factory=lambda: defaultdict(Counter)
-    )
+    # Interned Python filenames; a file's id is its index:
+    files: list[str] = field(default_factory=list)
+    file_ids: dict[str, int] = field(default_factory=dict)
+    # Per file id, sample counts indexed by line number. Should be Numba
+    # samples only.
+    line_counts: list["array[int]"] = field(default_factory=list)
+    # Running total of all line counts:
+    numba_sample_count: int = 0
     # Samples we couldn't parse:
     bad_samples: int = 0
     # Samples that weren't Numba based:
     other_samples: int = 0
+    # Map where non-Numba samples were spent, e.g. "numpy: DOUBLE_add", to
+    # number of samples:
+    other_counts: Counter[str] = field(default_factory=Counter)
+    # Samples where the thread was waiting inside Numba's threadpool, e.g. a
+    # worker with no work, or the main thread waiting for the workers:
+    idle_samples: int = 0
+    # With on-CPU sampling, thread samples skipped because the thread wasn't
+    # running; not included in the total:
+    off_cpu_samples: int = 0
+    # Map (process id, gdb thread id) to sample counts for that thread alone:
+    per_thread: dict[ThreadKey, SampleCounts] = field(default_factory=dict)
+    # Map process id to sample counts for that process alone:
+    per_process: dict[int, SampleCounts] = field(default_factory=dict)
+    # Whether to also keep each thread's stacks, for speedscope profiles:
+    thread_call_trees: bool = False
+    # Number of times the process was interrupted, and how long in total (and
+    # at most) it was kept stopped, in seconds:
+    interruptions: int = 0
+    total_stop_time: float = 0.0
+    max_stop_time: float = 0.0
+    # Timestamps of the first and latest samples:
+    first_timestamp: Optional[float] = None
+    last_timestamp: Optional[float] = None
+    # The requested seconds between samples, if known:
+    interval: float = 0.0
+    # How many processes were sampled at the same time, each by its own gdb;
+    # the achieved rate and overhead are per process:
+    sampled_processes: int = 1
+    # Every stack we've seen:
+    call_tree: StackTree = field(default_factory=StackTree)
+    # Map Numba function name, including its specialization, to number of
+    # samples attributed to it:
+    function_counts: Counter[str] = field(default_factory=Counter)
+    # Width of time windows in seconds, or 0 to disable the timeline:
+    bucket_width: float = 0.0
+    # Only the most recent windows are kept, so memory use stays bounded:
+    max_buckets: int = 100
+    buckets: deque[TimeBucket] = field(default_factory=deque)
+    # Map address to disassembled instruction, for Numba functions we've seen:
+    instructions: dict[int, Instruction] = field(default_factory=dict)
+    # Map instruction address to number of Numba samples attributed to it:
+    instruction_counts: Counter[int] = field(default_factory=Counter)
+
+    def __post_init__(self) -> None:
+        self.buckets = deque(self.buckets, maxlen=self.max_buckets)
+
+    @property
+    def path_to_line_counts(self) -> dict[str, dict[int, int]]:
+        """
+        Map Python filenames to per-line counts, for lines with samples.
+        """
+        return {
+            filename: {
+                line_number: count
+                for (line_number, count) in enumerate(counts)
+                if count
+            }
+            for (filename, counts) in zip(self.files, self.line_counts)
+        }
 
     def total_samples(self) -> int:
         """
         Total number of all samples.
         """
-        result = self.bad_samples + self.other_samples
-        for line_counts in self.path_to_line_counts.values():
-            result += sum(line_counts.values())
-        return result
+        return (
+            self.bad_samples
+            + self.other_samples
+            + self.idle_samples
+            + self.numba_sample_count
+        )
+
+    def _file_id(self, filename: str) -> int:
+        """
+        Return the id of a file, interning it if it's new.
+        """
+        file_id = self.file_ids.get(filename)
+        if file_id is None:
+            file_id = self.file_ids[filename] = len(self.files)
+            self.files.append(filename)
+            self.line_counts.append(_zeros(0))
+        return file_id
+
+    def add_sample(
+        self,
+        sample: Optional[list[Frame]],
+        thread_id: Optional[int] = None,
+        pid: Optional[int] = None,
+    ) -> None:
+        """
+        Add a sample of a single thread's stack.
+
+        If ``thread_id`` or ``pid`` are given, the sample is also counted for
+        that thread or process.
+        """
+        line, idle = self._add_stack(sample)
+        if thread_id is not None:
+            self._thread_counts(pid, thread_id).add(sample, line, idle)
+        if pid is not None:
+            self.per_process.setdefault(pid, SampleCounts()).add(sample, line, idle)
 
-    def add_sample(self, sample: Optional[list[Frame]]) -> None:
+    def _add_stack(
+        self, sample: Optional[list[Frame]]
+    ) -> tuple[Optional[tuple[int, int]], bool]:
         """
-        Add a sample.
+        Add a stack to the overall stats, returning the (file id, line number)
+        it was attributed to, if any, and whether it was idle.
         """
         if sample is None:
             self.bad_samples += 1
-            return
+            return None, False
 
+        self.call_tree.add(sample)
         for frame in sample:
             if frame.file.endswith(".py"):
-                self.path_to_line_counts[frame.file][frame.line] += 1
-                return
+                file_id = self._file_id(frame.file)
+                _add_line(self.line_counts, file_id, frame.line)
+                self.numba_sample_count += 1
+                if frame.address is not None:
+                    self.instruction_counts[frame.address] += 1
+                if frame.func:
+                    self.function_counts[frame.func] += 1
+                return (file_id, frame.line), False
+            if _is_threadpool_frame(frame):
+                self.idle_samples += 1
+                return None, True
 
         self.other_samples += 1
+        self.other_counts[_other_category(sample)] += 1
+        return None, False
+
+    def _thread_counts(self, pid: Optional[int], thread_id: int) -> SampleCounts:
+        """
+        Return a thread's sample counts, creating them if it's new.
+        """
+        key = (pid or 0, thread_id)
+        counts = self.per_thread.get(key)
+        if counts is None:
+            counts = self.per_thread[key] = SampleCounts(
+                call_tree=StackTree() if self.thread_call_trees else None
+            )
+        return counts
+
+    def add_all_threads(self, sample: Sample) -> None:
+        """
+        Add the stacks of all threads from one interruption of the process.
+        """
+        self.interruptions += 1
+        self.total_stop_time += sample.stop_time
+        self.max_stop_time = max(self.max_stop_time, sample.stop_time)
+        if self.first_timestamp is None:
+            self.first_timestamp = sample.timestamp
+        self.last_timestamp = sample.timestamp
+        for instruction in sample.disassembly:
+            self.instructions[instruction.address] = instruction
+        for thread_id in sample.off_cpu:
+            self.off_cpu_samples += 1
+            pid = sample.pids.get(thread_id)
+            self._thread_counts(pid, thread_id).off_cpu_samples += 1
+            if pid is not None:
+                self.per_process.setdefault(pid, SampleCounts()).off_cpu_samples += 1
+        if not sample.threads and sample.off_cpu:
+            # Nothing was running, so the process wasn't interrupted, and
+            # there are no samples for the time window:
+            return
+        bucket = self._bucket(sample.timestamp)
+        if not sample.threads:
+            self.add_sample(None)
+            if bucket is not None:
+                bucket.add(None)
+            return
+        for thread_id, stack in sample.threads.items():
+            self.add_sample(stack, thread_id, sample.pids.get(thread_id))
+            if bucket is not None:
+                bucket.add(stack)
+
+    def _bucket(self, timestamp: float) -> Optional[TimeBucket]:
+        """
+        Return the time window a timestamp falls in, creating it if it's new.
+        """
+        if not self.bucket_width:
+            return None
+        index = int(timestamp // self.bucket_width)
+        if not self.buckets or self.buckets[-1].index < index:
+            # Appending evicts the oldest window if we're at capacity:
+            self.buckets.append(TimeBucket(index))
+            return self.buckets[-1]
+        # Timestamps should only go forwards, but just in case:
+        for bucket in reversed(self.buckets):
+            if bucket.index == index:
+                return bucket
+        # The window was already evicted, or skipped:
+        return None
+
+    def merge(self, other: "Stats", concurrent: bool = False) -> None:
+        """
+        Add all of another ``Stats``' samples to this one.
+
+        If ``concurrent``, the other samples are from a different process that
+        was sampled at the same time, rather than e.g. a different period.
+        """
+        # Map the other's file ids to ours:
+        file_ids = [self._file_id(filename) for filename in other.files]
+        for file_id, counts in zip(file_ids, other.line_counts):
+            _add_counts(self.line_counts[file_id], counts)
+        self.numba_sample_count += other.numba_sample_count
+        self.bad_samples += other.bad_samples
+        self.other_samples += other.other_samples
+        self.other_counts.update(other.other_counts)
+        self.idle_samples += other.idle_samples
+        self.off_cpu_samples += other.off_cpu_samples
+        self.thread_call_trees = self.thread_call_trees or other.thread_call_trees
+        for key, thread_counts in other.per_thread.items():
+            self.per_thread.setdefault(key, SampleCounts()).merge(
+                thread_counts, file_ids
+            )
+        for pid, process_counts in other.per_process.items():
+            self.per_process.setdefault(pid, SampleCounts()).merge(
+                process_counts, file_ids
+            )
+        self.interruptions += other.interruptions
+        self.total_stop_time += other.total_stop_time
+        self.max_stop_time = max(self.max_stop_time, other.max_stop_time)
+        timestamps = [
+            t
+            for t in (
+                self.first_timestamp,
+                self.last_timestamp,
+                other.first_timestamp,
+                other.last_timestamp,
+            )
+            if t is not None
+        ]
+        if timestamps:
+            self.first_timestamp = min(timestamps)
+            self.last_timestamp = max(timestamps)
+        self.interval = self.interval or other.interval
+        if concurrent:
+            self.sampled_processes += other.sampled_processes
+        else:
+            self.sampled_processes = max(
+                self.sampled_processes, other.sampled_processes
+            )
+        self.call_tree.merge(other.call_tree)
+        self.function_counts.update(other.function_counts)
+        self.instructions.update(other.instructions)
+        self.instruction_counts.update(other.instruction_counts)
+        self.bucket_width = self.bucket_width or other.bucket_width
+        if other.buckets:
+            buckets = {bucket.index: bucket for bucket in self.buckets}
+            for other_bucket in other.buckets:
+                bucket = buckets.setdefault(
+                    other_bucket.index, TimeBucket(other_bucket.index)
+                )
+                bucket.merge(other_bucket)
+            self.buckets = deque(
+                sorted(buckets.values(), key=lambda bucket: bucket.index),
+                maxlen=self.max_buckets,
+            )
 
     def finalize(self) -> FinalStats:
         """
@@ -82,17 +761,194 @@ class Stats:
         percent_bad_samples = to_percent(self.bad_samples)
         percent_other_samples = to_percent(self.other_samples)
         numba_samples = {}
-        for filename, counts in self.path_to_line_counts.items():
+        numba_sample_errors = {}
+        for filename, counts in zip(self.files, self.line_counts):
             filename_counts: dict[int, float] = {}
+            filename_errors: dict[int, float] = {}
             numba_samples[filename] = filename_counts
-            for line_number, count in counts.items():
-                filename_counts[line_number] = to_percent(count)
+            numba_sample_errors[filename] = filename_errors
+            for line_number, count in enumerate(counts):
+                if count:
+                    filename_counts[line_number] = to_percent(count)
+                    filename_errors[line_number] = round(
+                        percent_error(count, total_samples), 1
+                    )
+
+        percent_off_cpu = 0.0
+        if self.off_cpu_samples:
+            percent_off_cpu = round(
+                self.off_cpu_samples / (self.off_cpu_samples + total_samples) * 100, 1
+            )
+
+        mean_stop_ms = 0.0
+        if self.interruptions:
+            mean_stop_ms = round(self.total_stop_time / self.interruptions * 1000, 3)
+
+        duration = 0.0
+        if self.first_timestamp is not None and self.last_timestamp is not None:
+            duration = self.last_timestamp - self.first_timestamp
+        achieved_rate = percent_overhead = 0.0
+        if duration > 0:
+            processes = self.sampled_processes
+            achieved_rate = round(
+                max(self.interruptions - processes, 0) / duration / processes, 1
+            )
+            percent_overhead = round(
+                self.total_stop_time / duration / processes * 100, 1
+            )
+
+        inclusive_numba_samples: dict[str, dict[int, float]] = {}
+        for (filename, line_number), count in self.call_tree.inclusive_counts(
+            _numba_line
+        ).items():
+            inclusive_numba_samples.setdefault(filename, {})[line_number] = to_percent(
+                count
+            )
+        # Self time per (function name, specialization):
+        specialization_counts: Counter[tuple[str, str]] = Counter()
+        for func, count in self.function_counts.items():
+            specialization_counts[split_signature(func)] += count
+        function_counts: Counter[str] = Counter()
+        for (name, _), count in specialization_counts.items():
+            function_counts[name] += count
+
+        numba_functions = {
+            name: {
+                "self": to_percent(function_counts[name]),
+                "inclusive": to_percent(count),
+            }
+            for (name, count) in self.call_tree.inclusive_counts(
+                _numba_function
+            ).most_common()
+        }
+        numba_specializations: dict[str, dict[str, dict[str, float]]] = {
+            name: {} for name in numba_functions
+        }
+        for (name, signature), count in self.call_tree.inclusive_counts(
+            _numba_specialization
+        ).most_common():
+            numba_specializations[name][signature] = {
+                "self": to_percent(specialization_counts[(name, signature)]),
+                "inclusive": to_percent(count),
+            }
+
+        timeline = []
+        for bucket in self.buckets:
+            start = bucket.index * self.bucket_width
+            end = start + self.bucket_width
+            if self.first_timestamp is not None:
+                start = max(start - self.first_timestamp, 0.0)
+                end -= self.first_timestamp
+            window_samples = bucket.total_samples
+            timeline.append(
+                {
+                    "start": round(start, 3),
+                    "end": round(end, 3),
+                    "total_samples": window_samples,
+                    "percent_numba_samples": round(
+                        sum(bucket.line_counts.values()) / window_samples * 100, 1
+                    ),
+                    "top_lines": [
+                        [filename, line_number, round(count / window_samples * 100, 1)]
+                        for ((filename, line_number), count) in (
+                            bucket.line_counts.most_common(TIMELINE_TOP_LINES)
+                        )
+                    ],
+                }
+            )
+
+        # Group instructions by source line:
+        line_instructions: dict[tuple[str, int], list[Instruction]] = {}
+        for address in sorted(self.instructions):
+            instruction = self.instructions[address]
+            line_instructions.setdefault(
+                (instruction.file, instruction.line), []
+            ).append(instruction)
+        hot_lines = sorted(
+            (
+                (
+                    numba_samples.get(filename, {}).get(line_number, 0.0),
+                    filename,
+                    line_number,
+                )
+                for (filename, line_number) in line_instructions
+            ),
+            reverse=True,
+        )[:DISASSEMBLED_HOT_LINES]
+        hot_instructions = [
+            {
+                "file": filename,
+                "line": line_number,
+                "percent": percent,
+                "instructions": [
+                    [
+                        instruction.address,
+                        instruction.text,
+                        to_percent(self.instruction_counts[instruction.address]),
+                    ]
+                    for instruction in line_instructions[(filename, line_number)]
+                ],
+            }
+            for (percent, filename, line_number) in hot_lines
+            if percent
+        ]
 
         final_stats = FinalStats(
             total_samples=total_samples,
             percent_bad_samples=percent_bad_samples,
             percent_other_samples=percent_other_samples,
             numba_samples=numba_samples,
+            percent_idle_samples=to_percent(self.idle_samples),
+            percent_off_cpu=percent_off_cpu,
+            other_breakdown={
+                category: to_percent(count)
+                for (category, count) in self.other_counts.most_common()
+            },
+            numba_sample_errors=numba_sample_errors,
+            per_thread={
+                key: counts.finalize(self.files)
+                for key, counts in sorted(self.per_thread.items())
+            },
+            per_process={
+                pid: counts.finalize(self.files)
+                for pid, counts in sorted(self.per_process.items())
+            },
+            mean_stop_ms=mean_stop_ms,
+            max_stop_ms=round(self.max_stop_time * 1000, 3),
+            duration=round(duration, 3),
+            requested_rate=round(1 / self.interval, 1) if self.interval else 0.0,
+            achieved_rate=achieved_rate,
+            percent_overhead=percent_overhead,
+            inclusive_numba_samples=inclusive_numba_samples,
+            numba_functions=numba_functions,
+            numba_specializations=numba_specializations,
+            timeline=timeline,
+            hot_instructions=hot_instructions,
         )
         assert -5.0 < final_stats.total_percent() - 100 < 5.0
         return final_stats
+
+
+def top_lines_error(
+    all_stats: Iterable[Stats], top_lines: int = PRECISION_TOP_LINES
+) -> Optional[float]:
+    """
+    The largest margin of error, in percentage points, of the ``top_lines``
+    lines with the most samples, combining the samples of all the given
+    ``Stats``.
+
+    Returns ``None`` if there are no Numba samples yet.
+    """
+    total = 0
+    line_counts: Counter[tuple[str, int]] = Counter()
+    for stats in all_stats:
+        total += stats.total_samples()
+        for filename, counts in zip(stats.files, stats.line_counts):
+            for line_number, count in enumerate(counts):
+                if count:
+                    line_counts[(filename, line_number)] += count
+    if not line_counts:
+        return None
+    return max(
+        percent_error(count, total) for (_, count) in line_counts.most_common(top_lines)
+    )
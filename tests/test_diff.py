@@ -0,0 +1,60 @@
+"""
+Tests for ``profila._diff``.
+"""
+
+from profila._stats import FinalStats
+from profila._diff import diff_stats, render_diff
+
+
+def _stats(total_samples: int, line_12: float, line_15: float) -> FinalStats:
+    return FinalStats(
+        total_samples=total_samples,
+        percent_bad_samples=0.0,
+        percent_other_samples=100.0 - line_12 - line_15,
+        numba_samples={"simple.py": {12: line_12, 15: line_15}},
+        numba_functions={
+            "simple": {"self": line_12 + line_15, "inclusive": line_12 + line_15}
+        },
+    )
+
+
+def test_significant_change() -> None:
+    """
+    With enough samples, a line whose share of the samples changed is flagged,
+    biggest change first, and an unchanged function isn't.
+    """
+    base = _stats(10_000, 60.0, 20.0)
+    candidate = _stats(10_000, 40.0, 40.0)
+    changes = diff_stats(base, candidate)
+    assert [(c.kind, c.line, c.significant) for c in changes] == [
+        ("line", 12, True),
+        ("line", 15, True),
+        ("function", None, False),
+    ]
+    assert changes[0].z_score < 0 < changes[1].z_score
+    text = render_diff(base, candidate, changes)
+    assert "| simple.py:12 | 60.0% | 40.0% | -20.0% |" in text
+    assert "`simple`" not in text
+
+
+def test_noise() -> None:
+    """
+    The same change with few samples could be noise, so isn't flagged.
+    """
+    changes = diff_stats(_stats(20, 60.0, 20.0), _stats(20, 50.0, 30.0))
+    assert not any(c.significant for c in changes)
+    assert "No significant changes." in render_diff(
+        _stats(20, 60.0, 20.0), _stats(20, 50.0, 30.0), changes
+    )
+
+
+def test_min_change() -> None:
+    """
+    Tiny changes aren't flagged, even when there are so many samples that
+    they're statistically significant.
+    """
+    changes = diff_stats(
+        _stats(10_000_000, 60.0, 20.0), _stats(10_000_000, 59.5, 20.5), min_change=1.0
+    )
+    assert all(abs(c.z_score) > 3 for c in changes if c.kind == "line")
+    assert not any(c.significant for c in changes)
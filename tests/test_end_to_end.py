@@ -1,13 +1,23 @@
 import asyncio
+import json
 import os
 from subprocess import Popen, PIPE, check_output, check_call
 import sys
-from typing import Any
+from typing import Any, Optional, cast
 
 import pytest
 
 from profila._stats import FinalStats
-from profila._gdb import run_subprocess
+from profila._gdb import (
+    _read_until_done,
+    exit_subprocess,
+    read_samples,
+    run_subprocess,
+    SamplerOptions,
+    SAMPLER_MODES,
+    EMBEDDED,
+    ADAPTIVE,
+)
 from profila.__main__ import get_stats
 
 
@@ -40,7 +50,13 @@ def test_stdout_and_stderr_passthrough(profila_setup: Any) -> None:
     assert b"out2@@\nYY" in p.stdout.read()
 
 
-def test_profiling(profila_setup: Any) -> None:
+@pytest.mark.parametrize(
+    "options",
+    [SamplerOptions(mode=mode) for mode in SAMPLER_MODES]
+    + [SamplerOptions(mode=mode, unwind=ADAPTIVE) for mode in SAMPLER_MODES]
+    + [SamplerOptions(mode=EMBEDDED, defer_symbols=True)],
+)
+def test_profiling(profila_setup: Any, options: SamplerOptions) -> None:
     """
     Plausible costs are assigned to relevant lines of code.
     """
@@ -48,7 +64,7 @@ def test_profiling(profila_setup: Any) -> None:
 
     async def main() -> FinalStats:
         process = await run_subprocess([simple_py])
-        return (await get_stats(process)).finalize()
+        return (await get_stats(process, options)).finalize()
 
     final_stats = asyncio.run(main())
     simple_py = os.path.abspath(simple_py)
@@ -63,6 +79,7 @@ def test_profiling(profila_setup: Any) -> None:
     cheap = simple_stats[15]
     assert expensive > cheap * 2
     assert cheap > 0
+    assert 0 < final_stats.mean_stop_ms <= final_stats.max_stop_ms
 
 
 def test_jupyter(profila_setup: Any) -> None:
@@ -76,3 +93,257 @@ def test_jupyter(profila_setup: Any) -> None:
     assert "% non-Numba samples" in output
     assert "% |         for j in range(max(i - 6, 0), i + 1):" in output
     assert "% |             total += timeseries[j]" in output
+
+
+def test_jupyter_session(profila_setup: Any) -> None:
+    """
+    A Jupyter kernel stays attached between ``%%profila`` cells, until
+    ``%profila_stop``.
+    """
+    output = check_output(
+        "jupyter-nbconvert scripts_for_tests/session.ipynb --execute --to markdown --stdout".split(),
+        encoding="utf-8",
+    )
+    assert output.count("**Elapsed:**") == 2
+    assert output.count("% |             total += timeseries[j]") == 2
+
+
+def test_profile_api(profila_setup: Any) -> None:
+    """
+    ``profila.profile()`` profiles a block of code, and
+    ``profila.profile_until()`` repeats a callable until there are enough
+    samples.
+    """
+    output = check_output(
+        [sys.executable, "scripts_for_tests/profile_api.py"],
+        encoding="utf-8",
+        env={**os.environ, "NUMBA_DEBUGINFO": "1"},
+    )
+    result = json.loads(output.splitlines()[-1])
+    # The expensive line:
+    assert result["block"]["16"] > 50
+    assert result["repeated"]["16"] > 50
+    assert result["repeated_total"] >= 200
+
+
+def test_profiling_threads(profila_setup: Any) -> None:
+    """
+    All threads running parallel Numba code are profiled.
+    """
+    parallel_py = "scripts_for_tests/parallel.py"
+
+    async def main() -> FinalStats:
+        process = await run_subprocess([parallel_py])
+        return (await get_stats(process)).finalize()
+
+    final_stats = asyncio.run(main())
+    parallel_py = os.path.abspath(parallel_py)
+
+    assert len(final_stats.per_thread) > 1
+    # Comments should have zero cost:
+    assert final_stats.numba_samples[parallel_py].get(11, 0) == 0
+    # The expensive line runs in more than one thread:
+    threads_running_line = [
+        thread_stats
+        for thread_stats in final_stats.per_thread.values()
+        if thread_stats.numba_samples.get(parallel_py, {}).get(12, 0) > 0
+    ]
+    assert len(threads_running_line) > 1
+
+
+def test_attach(profila_setup: Any) -> None:
+    """
+    ``profila attach`` profiles a running process, emitting snapshots, and
+    leaves it running once it's done.
+    """
+    service_py = "scripts_for_tests/service.py"
+    service = Popen(
+        [sys.executable, service_py],
+        stdout=PIPE,
+        env={**os.environ, "NUMBA_DEBUGINFO": "1"},
+    )
+    try:
+        assert service.stdout is not None
+        assert service.stdout.readline() == b"ready\n"
+        output = check_output(
+            [
+                sys.executable,
+                "-m",
+                "profila",
+                "attach",
+                "--duration",
+                "3",
+                "--snapshot-every",
+                "1",
+                "--format",
+                "json",
+                str(service.pid),
+            ],
+            encoding="utf-8",
+        )
+        messages = [json.loads(line) for line in output.splitlines()]
+        assert [m["message"] for m in messages[-2:]] == ["snapshot", "stats"]
+        assert all(m["message"] == "snapshot" for m in messages[:-1])
+        final_stats = messages[-1]["stats"]
+        assert final_stats["format"] == "profila"
+        [line] = [
+            line
+            for line in final_stats["lines"]
+            if line["file"] == os.path.abspath(service_py) and line["line"] == 19
+        ]
+        assert line["self"] > 5
+        # The service is still running:
+        assert service.poll() is None
+    finally:
+        service.kill()
+        service.wait()
+
+
+@pytest.mark.parametrize("mode", SAMPLER_MODES)
+def test_instructions(profila_setup: Any, mode: str) -> None:
+    """
+    With instructions recorded, the hottest line's disassembly is shown.
+    """
+    simple_py = "scripts_for_tests/simple.py"
+
+    async def main() -> FinalStats:
+        process = await run_subprocess([simple_py])
+        options = SamplerOptions(mode=mode, instructions=True)
+        return (await get_stats(process, options)).finalize()
+
+    final_stats = asyncio.run(main())
+    hottest = final_stats.hot_instructions[0]
+    assert hottest["file"] == os.path.abspath(simple_py)
+    assert hottest["line"] == 12
+    assert sum(percent for (_, _, percent) in hottest["instructions"]) > 5
+
+
+def test_specializations(profila_setup: Any) -> None:
+    """
+    Time is broken down by compiled specialization.
+    """
+
+    async def main() -> FinalStats:
+        process = await run_subprocess(["scripts_for_tests/specializations.py"])
+        return (await get_stats(process)).finalize()
+
+    final_stats = asyncio.run(main())
+    [simple] = [name for name in final_stats.numba_functions if name.endswith("simple")]
+    specializations = final_stats.numba_specializations[simple]
+    [float64] = [s for s in specializations if "double" in s]
+    [float32] = [s for s in specializations if "float" in s]
+    assert specializations[float64]["self"] > specializations[float32]["self"]
+
+
+@pytest.mark.parametrize("mode", SAMPLER_MODES)
+def test_follow_children(profila_setup: Any, mode: str) -> None:
+    """
+    With ``follow_children``, Numba code running in worker processes is
+    profiled, with a per-process breakdown.
+    """
+    pool_py = "scripts_for_tests/pool.py"
+
+    async def main() -> FinalStats:
+        process = await run_subprocess([pool_py], follow_children=True)
+        return (await get_stats(process, SamplerOptions(mode=mode))).finalize()
+
+    final_stats = asyncio.run(main())
+    assert final_stats.numba_samples[os.path.abspath(pool_py)][12] > 5
+    assert len(final_stats.per_process) >= 3
+    workers = [
+        stats for stats in final_stats.per_process.values() if stats.numba_samples
+    ]
+    assert len(workers) == 2
+
+
+@pytest.mark.parametrize(
+    "options",
+    [SamplerOptions(mode=mode) for mode in SAMPLER_MODES]
+    + [SamplerOptions(mode=EMBEDDED, unwind=ADAPTIVE, defer_symbols=True)],
+)
+def test_inlined_functions(profila_setup: Any, options: SamplerOptions) -> None:
+    """
+    Time in an inlined Numba function is attributed to its own lines, and to
+    its call site as inclusive time.
+    """
+    inlined_py = "scripts_for_tests/inlined.py"
+
+    async def main() -> FinalStats:
+        process = await run_subprocess([inlined_py])
+        return (await get_stats(process, options)).finalize()
+
+    final_stats = asyncio.run(main())
+    inlined_py = os.path.abspath(inlined_py)
+    assert final_stats.numba_samples[inlined_py][10] > 5
+    assert final_stats.inclusive_numba_samples[inlined_py][17] > 5
+
+
+@pytest.mark.parametrize("mode", SAMPLER_MODES)
+def test_fast_start(profila_setup: Any, mode: str) -> None:
+    """
+    With ``load_symbols``, Numba code compiled before sampling started is
+    still found, while symbols for libraries profila doesn't need, e.g.
+    NumPy's, are never loaded.
+    """
+    simple_py = os.path.abspath("scripts_for_tests/simple.py")
+
+    async def symbols_at_first_sample(
+        load_symbols: Optional[list[str]],
+    ) -> dict[str, bool]:
+        """
+        Map library filename to whether gdb loaded its symbols, once the first
+        sample in Numba code arrived.
+        """
+        process = await run_subprocess([simple_py], load_symbols=load_symbols)
+        assert process.stdin is not None
+        samples = read_samples(process, SamplerOptions(mode=mode))
+        try:
+            async for sample in samples:
+                if any(
+                    stack and any(frame.file == simple_py for frame in stack)
+                    for stack in sample.threads.values()
+                ):
+                    break
+            else:
+                raise AssertionError("No samples in Numba code.")
+        finally:
+            await samples.aclose()
+        process.stdin.write(b"-file-list-shared-libraries\n")
+        result = await _read_until_done(process)
+        await exit_subprocess(process)
+        libraries = cast(dict[str, Any], result["payload"])["shared-libraries"]
+        return {
+            os.path.basename(library["target-name"]): library["symbols-loaded"] == "1"
+            for library in libraries
+        }
+
+    def numpy_symbols(symbols: dict[str, bool]) -> list[bool]:
+        return [
+            loaded
+            for (library, loaded) in symbols.items()
+            if library.startswith("_multiarray_umath")
+        ]
+
+    fast = asyncio.run(symbols_at_first_sample([]))
+    assert any(loaded for (library, loaded) in fast.items() if "llvmlite" in library)
+    assert numpy_symbols(fast) == [False]
+    full = asyncio.run(symbols_at_first_sample(None))
+    assert numpy_symbols(full) == [True]
+
+
+@pytest.mark.parametrize("mode", SAMPLER_MODES)
+def test_on_cpu(profila_setup: Any, mode: str) -> None:
+    """
+    With ``on_cpu``, time the program spends sleeping is counted as off-CPU,
+    rather than as samples.
+    """
+    sleepy_py = "scripts_for_tests/sleepy.py"
+
+    async def main() -> FinalStats:
+        process = await run_subprocess([sleepy_py])
+        options = SamplerOptions(mode=mode, on_cpu=True)
+        return (await get_stats(process, options)).finalize()
+
+    final_stats = asyncio.run(main())
+    assert 20 < final_stats.percent_off_cpu < 80
+    assert final_stats.numba_samples[os.path.abspath(sleepy_py)][14] > 40
@@ -0,0 +1,351 @@
+"""
+Tests for ``profila._gdb``.
+"""
+
+import asyncio
+import os
+from pathlib import Path
+from subprocess import PIPE, Popen
+import sys
+import threading
+from time import sleep
+from uuid import uuid4
+
+from pygdbmi.gdbmiparser import parse_response
+import pytest
+
+from profila import _gdb, __main__ as profila_main
+from profila._gdb import (
+    ADAPTIVE,
+    AttachError,
+    Frame,
+    Instruction,
+    SamplerOptions,
+    _Inferiors,
+    _Schedule,
+    _extend_stack,
+    _first_high,
+    _library_addresses,
+    _parse_thread_info,
+    _thread_states,
+    _next_chunk,
+    _parse_disassembly,
+    attach_subprocess,
+    exit_subprocess,
+    find_pids,
+)
+
+
+class FakeClock:
+    """A replacement for ``time.time()``."""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_schedule_corrects_drift(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    The time taken by each sample is subtracted from the following delay, so
+    samples stay on a fixed grid.
+    """
+    clock = FakeClock()
+    monkeypatch.setattr(_gdb, "time", clock)
+    schedule = _Schedule(0.010, 0.0)
+
+    clock.now += 0.003
+    assert schedule.delay() == pytest.approx(0.007)
+    clock.now += 0.007 + 0.004
+    assert schedule.delay() == pytest.approx(0.006)
+
+
+def test_schedule_falls_behind(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    If a sample took longer than the interval, the next one is taken
+    immediately, and the grid restarts from there rather than bursting to catch
+    up.
+    """
+    clock = FakeClock()
+    monkeypatch.setattr(_gdb, "time", clock)
+    schedule = _Schedule(0.010, 0.0)
+
+    clock.now += 0.035
+    assert schedule.delay() == 0
+    clock.now += 0.002
+    assert schedule.delay() == pytest.approx(0.008)
+
+
+def test_schedule_jitter(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Jitter moves each sample randomly by up to the given fraction of the
+    interval.
+    """
+    clock = FakeClock()
+    monkeypatch.setattr(_gdb, "time", clock)
+    schedule = _Schedule(0.010, 0.5)
+
+    delays = set()
+    for _ in range(100):
+        delay = schedule.delay()
+        assert 0.005 - 1e-9 <= delay <= 0.015 + 1e-9
+        delays.add(delay)
+        # Jump to the grid point, so the next delay is measured from it:
+        clock.now = schedule.next_tick
+    assert len(delays) > 1
+
+
+NATIVE = Frame(file="", line=0, func="PyEval", library="/lib/libpython3.so")
+NUMBA = Frame(file="/a.py", line=3, func="kernel")
+IDLE = Frame(file="", line=0, func="wait", library="/lib/workqueue.so")
+
+
+def test_adaptive_unwinding() -> None:
+    """
+    Adaptive unwinding asks for more frames until it reaches a frame the sample
+    is attributed to, the end of the stack, or the maximum depth.
+    """
+    options = SamplerOptions(unwind=ADAPTIVE, depth=10)
+    # The first chunk of 4 frames has no attributable frame, so read on:
+    assert _next_chunk([NATIVE] * 4, 4, options) == 4
+    # Numba code or the threadpool were found:
+    assert _next_chunk([NATIVE, NATIVE, NUMBA], 4, options) is None
+    assert _next_chunk([NATIVE] * 4 + [IDLE], 8, options) is None
+    # A Numba frame at the end of a chunk may have inlined call sites after
+    # it, which also need reading:
+    assert _next_chunk([NATIVE, NATIVE, NATIVE, NUMBA], 4, options) == 4
+    assert _next_chunk([NATIVE] * 4 + [NUMBA, NUMBA, NUMBA, NATIVE], 8, options) is None
+    # If the inlined call sites end exactly at the end of a chunk, stop at the
+    # next frame that isn't Numba code:
+    assert _next_chunk([NUMBA] * 4 + [NATIVE] * 4, 8, options) is None
+    # Fewer frames than requested means the stack has ended:
+    assert _next_chunk([NATIVE] * 3, 4, options) is None
+    assert _next_chunk([NATIVE] * 4, 8, options) is None
+    # Maximum depth reached:
+    assert _next_chunk([NATIVE] * 10, 10, options) is None
+    # Couldn't read the stack:
+    assert _next_chunk(None, 4, options) is None
+
+
+def test_first_high() -> None:
+    """
+    gdb's frame ranges are inclusive, so the first request for a stack never
+    reads more than ``depth`` frames.
+    """
+    full = SamplerOptions(depth=10)
+    assert len(range(0, _first_high(full) + 1)) == 10
+    adaptive = SamplerOptions(unwind=ADAPTIVE, depth=10)
+    assert len(range(0, _first_high(adaptive) + 1)) == 4
+    shallow = SamplerOptions(unwind=ADAPTIVE, depth=2)
+    assert len(range(0, _first_high(shallow) + 1)) == 2
+
+
+def test_extend_stack() -> None:
+    """
+    Later chunks are added to the stack so far; an error reading a later chunk
+    means the end of the stack was reached.
+    """
+    reply: dict[str, object] = {
+        "type": "result",
+        "payload": {"stack": [{"level": "4", "fullname": "/a.py", "line": "3"}]},
+    }
+    error: dict[str, object] = {
+        "type": "result",
+        "payload": {"msg": "Not enough frames in stack."},
+    }
+    assert _extend_stack(None, reply) == [Frame(file="/a.py", line=3)]
+    assert _extend_stack([NATIVE], reply) == [NATIVE, Frame(file="/a.py", line=3)]
+    assert _extend_stack([NATIVE], error) == [NATIVE]
+    assert _extend_stack(None, error) is None
+
+
+def test_parse_disassembly() -> None:
+    """
+    ``-data-disassemble`` results with source lines are converted to
+    ``Instruction`` objects.
+    """
+    message = parse_response(
+        '^done,asm_insns=[src_and_asm_line={line="12",file="a.py",'
+        'fullname="/src/a.py",line_asm_insn=[{address="0x10",func-name="f",'
+        'offset="0",inst="vmulpd %ymm1,%ymm0,%ymm0"},{address="0x14",'
+        'func-name="f",offset="4",inst="ret"}]}]'
+    )
+    assert _parse_disassembly(message) == [
+        Instruction(0x10, "/src/a.py", 12, "f", "vmulpd %ymm1,%ymm0,%ymm0"),
+        Instruction(0x14, "/src/a.py", 12, "f", "ret"),
+    ]
+    error = parse_response('^error,msg="No function contains specified address."')
+    assert _parse_disassembly(error) == []
+
+
+def test_find_pids() -> None:
+    """
+    ``find_pids()`` finds processes by command line, excluding the current
+    process.
+    """
+    marker = f"profila-test-{uuid4().hex}"
+    code = "import time; print('ready', flush=True); time.sleep(30)"
+    processes = [
+        Popen([sys.executable, "-c", code, marker], stdout=PIPE) for _ in range(2)
+    ]
+    try:
+        # Make sure they're running the new command line:
+        for process in processes:
+            assert process.stdout is not None
+            process.stdout.readline()
+        assert find_pids(marker) == sorted(p.pid for p in processes)
+        assert find_pids(marker[-8:] + "$") == sorted(p.pid for p in processes)
+        assert find_pids(f"profila-test-{uuid4().hex}") == []
+    finally:
+        for process in processes:
+            process.kill()
+            process.wait()
+
+
+def test_fast_start_pending_symbols() -> None:
+    """
+    With fast start, loading a library we need symbols for marks symbols as
+    pending; other libraries don't.
+    """
+    inferiors = _Inferiors()
+    inferiors.update("library-loaded", {"target-name": "/lib/libc.so.6"})
+    assert not inferiors.symbols_pending
+
+    inferiors.symbol_libraries = ("libc\\.so", "workqueue")
+    inferiors.update("library-loaded", {"target-name": "/lib/libm.so.6"})
+    assert not inferiors.symbols_pending
+    inferiors.update("library-loaded", {"target-name": "/x/numba/workqueue.so"})
+    assert inferiors.symbols_pending
+
+
+def test_library_addresses() -> None:
+    """
+    ``_library_addresses()`` finds where a process loaded matching libraries.
+    """
+    [(path, address)] = _library_addresses(os.getpid(), "libc\\.so").items()
+    assert "libc" in os.path.basename(path)
+    with open("/proc/self/maps") as f:
+        starts = [
+            int(line.split("-")[0], 16) for line in f if line.rstrip().endswith(path)
+        ]
+    assert address in starts
+    assert _library_addresses(os.getpid(), "no-such-library") == {}
+
+
+def test_parse_thread_info() -> None:
+    """
+    ``_parse_thread_info()`` maps gdb thread ids to kernel thread ids.
+    """
+    message = parse_response(
+        '^done,threads=[{id="2",target-id="Thread 0x7f00 (LWP 1235)",'
+        'state="stopped"},{id="1",target-id="process 1234",state="stopped"},'
+        '{id="3",target-id="Remote target",state="stopped"}],'
+        'current-thread-id="1"'
+    )
+    assert _parse_thread_info(message) == {2: 1235, 1: 1234, 3: None}
+    assert _parse_thread_info(parse_response('^error,msg="No registers."')) == {}
+
+
+def test_thread_states() -> None:
+    """
+    ``_thread_states()`` reads each thread's scheduler state from ``/proc``.
+    """
+    states = _thread_states([os.getpid()])
+    # This thread is running right now:
+    assert states[threading.get_native_id()] == "R"
+
+    process = Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        for _ in range(100):
+            if _thread_states([process.pid]) == {process.pid: "S"}:
+                break
+            sleep(0.05)
+        assert _thread_states([process.pid]) == {process.pid: "S"}
+    finally:
+        process.kill()
+        process.wait()
+    assert _thread_states([process.pid]) == {}
+
+
+# Just enough of gdb's MI to attach, where attaching fails for processes that
+# don't exist:
+FAKE_GDB = """\
+import os, sys
+for line in sys.stdin:
+    command = line.split()
+    if command[0] == "-gdb-exit":
+        print("^exit", flush=True)
+        break
+    if command[0] == "-target-attach" and not os.path.exists(f"/proc/{command[-1]}"):
+        print('^error,msg="ptrace: No such process."')
+    elif command[0] == "-add-inferior":
+        print('^done,inferior="i2"')
+    else:
+        print("^done")
+    print("(gdb)", flush=True)
+"""
+
+# Larger than the largest possible pid on Linux:
+MISSING_PID = 2**22 + 1
+
+
+@pytest.fixture
+def fake_gdb(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Make ``_gdb`` run ``FAKE_GDB`` instead of gdb.
+    """
+    script = tmp_path / "fake_gdb.py"
+    script.write_text(FAKE_GDB)
+    gdb = tmp_path / "gdb"
+    gdb.write_text(f"#!/bin/sh\nexec {sys.executable} {script}\n")
+    gdb.chmod(0o755)
+    monkeypatch.setattr(_gdb, "GDB_PATH", str(gdb))
+
+
+@pytest.mark.usefixtures("fake_gdb")
+def test_attach_missing_process() -> None:
+    """
+    Failing to attach to a process raises ``AttachError`` with gdb's error
+    message.
+    """
+    with pytest.raises(AttachError) as exc_info:
+        asyncio.run(attach_subprocess(str(MISSING_PID)))
+    assert str(exc_info.value) == (
+        f"Couldn't attach to process {MISSING_PID}: ptrace: No such process."
+    )
+
+
+@pytest.mark.usefixtures("fake_gdb")
+def test_attach_command_missing_process(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    ``profila attach`` turns ``AttachError`` into an error exit.
+    """
+    monkeypatch.setattr(profila_main, "GDB_PATH", _gdb.GDB_PATH)
+    monkeypatch.setattr(sys, "argv", ["profila", "attach", str(MISSING_PID)])
+    with pytest.raises(SystemExit) as exc_info:
+        profila_main.main()
+    assert str(exc_info.value) == (
+        f"Couldn't attach to process {MISSING_PID}: ptrace: No such process."
+    )
+
+
+@pytest.mark.usefixtures("fake_gdb")
+def test_attach_missing_child(
+    monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]
+) -> None:
+    """
+    A child process that exits before it can be attached to is skipped with a
+    warning.
+    """
+    monkeypatch.setattr(_gdb, "_child_pids", lambda pid: [MISSING_PID])
+
+    async def main() -> None:
+        process = await attach_subprocess(str(os.getpid()), follow_children=True)
+        await exit_subprocess(process)
+
+    asyncio.run(main())
+    assert (
+        f"Couldn't attach to child process {MISSING_PID}, skipping: "
+        "ptrace: No such process."
+    ) in capsys.readouterr().err
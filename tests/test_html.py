@@ -0,0 +1,47 @@
+"""
+Tests for ``profila._html``.
+"""
+
+from pathlib import Path
+
+from profila._stats import FinalStats
+from profila._html import REGION_CONTEXT, _hot_regions, render_html
+
+
+def _stats(path: Path) -> FinalStats:
+    return FinalStats(
+        total_samples=100,
+        percent_bad_samples=0.0,
+        percent_other_samples=10.0,
+        numba_samples={str(path): {10: 20.0, 12: 10.0, 100: 60.0}},
+    )
+
+
+def test_hot_regions(tmp_path: Path) -> None:
+    """
+    Only lines with samples, plus some context, are included, grouping nearby
+    lines and stopping at the end of the file; the hottest region is first.
+    """
+    path = tmp_path / "code.py"
+    path.write_text("".join(f"line {i}\n" for i in range(1, 102)))
+    regions = _hot_regions(_stats(path))
+    assert [(r["start"], r["end"], r["percent"]) for r in regions] == [
+        (100 - REGION_CONTEXT, 101, 60.0),
+        (10 - REGION_CONTEXT, 12 + REGION_CONTEXT, 30.0),
+    ]
+    assert regions[1]["lines"][REGION_CONTEXT] == [10, "line 10", 20.0, 0]
+
+
+def test_render_html(tmp_path: Path) -> None:
+    """
+    ``render_html()`` embeds the hot regions' source code, without letting it
+    end the script element.
+    """
+    path = tmp_path / "code.py"
+    path.write_text("".join(f"x = '</script>' # {i}\n" for i in range(1, 102)))
+    html = render_html(_stats(path))
+    assert html.count("<details data-region=") == 2
+    assert "x = '<\\/script>' # 100" in html
+    # Lines far from any samples aren't included:
+    assert '# 50"' not in html
+    assert html.count("</script>") == 2
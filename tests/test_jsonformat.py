@@ -0,0 +1,129 @@
+"""
+Tests for ``profila._jsonformat``.
+"""
+
+import json
+
+import pytest
+
+from profila._stats import FinalStats
+from profila._jsonformat import FORMAT_VERSION, from_json, to_json
+
+FINAL_STATS = FinalStats(
+    total_samples=1000,
+    percent_bad_samples=5.0,
+    percent_other_samples=10.0,
+    numba_samples={"simple.py": {12: 60.0, 15: 25.0}},
+    numba_sample_errors={"simple.py": {12: 3.0, 15: 2.7}},
+    percent_off_cpu=20.0,
+    per_thread={
+        (1234, 1): FinalStats(
+            total_samples=500,
+            percent_bad_samples=0.0,
+            percent_other_samples=0.0,
+            percent_off_cpu=40.0,
+            numba_samples={"simple.py": {12: 100.0}},
+            inclusive_numba_samples={"simple.py": {12: 100.0}},
+        )
+    },
+    per_process={
+        pid: FinalStats(
+            total_samples=500,
+            percent_bad_samples=0.0,
+            percent_other_samples=50.0,
+            numba_samples={"simple.py": {12: 50.0}},
+            inclusive_numba_samples={"simple.py": {12: 50.0}},
+        )
+        for pid in (1234, 1235)
+    },
+    mean_stop_ms=0.25,
+    max_stop_ms=1.5,
+    duration=10.0,
+    requested_rate=100.0,
+    achieved_rate=99.9,
+    percent_overhead=2.5,
+    # Line 3 calls other Numba code, so only has inclusive time:
+    inclusive_numba_samples={"simple.py": {3: 20.0, 12: 60.0, 15: 25.0}},
+    numba_functions={"simple": {"self": 85.0, "inclusive": 85.0}},
+    numba_specializations={
+        "simple": {
+            "(float64)": {"self": 60.0, "inclusive": 60.0},
+            "(int64)": {"self": 25.0, "inclusive": 25.0},
+        }
+    },
+    timeline=[
+        {
+            "start": 0.0,
+            "end": 1.0,
+            "total_samples": 100,
+            "percent_numba_samples": 80.0,
+            "top_lines": [["simple.py", 12, 50.0]],
+        }
+    ],
+    hot_instructions=[
+        {
+            "file": "simple.py",
+            "line": 12,
+            "percent": 60.0,
+            "instructions": [[4096, "vmulpd %ymm1,%ymm0,%ymm0", 30.0]],
+        }
+    ],
+)
+
+
+def test_round_trip() -> None:
+    """
+    ``from_json()`` recreates the ``FinalStats`` passed to ``to_json()``, even
+    after a trip through JSON.
+    """
+    data = json.loads(json.dumps(to_json(FINAL_STATS)))
+    assert from_json(data) == FINAL_STATS
+
+
+def test_format() -> None:
+    """
+    The JSON format has a version, and lines are values rather than keys.
+    """
+    data = to_json(FINAL_STATS)
+    assert data["format"] == "profila"
+    assert data["version"] == FORMAT_VERSION
+    assert data["percent_numba_samples"] == 85.0
+    assert data["lines"] == [
+        {
+            "file": "simple.py",
+            "line": 3,
+            "self": None,
+            "inclusive": 20.0,
+            "error": None,
+        },
+        {
+            "file": "simple.py",
+            "line": 12,
+            "self": 60.0,
+            "inclusive": 60.0,
+            "error": 3.0,
+        },
+        {
+            "file": "simple.py",
+            "line": 15,
+            "self": 25.0,
+            "inclusive": 25.0,
+            "error": 2.7,
+        },
+    ]
+    assert data["threads"][0]["thread_id"] == 1
+    assert data["threads"][0]["pid"] == 1234
+    assert data["threads"][0]["total_samples"] == 500
+    # Threads from profiles without process ids:
+    del data["threads"][0]["pid"]
+    assert from_json(data).per_thread.keys() == {(0, 1)}
+
+
+def test_unsupported() -> None:
+    """
+    ``from_json()`` rejects other JSON, and other versions.
+    """
+    with pytest.raises(ValueError):
+        from_json({"shared": {"frames": []}})
+    with pytest.raises(ValueError):
+        from_json({**to_json(FINAL_STATS), "version": FORMAT_VERSION + 1})
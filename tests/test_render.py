@@ -2,10 +2,14 @@
 Tests for ``profila._render``.
 """
 
+from dataclasses import replace
+import json
+
 from syrupy.assertion import SnapshotAssertion
 
-from profila._stats import FinalStats
-from profila._render import render_text
+from profila._gdb import Frame
+from profila._stats import FinalStats, Stats
+from profila._render import render_text, render_collapsed, render_speedscope
 
 
 def test_render_text(snapshot: SnapshotAssertion) -> None:
@@ -19,3 +23,345 @@ def test_render_text(snapshot: SnapshotAssertion) -> None:
         numba_samples={"scripts_for_tests/simple.py": {12: 35.0, 15: 40.0}},
     )
     assert render_text(final_stats) == snapshot
+
+
+def test_render_text_threads(snapshot: SnapshotAssertion) -> None:
+    """
+    ``render_text()`` shows a per-thread breakdown when there are multiple
+    threads.
+    """
+    final_stats = FinalStats(
+        total_samples=1000,
+        percent_bad_samples=0.0,
+        percent_other_samples=10.0,
+        numba_samples={"scripts_for_tests/simple.py": {12: 60.0}},
+        percent_idle_samples=30.0,
+        per_thread={
+            (0, 1): FinalStats(
+                total_samples=500,
+                percent_bad_samples=0.0,
+                percent_other_samples=20.0,
+                numba_samples={"scripts_for_tests/simple.py": {12: 50.0}},
+                percent_idle_samples=30.0,
+            ),
+            (0, 2): FinalStats(
+                total_samples=500,
+                percent_bad_samples=0.0,
+                percent_other_samples=0.0,
+                numba_samples={"scripts_for_tests/simple.py": {12: 70.0}},
+                percent_idle_samples=30.0,
+            ),
+        },
+    )
+    assert render_text(final_stats) == snapshot
+
+
+def test_render_processes() -> None:
+    """
+    ``render_text()`` shows a per-process breakdown when there are multiple
+    processes.
+    """
+    final_stats = FinalStats(
+        total_samples=20,
+        percent_bad_samples=0.0,
+        percent_other_samples=50.0,
+        numba_samples={"/src/a.py": {2: 50.0}},
+        per_process={
+            100: FinalStats(
+                total_samples=10,
+                percent_bad_samples=0.0,
+                percent_other_samples=100.0,
+                numba_samples={},
+            ),
+            101: FinalStats(
+                total_samples=10,
+                percent_bad_samples=0.0,
+                percent_other_samples=0.0,
+                numba_samples={"/src/a.py": {1: 40.0, 2: 60.0}},
+            ),
+        },
+    )
+    assert (
+        "| 100 | 10 | 0.0% | 100.0% | 0.0% | 0.0% |  |\n"
+        "| 101 | 10 | 100.0% | 0.0% | 0.0% | 0.0% | a.py:2 (60.0%) |\n"
+    ) in render_text(final_stats)
+
+    # Threads from different processes may share a thread id, so the thread
+    # table shows the process too:
+    thread_stats = FinalStats(
+        total_samples=10,
+        percent_bad_samples=0.0,
+        percent_other_samples=100.0,
+        numba_samples={},
+    )
+    text = render_text(
+        replace(
+            final_stats, per_thread={(100, 1): thread_stats, (101, 1): thread_stats}
+        )
+    )
+    assert "\n| Process | Thread | Samples |" in text
+    assert "| 100 | 1 | 10 | 0.0% | 100.0% | 0.0% | 0.0% |\n" in text
+    assert "| 101 | 1 | 10 | 0.0% | 100.0% | 0.0% | 0.0% |\n" in text
+
+
+def test_render_off_cpu() -> None:
+    """
+    ``render_text()`` shows the off-CPU percentage, overall and per thread,
+    only if there was on-CPU sampling.
+    """
+    thread_stats = FinalStats(
+        total_samples=10,
+        percent_bad_samples=0.0,
+        percent_other_samples=0.0,
+        numba_samples={"/src/a.py": {2: 100.0}},
+        percent_off_cpu=75.0,
+    )
+    final_stats = FinalStats(
+        total_samples=20,
+        percent_bad_samples=0.0,
+        percent_other_samples=0.0,
+        numba_samples={"/src/a.py": {2: 100.0}},
+        percent_off_cpu=60.0,
+        per_thread={
+            (0, 1): thread_stats,
+            (0, 2): replace(thread_stats, percent_off_cpu=0.0),
+        },
+    )
+    text = render_text(final_stats)
+    assert "**Off-CPU:** 60.0% of thread samples were waiting" in text
+    assert "| Bad | Off-CPU |\n" in text
+    assert "| 1 | 10 | 100.0% | 0.0% | 0.0% | 0.0% | 75.0% |\n" in text
+
+    text = render_text(replace(final_stats, percent_off_cpu=0.0))
+    assert "Off-CPU" not in text
+
+
+def test_render_margin_of_error() -> None:
+    """
+    ``render_text()`` shows each line's margin of error, when known.
+    """
+    final_stats = FinalStats(
+        total_samples=100,
+        percent_bad_samples=0.0,
+        percent_other_samples=0.0,
+        numba_samples={"scripts_for_tests/simple.py": {12: 60.0, 15: 40.0}},
+        numba_sample_errors={"scripts_for_tests/simple.py": {12: 9.4, 15: 9.4}},
+        inclusive_numba_samples={
+            "scripts_for_tests/simple.py": {10: 60.0, 12: 60.0, 15: 40.0}
+        },
+    )
+    output = render_text(final_stats)
+    assert "± is the margin of error at 95% confidence" in output
+    assert (
+        "  Self         Incl |\n"
+        "              60.0% |     for i in range(len(timeseries)):\n"
+    ) in output
+    assert " 60.0% ± 9.4  60.0% |         result[i] = " in output
+
+
+def test_render_other_breakdown() -> None:
+    """
+    ``render_text()`` shows where non-Numba samples were spent, summing up
+    anything past the top entries.
+    """
+    other_breakdown = {"numpy: DOUBLE_add": 30.0, "unknown": 5.0}
+    other_breakdown.update({f"libfoo.so: f{i}": 1.0 for i in range(10)})
+    final_stats = FinalStats(
+        total_samples=100,
+        percent_bad_samples=0.0,
+        percent_other_samples=45.0,
+        numba_samples={"/src/a.py": {1: 55.0}},
+        other_breakdown=other_breakdown,
+    )
+    output = render_text(final_stats)
+    assert (
+        "| Non-Numba code | Samples |\n"
+        "|:---|---:|\n"
+        "| numpy: `DOUBLE_add` | 30.0% |\n"
+        "| unknown | 5.0% |\n"
+        "| libfoo.so: `f0` | 1.0% |\n"
+    ) in output
+    assert "| libfoo.so: `f7` | 1.0% |\n| 2 others | 2.0% |\n" in output
+
+
+def test_render_stop_time() -> None:
+    """
+    ``render_text()`` reports how long the process was stopped per sample.
+    """
+    final_stats = FinalStats(
+        total_samples=10,
+        percent_bad_samples=0.0,
+        percent_other_samples=100.0,
+        numba_samples={},
+        mean_stop_ms=1.5,
+        max_stop_ms=4.0,
+    )
+    assert "**Process stopped per sample:** 1.5ms mean, 4.0ms max\n" in render_text(
+        final_stats
+    )
+
+
+def test_render_sampling_rate() -> None:
+    """
+    ``render_text()`` reports the achieved sampling rate and overhead.
+    """
+    final_stats = FinalStats(
+        total_samples=10,
+        percent_bad_samples=0.0,
+        percent_other_samples=100.0,
+        numba_samples={},
+        duration=0.2,
+        requested_rate=100.0,
+        achieved_rate=50.0,
+        percent_overhead=5.5,
+    )
+    assert (
+        "**Sampling:** 50.0 samples/second (100.0/second requested) over 0.2 "
+        "seconds, process stopped by the sampler 5.5% of the time\n"
+    ) in render_text(final_stats)
+
+
+def test_render_text_inclusive(snapshot: SnapshotAssertion) -> None:
+    """
+    ``render_text()`` shows Numba functions, and inclusive time for lines
+    that call other Numba code.
+    """
+    final_stats = FinalStats(
+        total_samples=100,
+        percent_bad_samples=0.0,
+        percent_other_samples=0.0,
+        numba_samples={"scripts_for_tests/simple.py": {12: 60.0, 15: 40.0}},
+        inclusive_numba_samples={
+            "scripts_for_tests/simple.py": {10: 60.0, 12: 60.0, 15: 40.0}
+        },
+        numba_functions={"simple": {"self": 100.0, "inclusive": 100.0}},
+    )
+    assert render_text(final_stats) == snapshot
+
+
+def test_render_timeline() -> None:
+    """
+    ``render_text()`` shows the hottest lines per time window.
+    """
+    final_stats = FinalStats(
+        total_samples=10,
+        percent_bad_samples=0.0,
+        percent_other_samples=0.0,
+        numba_samples={"/src/a.py": {1: 40.0, 2: 60.0}},
+        timeline=[
+            {
+                "start": 0.0,
+                "end": 1.0,
+                "total_samples": 10,
+                "percent_numba_samples": 100.0,
+                "top_lines": [["/src/a.py", 2, 60.0], ["/src/a.py", 1, 40.0]],
+            }
+        ],
+    )
+    assert (
+        "| Seconds | Samples | Numba | Hottest lines |\n"
+        "|--------:|--------:|------:|:--------------|\n"
+        "| 0.0–1.0 | 10 | 100.0% | a.py:2 (60.0%), a.py:1 (40.0%) |\n"
+    ) in render_text(final_stats)
+
+
+def test_render_instructions() -> None:
+    """
+    ``render_text()`` shows the disassembly of the hottest lines.
+    """
+    final_stats = FinalStats(
+        total_samples=10,
+        percent_bad_samples=0.0,
+        percent_other_samples=0.0,
+        numba_samples={"scripts_for_tests/simple.py": {12: 100.0}},
+        hot_instructions=[
+            {
+                "file": "scripts_for_tests/simple.py",
+                "line": 12,
+                "percent": 100.0,
+                "instructions": [[0x10, "vmulpd", 0.0], [0x14, "add", 100.0]],
+            }
+        ],
+    )
+    assert (
+        "\n**Instructions for the hottest lines:**\n\n"
+        "scripts_for_tests/simple.py line 12 (100.0%): "
+        "`result[i] = (7 + timeseries[i] / 9 + (timeseries[i] ** 2) / 7) / 5`\n\n"
+        "```\n"
+        "       | 0x10: vmulpd\n"
+        "100.0% | 0x14: add\n"
+        "```\n"
+    ) in render_text(final_stats)
+
+
+def test_render_specializations() -> None:
+    """
+    ``render_text()`` breaks functions with multiple specializations down.
+    """
+    final_stats = FinalStats(
+        total_samples=100,
+        percent_bad_samples=0.0,
+        percent_other_samples=0.0,
+        numba_samples={"scripts_for_tests/simple.py": {12: 100.0}},
+        numba_functions={"simple": {"self": 100.0, "inclusive": 100.0}},
+        numba_specializations={
+            "simple": {
+                "(float64)": {"self": 70.0, "inclusive": 70.0},
+                "(float32)": {"self": 30.0, "inclusive": 30.0},
+            }
+        },
+    )
+    assert (
+        "| Numba function | Self | Inclusive |\n"
+        "|:---|---:|---:|\n"
+        "| `simple` | 100.0% | 100.0% |\n"
+        "| ↳ `simple(float64)` | 70.0% | 70.0% |\n"
+        "| ↳ `simple(float32)` | 30.0% | 30.0% |\n"
+    ) in render_text(final_stats)
+
+
+def make_stats(thread_call_trees: bool = True) -> Stats:
+    """
+    ``Stats`` with a couple of threads and stacks.
+    """
+    stats = Stats(thread_call_trees=thread_call_trees)
+    kernel = Frame(file="/a.py", line=3, func="kernel")
+    caller = Frame(file="/a.py", line=10, func="caller")
+    malloc = Frame(file="", line=0, func="malloc", library="/lib/libc.so.6")
+    stats.add_sample([kernel, caller], 1)
+    stats.add_sample([kernel, caller], 1)
+    stats.add_sample([malloc, caller], 2)
+    stats.add_sample(None, 2)
+    return stats
+
+
+def test_render_collapsed() -> None:
+    """
+    ``render_collapsed()`` renders one line per unique stack, outermost frame
+    first.
+    """
+    assert render_collapsed(make_stats()) == (
+        "caller (/a.py:10);kernel (/a.py:3) 2\ncaller (/a.py:10);malloc [libc.so.6] 1\n"
+    )
+
+
+def test_render_speedscope() -> None:
+    """
+    ``render_speedscope()`` renders a profile per thread.
+    """
+    result = json.loads(render_speedscope(make_stats()))
+    frames = [f["name"] for f in result["shared"]["frames"]]
+    profiles = {p["name"]: p for p in result["profiles"]}
+    assert profiles.keys() == {"Thread 1", "Thread 2"}
+    thread1 = profiles["Thread 1"]
+    assert [[frames[i] for i in s] for s in thread1["samples"]] == [
+        ["caller (/a.py:10)", "kernel (/a.py:3)"]
+    ]
+    assert thread1["weights"] == [2]
+    assert thread1["endValue"] == 2
+    assert profiles["Thread 2"]["weights"] == [1]
+
+    # Without per-thread stacks, all threads share one profile:
+    result = json.loads(render_speedscope(make_stats(thread_call_trees=False)))
+    assert [p["name"] for p in result["profiles"]] == ["All threads"]
+    assert sorted(result["profiles"][0]["weights"]) == [1, 2]
@@ -0,0 +1,134 @@
+"""
+Tests for ``profila._samplelog``.
+"""
+
+from io import StringIO
+from typing import Optional
+
+from hypothesis import given, strategies as st
+import pytest
+
+from profila._gdb import Frame, Instruction, Sample
+from profila._samplelog import SampleLogReader, SampleLogWriter
+from profila._stats import Stats
+from profila.__main__ import load_stats
+
+FRAMES = st.builds(
+    Frame,
+    file=st.sampled_from(["a.py", "b.py", ""]),
+    line=st.integers(min_value=0, max_value=20),
+    func=st.none() | st.sampled_from(["f", "g"]),
+    library=st.none() | st.just("libc.so.6"),
+    address=st.none() | st.integers(min_value=0, max_value=2**64 - 1),
+)
+STACKS: st.SearchStrategy[Optional[list[Frame]]] = st.none() | st.lists(
+    FRAMES, max_size=5
+)
+
+
+def _add_pids(sample: Sample) -> Sample:
+    """
+    Give threads consistent process ids, with thread 4's unknown.
+    """
+    sample.pids = {
+        thread_id: 100 + thread_id // 2
+        for thread_id in [*sample.threads, *sample.off_cpu]
+        if thread_id != 4
+    }
+    return sample
+
+
+SAMPLES = st.lists(
+    st.builds(
+        Sample,
+        threads=st.dictionaries(st.integers(min_value=1, max_value=4), STACKS),
+        stop_time=st.floats(min_value=0, max_value=1),
+        timestamp=st.floats(min_value=0, max_value=1e10),
+        disassembly=st.lists(
+            st.builds(
+                Instruction,
+                address=st.integers(min_value=0, max_value=2**64 - 1),
+                file=st.sampled_from(["a.py", ""]),
+                line=st.integers(min_value=0, max_value=20),
+                func=st.none() | st.just("f"),
+                text=st.text(),
+            ),
+            max_size=3,
+        ),
+        off_cpu=st.lists(st.integers(min_value=5, max_value=6), unique=True),
+    ).map(_add_pids),
+    max_size=20,
+)
+
+
+@given(samples=SAMPLES)
+def test_roundtrip(samples: list[Sample]) -> None:
+    """
+    Samples written to a log are read back unchanged.
+    """
+    f = StringIO()
+    writer = SampleLogWriter(f, {"interval": 0.01})
+    for sample in samples:
+        writer.write(sample)
+
+    f.seek(0)
+    reader = SampleLogReader(f)
+    assert reader.metadata == {"interval": 0.01}
+    assert list(reader) == samples
+
+
+@given(samples=SAMPLES)
+def test_load_stats(samples: list[Sample]) -> None:
+    """
+    ``load_stats()`` gives the same ``Stats`` as adding the samples directly.
+    """
+    f = StringIO()
+    writer = SampleLogWriter(f, {"interval": 0.01})
+    expected = Stats(interval=0.01)
+    for sample in samples:
+        writer.write(sample)
+        expected.add_all_threads(sample)
+
+    f.seek(0)
+    assert load_stats(f) == expected
+
+
+def test_truncated_log() -> None:
+    """
+    A partially written final line, e.g. from a killed profiler, is ignored.
+    """
+    f = StringIO()
+    writer = SampleLogWriter(f, {})
+    sample = Sample(threads={1: [Frame(file="a.py", line=3)]}, timestamp=1.0)
+    writer.write(sample)
+    writer.write(sample)
+    truncated = StringIO(f.getvalue()[:-10])
+    assert list(SampleLogReader(truncated)) == [sample]
+
+
+def test_not_a_log() -> None:
+    """
+    Reading something that isn't a sample log raises ``ValueError``.
+    """
+    with pytest.raises(ValueError):
+        SampleLogReader(StringIO("hello\n"))
+    with pytest.raises(ValueError):
+        SampleLogReader(StringIO('["something", 1, {}]\n'))
+
+
+def test_version_1_log() -> None:
+    """
+    Logs written before addresses were recorded can still be read.
+    """
+    f = StringIO(
+        '["profila-samples", 1, {}]\n'
+        '["F", 0, "a.py", 3, "f", null]\n'
+        '["S", 1.0, 0.001, [[1, [0]]]]\n'
+    )
+    assert list(SampleLogReader(f)) == [
+        Sample(
+            threads={1: [Frame(file="a.py", line=3, func="f")]},
+            stop_time=0.001,
+            timestamp=1.0,
+        )
+    ]
@@ -0,0 +1,23 @@
+"""
+Tests for ``profila._session``.
+"""
+
+import pytest
+
+from profila._session import parse_options
+
+
+def test_parse_options() -> None:
+    """
+    ``parse_options()`` splits valid options, and raises ``ValueError`` for
+    invalid ones.
+    """
+    assert parse_options("--rate 1000  --sampler embedded") == [
+        "--rate",
+        "1000",
+        "--sampler",
+        "embedded",
+    ]
+    assert parse_options("") == []
+    with pytest.raises(ValueError, match="--rate must be positive"):
+        parse_options("--rate 0")
@@ -0,0 +1,62 @@
+"""
+Tests for ``profila._stacks``.
+"""
+
+from collections import Counter
+
+from hypothesis import given, strategies as st
+
+from profila._gdb import Frame
+from profila._stacks import StackTree, frame_key
+
+STACKS = st.lists(
+    st.lists(
+        st.builds(
+            Frame,
+            file=st.sampled_from(["a.py", "b.py", "c.c"]),
+            line=st.integers(min_value=1, max_value=4),
+        ),
+        max_size=6,
+    ),
+    max_size=20,
+)
+
+
+@given(stacks=STACKS)
+def test_stacks_roundtrip(stacks: list[list[Frame]]) -> None:
+    """
+    ``StackTree.stacks()`` gives back the added stacks, outermost first, with
+    their counts.
+    """
+    tree = StackTree()
+    for stack in stacks:
+        tree.add(stack)
+    assert tree.root.total == len(stacks)
+
+    expected = Counter(tuple(frame_key(f) for f in reversed(s)) for s in stacks)
+    actual: Counter[tuple[object, ...]] = Counter()
+    for path, count in tree.stacks():
+        actual[tuple(tree.frames[i] for i in path)] += count
+    assert actual == expected
+    # Frames are interned:
+    assert len(tree.frames) == len(set(tree.frames))
+
+
+@given(stacks=STACKS)
+def test_inclusive_counts(stacks: list[list[Frame]]) -> None:
+    """
+    ``StackTree.inclusive_counts()`` counts each sample once per key in its
+    stack.
+    """
+    tree = StackTree()
+    for stack in stacks:
+        tree.add(stack)
+
+    def by_file(frame: tuple[str, int, object, object]) -> object:
+        return None if frame[0].endswith(".c") else frame[0]
+
+    expected: Counter[object] = Counter()
+    for stack in stacks:
+        for file in {f.file for f in stack if not f.file.endswith(".c")}:
+            expected[file] += 1
+    assert tree.inclusive_counts(by_file) == expected
@@ -2,11 +2,13 @@
 Tests for ``profila._stats``.
 """
 
+from array import array
+import sys
 from typing import Optional
 from hypothesis import given, strategies as st
 
-from profila._stats import Stats
-from profila._gdb import Frame
+from profila._stats import Stats, _add_counts, percent_error, top_lines_error
+from profila._gdb import Frame, Instruction, Sample
 
 import pytest
 
@@ -85,3 +87,480 @@ def test_create_stats(samples: list[Optional[list[Frame]]]) -> None:
             assert (pct / 100) * total == pytest.approx(
                 stats.path_to_line_counts[path][line], 0.01
             )
+
+
+def test_threads_and_idle() -> None:
+    """
+    Stacks from multiple threads are added to combined and per-thread stats,
+    and threads waiting in Numba's threadpool are counted as idle.
+    """
+    wait = Frame(file="", line=0, func="pthread_cond_wait", library="libc.so.6")
+    pool = Frame(
+        file="",
+        line=0,
+        func="queue_state_wait",
+        library="/numba/np/ufunc/workqueue.cpython-311-x86_64-linux-gnu.so",
+    )
+    kernel = Frame(file="a.py", line=3)
+    stats = Stats()
+    stats.add_all_threads(Sample(threads={1: [wait, pool, kernel], 2: [kernel]}))
+    stats.add_all_threads(Sample(threads={1: [kernel], 2: [wait, pool], 3: None}))
+    stats.add_all_threads(Sample(threads={}))
+
+    assert stats.total_samples() == 6
+    assert stats.idle_samples == 2
+    assert stats.bad_samples == 2
+    assert stats.path_to_line_counts == {"a.py": {3: 2}}
+    assert stats.per_thread.keys() == {(0, 1), (0, 2), (0, 3)}
+    assert stats.per_thread[(0, 1)].idle_samples == 1
+    assert stats.per_thread[(0, 2)].numba_samples == 1
+    assert stats.per_thread[(0, 3)].bad_samples == 1
+
+    final_stats = stats.finalize()
+    assert final_stats.percent_idle_samples == 33.3
+    assert final_stats.per_thread[(0, 1)].percent_idle_samples == 50.0
+    assert final_stats.per_thread[(0, 1)].percent_numba_samples() == 50.0
+    assert final_stats.per_thread[(0, 3)].percent_bad_samples == 100.0
+    # Per-thread stacks are only kept when asked for:
+    assert stats.per_thread[(0, 1)].call_tree is None
+
+
+def test_processes() -> None:
+    """
+    Stacks are also added to per-process stats, for threads whose process is
+    known.
+    """
+    kernel = Frame(file="a.py", line=3)
+    other = Frame(file="", line=0, func="poll", library="libc.so.6")
+    stats = Stats()
+    stats.add_all_threads(
+        Sample(threads={1: [other], 2: [kernel], 3: [kernel]}, pids={1: 10, 2: 11})
+    )
+    stats.add_all_threads(
+        Sample(threads={1: [other], 2: [kernel]}, pids={1: 10, 2: 11})
+    )
+
+    assert stats.per_process.keys() == {10, 11}
+    assert stats.per_process[10].other_samples == 2
+    assert stats.per_process[11].numba_samples == 2
+
+    final_stats = stats.finalize()
+    assert final_stats.numba_samples == {"a.py": {3: 60.0}}
+    assert final_stats.per_process[10].percent_other_samples == 100.0
+    assert final_stats.per_process[11].numba_samples == {"a.py": {3: 100.0}}
+
+
+def test_off_cpu() -> None:
+    """
+    With on-CPU sampling, threads that weren't running are counted as
+    off-CPU, separately from the samples, including when the process wasn't
+    interrupted at all.
+    """
+    kernel = Frame(file="a.py", line=3)
+    stats = Stats()
+    stats.add_all_threads(Sample(threads={1: [kernel]}, off_cpu=[2], pids={2: 10}))
+    stats.add_all_threads(Sample(threads={}, off_cpu=[1, 2], pids={2: 10}))
+    stats.add_all_threads(Sample(threads={1: [kernel], 2: [kernel]}, pids={2: 10}))
+
+    assert stats.total_samples() == 3
+    assert stats.bad_samples == 0
+    assert stats.off_cpu_samples == 3
+    assert stats.per_thread[(10, 2)].off_cpu_samples == 2
+    assert stats.per_process[10].off_cpu_samples == 2
+
+    merged = Stats()
+    merged.merge(stats)
+    assert merged.off_cpu_samples == 3
+
+    final_stats = stats.finalize()
+    assert final_stats.numba_samples == {"a.py": {3: 100.0}}
+    assert final_stats.percent_off_cpu == 50.0
+    assert final_stats.per_thread[(0, 1)].percent_off_cpu == 33.3
+    assert final_stats.per_thread[(10, 2)].percent_off_cpu == 66.7
+
+
+def test_off_cpu_timeline() -> None:
+    """
+    A time window where nothing was running has no samples, so it isn't in
+    the timeline.
+    """
+    kernel = Frame(file="a.py", line=3)
+    stats = Stats(bucket_width=1.0)
+    stats.add_all_threads(Sample(threads={1: [kernel]}, timestamp=100.5))
+    stats.add_all_threads(Sample(threads={}, off_cpu=[1], timestamp=101.5))
+    stats.add_all_threads(Sample(threads={}, off_cpu=[1], timestamp=101.7))
+
+    final_stats = stats.finalize()
+    assert final_stats.percent_off_cpu == 66.7
+    assert [window["total_samples"] for window in final_stats.timeline] == [1]
+
+
+def test_merge_concurrent_threads() -> None:
+    """
+    Processes sampled at the same time each have their own gdb, which numbers
+    threads from 1, so merging them keeps threads with the same id apart.
+    """
+    kernel = Frame(file="a.py", line=3)
+    other = Frame(file="", line=0, func="poll", library="libc.so.6")
+    first = Stats()
+    first.add_all_threads(
+        Sample(threads={1: [kernel], 2: [other]}, pids={1: 10, 2: 10})
+    )
+    second = Stats()
+    second.add_all_threads(Sample(threads={1: [other]}, pids={1: 20}))
+
+    merged = Stats()
+    merged.merge(first)
+    merged.merge(second, concurrent=True)
+    assert merged.per_thread.keys() == {(10, 1), (10, 2), (20, 1)}
+    final_stats = merged.finalize()
+    assert final_stats.per_thread[(10, 1)].percent_numba_samples() == 100.0
+    assert final_stats.per_thread[(20, 1)].percent_other_samples == 100.0
+
+
+def test_other_breakdown() -> None:
+    """
+    Non-Numba samples are broken down by the innermost frame in the
+    interpreter, BLAS, or a Python package, skipping system libraries.
+    """
+    numpy = "/env/lib/python3.11/site-packages/numpy/core/_multiarray_umath.so"
+    openblas = "/env/lib/python3.11/site-packages/numpy.libs/libopenblas64_.so"
+    memcpy = Frame(file="", line=0, func="memcpy", library="/lib/libc.so.6")
+    ufunc = Frame(file="", line=0, func="DOUBLE_add", library=numpy)
+    gemm = Frame(file="", line=0, func="dgemm_kernel", library=openblas)
+    eval_frame = Frame(file="", line=0, func="_PyEval_EvalFrameDefault")
+    stats = Stats()
+    stats.add_sample([memcpy, ufunc, eval_frame])
+    stats.add_sample([ufunc, eval_frame])
+    stats.add_sample([gemm, Frame(file="", line=0, func="cblas_dgemm", library=numpy)])
+    stats.add_sample([eval_frame])
+    stats.add_sample([memcpy])
+    stats.add_sample([Frame(file="", line=0, func="f", library="/lib/libfoo.so")])
+    stats.add_sample([])
+    stats.add_sample([Frame(file="a.py", line=3)])
+
+    assert stats.other_counts == {
+        "numpy: DOUBLE_add": 2,
+        "BLAS: dgemm_kernel": 1,
+        "Python interpreter: _PyEval_EvalFrameDefault": 1,
+        "libc.so.6: memcpy": 1,
+        "libfoo.so: f": 1,
+        "unknown": 1,
+    }
+    final_stats = stats.finalize()
+    assert final_stats.percent_other_samples == 87.5
+    assert list(final_stats.other_breakdown.items())[0] == ("numpy: DOUBLE_add", 25.0)
+
+
+def test_stop_time() -> None:
+    """
+    How long the process was stopped is tracked per interruption.
+    """
+    stats = Stats()
+    kernel = Frame(file="a.py", line=3)
+    stats.add_all_threads(Sample(threads={1: [kernel], 2: [kernel]}, stop_time=0.001))
+    stats.add_all_threads(Sample(threads={1: [kernel]}, stop_time=0.004))
+    assert stats.interruptions == 2
+    final_stats = stats.finalize()
+    assert final_stats.mean_stop_ms == 2.5
+    assert final_stats.max_stop_ms == 4.0
+
+
+def test_sampling_rate() -> None:
+    """
+    The achieved sampling rate, duration and overhead are calculated from the
+    samples' timestamps.
+    """
+    stats = Stats(interval=0.01)
+    kernel = Frame(file="a.py", line=3)
+    for i in range(11):
+        stats.add_all_threads(
+            Sample(threads={1: [kernel]}, stop_time=0.001, timestamp=100 + i * 0.02)
+        )
+    final_stats = stats.finalize()
+    assert final_stats.duration == 0.2
+    assert final_stats.requested_rate == 100.0
+    assert final_stats.achieved_rate == 50.0
+    assert final_stats.percent_overhead == 5.5
+
+
+def test_concurrent_merge() -> None:
+    """
+    Merging ``Stats`` from processes sampled at the same time keeps the
+    achieved rate and overhead per process.
+    """
+    kernel = Frame(file="a.py", line=3)
+    merged = Stats(interval=0.01)
+    for process in range(3):
+        stats = Stats(interval=0.01)
+        for i in range(11):
+            stats.add_all_threads(
+                Sample(
+                    threads={1: [kernel]},
+                    stop_time=0.001,
+                    timestamp=100 + i * 0.02 + process * 0.001,
+                )
+            )
+        merged.merge(stats, concurrent=process > 0)
+    final_stats = merged.finalize()
+    assert merged.sampled_processes == 3
+    assert final_stats.total_samples == 33
+    assert final_stats.duration == 0.202
+    assert final_stats.achieved_rate == 49.5
+    assert final_stats.percent_overhead == 5.4
+
+
+def test_margin_of_error() -> None:
+    """
+    Line percentages get a margin of error that shrinks with more samples, and
+    ``top_lines_error()`` reports the widest one of the hottest lines.
+    """
+    assert percent_error(50, 100) == pytest.approx(9.61, abs=0.01)
+    assert percent_error(5000, 10000) == pytest.approx(0.98, abs=0.01)
+    # Even with all samples on one line, a few samples aren't conclusive:
+    assert percent_error(10, 10) > 10
+
+    hot = Frame(file="a.py", line=3)
+    cold = Frame(file="a.py", line=4)
+    other = Frame(file="", line=0, func="poll", library="libc.so.6")
+    stats = Stats()
+    assert top_lines_error([stats]) is None
+    for _ in range(60):
+        stats.add_sample([hot])
+    for _ in range(40):
+        stats.add_sample([cold])
+    second = Stats()
+    for _ in range(100):
+        second.add_sample([other])
+    assert top_lines_error([stats]) == percent_error(60, 100)
+    assert top_lines_error([stats], 1) == percent_error(60, 100)
+    assert top_lines_error([stats, second]) == percent_error(60, 200)
+    assert stats.finalize().numba_sample_errors == {
+        "a.py": {
+            3: round(percent_error(60, 100), 1),
+            4: round(percent_error(40, 100), 1),
+        }
+    }
+
+
+def test_inclusive_and_functions() -> None:
+    """
+    Callers of Numba functions get inclusive time, and time is broken down by
+    Numba function.
+    """
+    helper = Frame(file="a.py", line=3, func="helper")
+    caller = Frame(file="a.py", line=10, func="kernel")
+    other_caller = Frame(file="a.py", line=12, func="kernel")
+    stats = Stats()
+    stats.add_sample([helper, caller])
+    stats.add_sample([helper, other_caller])
+    stats.add_sample([other_caller])
+    stats.add_sample([Frame(file="", line=0, func="malloc"), helper, caller])
+
+    final_stats = stats.finalize()
+    assert final_stats.numba_samples == {"a.py": {3: 75.0, 12: 25.0}}
+    assert final_stats.inclusive_numba_samples == {
+        "a.py": {3: 75.0, 10: 50.0, 12: 50.0}
+    }
+    assert final_stats.numba_functions == {
+        "kernel": {"self": 25.0, "inclusive": 100.0},
+        "helper": {"self": 75.0, "inclusive": 75.0},
+    }
+
+
+@given(
+    samples=st.lists(
+        st.builds(
+            Sample,
+            threads=st.dictionaries(
+                st.integers(min_value=1, max_value=3),
+                st.none()
+                | st.lists(
+                    st.builds(
+                        Frame,
+                        file=st.sampled_from(["a.py", "b.py", "file.c"]),
+                        line=st.integers(min_value=1, max_value=300),
+                        func=st.none() | st.sampled_from(["f", "g"]),
+                    ),
+                    max_size=5,
+                ),
+            ),
+            stop_time=st.sampled_from([0.0, 0.125, 0.5]),
+        ),
+        max_size=20,
+    ),
+    split=st.integers(min_value=0, max_value=20),
+)
+def test_merge(samples: list[Sample], split: int) -> None:
+    """
+    Merging ``Stats`` gives the same result as adding all the samples to one.
+    """
+    for i, sample in enumerate(samples):
+        sample.timestamp = float(i)
+    expected = Stats(interval=0.01, bucket_width=3.0)
+    for sample in samples:
+        expected.add_all_threads(sample)
+
+    first = Stats(interval=0.01, bucket_width=3.0)
+    for sample in samples[:split]:
+        first.add_all_threads(sample)
+    second = Stats(bucket_width=3.0)
+    for sample in samples[split:]:
+        second.add_all_threads(sample)
+    first.merge(second)
+
+    assert first == expected
+    assert first.total_samples() == expected.total_samples()
+    assert first.finalize() == expected.finalize()
+
+
+@pytest.mark.parametrize("numpy", [True, False])
+def test_add_counts(monkeypatch: pytest.MonkeyPatch, numpy: bool) -> None:
+    """
+    ``_add_counts()`` adds counts in place, growing the target as needed, with
+    or without NumPy.
+    """
+    if not numpy:
+        monkeypatch.setitem(sys.modules, "numpy", None)
+    target = array("Q", [1, 0, 2])
+    _add_counts(target, array("Q", [0, 5, 1, 0, 7]))
+    assert target == array("Q", [1, 5, 3, 0, 7])
+    _add_counts(target, array("Q"))
+    assert target == array("Q", [1, 5, 3, 0, 7])
+    # The target can still grow afterwards:
+    target.append(1)
+
+
+def test_merge_file_ids() -> None:
+    """
+    Per-thread line counts are merged by filename, even if files were
+    interned in a different order.
+    """
+    a = [Frame(file="a.py", line=1)]
+    b = [Frame(file="b.py", line=2)]
+    first = Stats()
+    first.add_sample(a, 1)
+    second = Stats()
+    second.add_sample(b, 1)
+    second.add_sample(a, 1)
+    first.merge(second)
+    assert first.finalize().per_thread[(0, 1)].numba_samples == {
+        "a.py": {1: 66.7},
+        "b.py": {2: 33.3},
+    }
+
+
+def test_timeline() -> None:
+    """
+    With a bucket width, ``Stats`` reports the hottest lines per time window,
+    keeping only the most recent windows.
+    """
+    stats = Stats(bucket_width=1.0, max_buckets=2)
+    warmup = [Frame(file="a.py", line=1)]
+    steady = [Frame(file="a.py", line=2)]
+    other = [Frame(file="file.c", line=3)]
+    for timestamp, stack in [
+        # This window gets evicted:
+        (100.5, other),
+        (101.0, warmup),
+        (101.5, other),
+        (102.0, steady),
+        (102.2, steady),
+        (102.4, warmup),
+        (102.6, steady),
+    ]:
+        stats.add_all_threads(Sample(threads={1: stack}, timestamp=timestamp))
+
+    timeline = stats.finalize().timeline
+    assert timeline == [
+        {
+            "start": 0.5,
+            "end": 1.5,
+            "total_samples": 2,
+            "percent_numba_samples": 50.0,
+            "top_lines": [["a.py", 1, 50.0]],
+        },
+        {
+            "start": 1.5,
+            "end": 2.5,
+            "total_samples": 4,
+            "percent_numba_samples": 100.0,
+            "top_lines": [["a.py", 2, 75.0], ["a.py", 1, 25.0]],
+        },
+    ]
+    # The whole run is still included in the overall stats:
+    assert stats.total_samples() == 7
+
+
+def test_hot_instructions() -> None:
+    """
+    Samples with instruction addresses are shown against the disassembly of
+    the hottest lines.
+    """
+    stats = Stats()
+    stats.add_all_threads(
+        Sample(
+            threads={1: [Frame(file="a.py", line=3, func="f", address=0x10)]},
+            disassembly=[
+                Instruction(0x10, "a.py", 3, "f", "vmulpd %ymm1,%ymm0,%ymm0"),
+                Instruction(0x14, "a.py", 3, "f", "add $0x20,%rax"),
+                Instruction(0x18, "a.py", 4, "f", "ret"),
+            ],
+        )
+    )
+    for address in [0x14, 0x14, 0x18]:
+        stats.add_all_threads(
+            Sample(threads={1: [Frame(file="a.py", line=3, address=address)]})
+        )
+    # Lines without samples are left out:
+    assert stats.finalize().hot_instructions == [
+        {
+            "file": "a.py",
+            "line": 3,
+            "percent": 100.0,
+            "instructions": [
+                [0x10, "vmulpd %ymm1,%ymm0,%ymm0", 25.0],
+                [0x14, "add $0x20,%rax", 50.0],
+            ],
+        }
+    ]
+
+
+def test_specializations() -> None:
+    """
+    Time is broken down by compiled specialization, as well as by function.
+    """
+    float32 = Frame(
+        file="a.py",
+        line=3,
+        func="__main__::kernel[abi:v1][abi:c8tJTIeFIjxB2IKSgI4CrvQClQZ6FczSBAA_3d]"
+        "(Array<float, 1, C, mutable, aligned>)",
+    )
+    float64 = Frame(
+        file="a.py",
+        line=3,
+        func="__main__::kernel[abi:v2][abi:c8tJTIeFIjxB2IKSgI4CrvQClQZ6FczSBAA_3d]"
+        "(Array<double, 1, C, mutable, aligned>)",
+    )
+    stats = Stats()
+    stats.add_sample([float32])
+    stats.add_sample([float64])
+    stats.add_sample([float64])
+    stats.add_sample([float64])
+
+    final_stats = stats.finalize()
+    assert final_stats.numba_functions == {
+        "__main__.kernel": {"self": 100.0, "inclusive": 100.0},
+    }
+    assert final_stats.numba_specializations == {
+        "__main__.kernel": {
+            "(Array<double, 1, C, mutable, aligned>)": {
+                "self": 75.0,
+                "inclusive": 75.0,
+            },
+            "(Array<float, 1, C, mutable, aligned>)": {
+                "self": 25.0,
+                "inclusive": 25.0,
+            },
+        }
+    }